@@ -1,21 +1,37 @@
 # agent_brain.py - LançAI: Agente de Query e Validação Contábil (CORRIGIDO PARA COTA)
 
+import asyncio
+import hashlib
+import math
+import logging
+import re
+import unicodedata
+import numpy as np
 import pandas as pd
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
-from dotenv import load_dotenv
 import os
+from typing import Any, Dict, Optional, Callable, Iterator, List, Tuple
+from prompt_builder import build_agent_prompt, build_statistics_section, estimate_tokens, is_lancamentos_frame, partition_dataframe, PROMPT_TOKEN_BUDGET, CHARS_PER_TOKEN
+from rules_engine import UNMAPPED_ACCOUNT
+from compact_dtypes import expand_lancamentos
+from llm_cache import response_cache, dataframe_fingerprint, make_cache_key
+from llm_client import get_llm_client, llm_model_name
+from metrics import metrics
+from row_index import select_relevant_rows, strip_exact_filters, tokenize
+from sql_query import SQL_MAX_ROWS, SQLQueryError, describe_table, extract_sql, run_query, sql_engine_name
 
-# Carrega a chave da API
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY") 
+# O LLM é criado sob demanda pelo cliente compartilhado (backend em LANCAI_LLM_BACKEND):
+# importar este módulo não carrega o LangChain nem exige a chave da API.
+LLM_MODEL_NAME = llm_model_name()
 
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY não encontrada. Verifique seu arquivo .env.")
+logger = logging.getLogger(__name__)
 
-# Inicialização do LLM
-# CORREÇÃO: gemini-2.5-pro alterado para gemini-2.5-flash. Maior cota e velocidade.
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.0)
+# Modo map-reduce (análise em partes para DataFrames que não cabem em um prompt)
+MAP_REDUCE_CHUNK_ROWS = int(os.getenv("LANCAI_MAP_REDUCE_CHUNK_ROWS", "20000"))
+MAP_REDUCE_CONCURRENCY = int(os.getenv("LANCAI_MAP_REDUCE_CONCURRENCY", "4"))
+# Limite de partes por análise (o tamanho das partes aumenta para respeitá-lo)
+MAP_REDUCE_MAX_CHUNKS = int(os.getenv("LANCAI_MAP_REDUCE_MAX_CHUNKS", "50"))
+# Níveis de consolidação intermediária; no último, as respostas parciais são cortadas para caber em um prompt
+MAP_REDUCE_MAX_LEVELS = max(0, int(os.getenv("LANCAI_MAP_REDUCE_MAX_LEVELS", "3")))
 
 # --- SISTEMA DE PROMPT DO AGENTE LançAI (MAIS FLEXÍVEL) ---
 SYSTEM_PROMPT_LANCAI = """
@@ -27,39 +43,570 @@ INSTRUÇÕES:
 2. **PRIORIDADE 1 (Validação de Mapeamento):** Se a tarefa for a "análise inicial", sua prioridade é verificar a coluna 'Conta_Debito' ou 'Conta_Credito' por valores como 'Regra Não Mapeada'.
     * Se encontrar, liste as chaves de NF-e e CFOPs não mapeados e sugira a inclusão da regra.
 3. **PRIORIDADE 2 (Perguntas Humanas):** Se a tarefa for uma pergunta específica (ex: 'valor total', 'nova tributação'), use sua capacidade de raciocínio sobre o DataFrame para responder.
-    * Para **perguntas quantitativas** (Ex: 'valor total'), **utilize os dados do DataFrame para calcular a resposta**. Use a coluna 'Valor_Lancamento'.
+    * Para **perguntas quantitativas** (Ex: 'valor total'), **utilize as estatísticas pré-calculadas**, que cobrem TODAS as linhas. Use a coluna 'Valor_Lancamento'. As linhas brutas podem ser apenas uma amostra.
     * Para **perguntas de compliance** (Ex: 'nova tributação'), use seu conhecimento fiscal e o contexto dos lançamentos para fornecer uma análise informada e um aviso de que a validação final é responsabilidade do Contador.
 
-O DataFrame a ser analisado está no formato Markdown a seguir. Sua resposta deve ser baseada nos dados e no prompt:
+O DataFrame a ser analisado é descrito a seguir (esquema, estatísticas pré-calculadas e linhas em CSV). Sua resposta deve ser baseada nos dados e no prompt:
 """
 
-def generate_accounting_summary_and_answer(df_lancamentos: pd.DataFrame, user_question: str) -> str:
-    """Invoca o LLM para analisar o DataFrame de lançamentos e responder à pergunta do usuário."""
+# Tarefa da análise inicial (auditoria de mapeamentos), usada pela interface e pela linha de comando
+INITIAL_AUDIT_TASK = "Faça a análise inicial do DataFrame. Forneça o resumo e a auditoria de mapeamentos (Regra Não Mapeada)."
+# Início das mensagens de erro devolvidas no lugar da resposta (chamadores sem interface detectam a falha por ele)
+LLM_ERROR_PREFIX = "Erro ao gerar a análise contábil pelo Agente LançAI."
+
+# Versão do prompt: faz parte da chave do cache de respostas (altere ao mudar o prompt ou o prompt_builder)
+PROMPT_VERSION = "3-" + hashlib.sha256(SYSTEM_PROMPT_LANCAI.encode('utf-8')).hexdigest()[:8]
+
+def _cache_key_for(df_lancamentos: pd.DataFrame, user_question: str, use_cache: bool) -> Optional[str]:
+    """Chave do cache de respostas (None quando o cache está desativado)."""
+    if not use_cache or not response_cache.enabled:
+        return None
+    return make_cache_key(dataframe_fingerprint(df_lancamentos), user_question, LLM_MODEL_NAME, PROMPT_VERSION)
+
+
+def _build_prompt(df_lancamentos: pd.DataFrame, user_question: str) -> str:
+    """
+    Monta o prompt dentro do orçamento de tokens (esquema + estatísticas + linhas que couberem).
+    Perguntas sobre um emitente, nota, CFOP ou conta levam só as linhas relacionadas (row_index);
+    a análise inicial é uma visão geral e sempre usa o DataFrame inteiro.
+    """
+    with metrics.timer('prompt_build', rows=len(df_lancamentos)) as details:
+        retrieval = select_relevant_rows(df_lancamentos, user_question) if user_question != INITIAL_AUDIT_TASK else None
+        prompt_data = build_agent_prompt(df_lancamentos, user_question, SYSTEM_PROMPT_LANCAI, retrieval=retrieval)
+        details['prompt_tokens'] = prompt_data['token_usage']['total']
+    metrics.observe('prompt_tokens_estimated', prompt_data['token_usage']['total'])
+    logger.info(
+        "Prompt LançAI: %s tokens estimados por seção; %d de %d linhas incluídas.",
+        prompt_data['token_usage'], prompt_data['rows_included'], prompt_data['rows_total']
+    )
+    return prompt_data['prompt']
+
+
+def _llm_error_message(e: Exception) -> str:
+    # Melhor feedback para o erro de cota
+    if "ResourceExhausted" in str(e):
+        return f"{LLM_ERROR_PREFIX} Detalhes: **Cota de API Excedida (ResourceExhausted)**. Verifique seu plano e os limites de uso no Google AI Studio."
+    return f"{LLM_ERROR_PREFIX} Detalhes: {type(e).__name__}. Verifique a API Key."
+
+
+@metrics.timed('generate_accounting_summary_and_answer')
+def generate_accounting_summary_and_answer(df_lancamentos: pd.DataFrame, user_question: str, use_cache: bool = True) -> str:
+    """
+    Invoca o LLM para analisar o DataFrame de lançamentos e responder à pergunta do usuário.
+    Respostas bem-sucedidas ficam no cache persistente (mesmos dados + mesma pergunta = sem nova chamada).
+    """
     
     if df_lancamentos is None or df_lancamentos.empty:
         return "Não há dados de lançamentos contábeis para analisar."
-    
-    # 1. Converte o DF para Markdown para enviar ao LLM
-    df_markdown = df_lancamentos.to_markdown(index=False)
-
-    # 2. Cria o prompt combinando o sistema, o DF e a pergunta do usuário
-    full_prompt = (
-        SYSTEM_PROMPT_LANCAI + 
-        f"\n\n--- INÍCIO DO DATAFRAME ---\n{df_markdown}\n--- FIM DO DATAFRAME ---\n\n" +
-        f"PERGUNTA/TAREFA DO USUÁRIO: {user_question}"
-    )
-    
-    prompt_template = ChatPromptTemplate.from_messages([
-        ("human", full_prompt)
-    ])
-    
+
+    cache_key = _cache_key_for(df_lancamentos, user_question, use_cache)
+    if cache_key is not None:
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            logger.info("Resposta do LLM servida pelo cache.")
+            return cached_response
+
     try:
-        chain = prompt_template | llm
-        response = chain.invoke({})
-        return response.content
+        # Chamada pelo cliente compartilhado: limite de requisições/tokens por minuto,
+        # concorrência máxima e novas tentativas em erros de cota ou transitórios
+        response_text = get_llm_client().invoke(_build_prompt(df_lancamentos, user_question))
+        # Apenas respostas válidas entram no cache (erros sempre geram nova tentativa)
+        if cache_key is not None and response_text:
+            response_cache.set(cache_key, response_text)
+        return response_text
 
     except Exception as e:
-        # Melhor feedback para o erro de cota
-        if "ResourceExhausted" in str(e):
-             return "Erro ao gerar a análise contábil pelo Agente LançAI. Detalhes: **Cota de API Excedida (ResourceExhausted)**. Verifique seu plano e os limites de uso no Google AI Studio."
-        return f"Erro ao gerar a análise contábil pelo Agente LançAI. Detalhes: {type(e).__name__}. Verifique a API Key."
\ No newline at end of file
+        return _llm_error_message(e)
+
+
+def stream_accounting_summary_and_answer(df_lancamentos: pd.DataFrame, user_question: str, use_cache: bool = True) -> Iterator[str]:
+    """
+    Versão em streaming de generate_accounting_summary_and_answer: devolve os trechos da
+    resposta à medida que o LLM os gera (para uso com st.write_stream).
+    Respostas em cache saem de uma vez; a resposta completa só entra no cache se o streaming terminar sem erro.
+    """
+    if df_lancamentos is None or df_lancamentos.empty:
+        yield "Não há dados de lançamentos contábeis para analisar."
+        return
+
+    cache_key = _cache_key_for(df_lancamentos, user_question, use_cache)
+    if cache_key is not None:
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            logger.info("Resposta do LLM servida pelo cache.")
+            yield cached_response
+            return
+
+    chunks: List[str] = []
+    try:
+        for chunk in get_llm_client().stream(_build_prompt(df_lancamentos, user_question)):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        # Se parte da resposta já foi exibida, o erro aparece logo abaixo dela
+        yield ("\n\n" if chunks else "") + _llm_error_message(e)
+        return
+
+    if cache_key is not None and chunks:
+        response_cache.set(cache_key, ''.join(chunks))
+
+
+# --------------------------------------------------------------------------------
+# --- MODO MAP-REDUCE (ANÁLISE EM PARTES) ---
+# --------------------------------------------------------------------------------
+
+MAP_SYSTEM_PROMPT_LANCAI = SYSTEM_PROMPT_LANCAI + """
+ATENÇÃO: você está analisando apenas UMA PARTE dos lançamentos ({parte}).
+Responda à pergunta considerando somente esta parte, de forma objetiva e com os números relevantes
+(quantidades, valores, CFOPs, contas e chaves de NF-e citadas). Sua resposta será consolidada com a das demais partes.
+"""
+
+REDUCE_SYSTEM_PROMPT_LANCAI = """
+Você é o Agente de Análise Contábil LançAI, especializado em Contabilidade e Fiscal para a Indústria Metalúrgica.
+Os lançamentos foram analisados em partes. Abaixo estão as estatísticas de TODAS as linhas e as respostas parciais de cada parte.
+Consolide as respostas parciais em uma única resposta à pergunta do usuário:
+1. **SEMPRE** comece com um resumo conciso do que foi analisado.
+2. Some ou combine os números das partes quando fizer sentido e confira-os com as estatísticas gerais (que são exatas).
+3. Não repita a mesma constatação para cada parte; agrupe-as.
+"""
+
+
+async def _map_chunks(prompts: List[str], max_concurrency: int) -> List[Any]:
+    """Executa as análises das partes em paralelo (no máximo max_concurrency por vez)."""
+    client = get_llm_client()
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(prompt: str) -> str:
+        async with semaphore:
+            return await client.ainvoke(prompt)
+
+    return await asyncio.gather(*(run(prompt) for prompt in prompts), return_exceptions=True)
+
+
+def _truncate_partial(text: str, max_tokens: int) -> str:
+    """Corta uma resposta parcial no limite de tokens (estimado), avisando o corte."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    marker = "\n[... resposta parcial cortada para caber no prompt de consolidação]"
+    return text[:max(0, max_chars - len(marker))] + marker
+
+
+def _reduce_partials(partials: List[str], user_question: str, global_stats: str, token_budget: int) -> str:
+    """
+    Consolida as respostas parciais. Se não couberem em um único prompt, são consolidadas
+    em níveis (grupos de ao menos duas respostas parciais viram novas respostas parciais, então
+    cada nível ao menos reduz pela metade a quantidade). Após MAP_REDUCE_MAX_LEVELS níveis, as
+    respostas restantes são cortadas para caber em uma única consolidação.
+    """
+    client = get_llm_client()
+    header = f"{REDUCE_SYSTEM_PROMPT_LANCAI}\n--- ESTATÍSTICAS PRÉ-CALCULADAS (TODAS AS LINHAS) ---\n{global_stats}"
+    question_text = f"PERGUNTA/TAREFA DO USUÁRIO: {user_question}"
+    available = max(1, token_budget - estimate_tokens(header) - estimate_tokens(question_text))
+
+    def prompt_for(group: List[str]) -> str:
+        # Grupos que estouram o orçamento (respostas parciais muito longas) têm cada resposta cortada
+        if sum(estimate_tokens(partial) for partial in group) > available:
+            per_partial = max(1, available // len(group))
+            group = [_truncate_partial(partial, per_partial) for partial in group]
+        return "\n\n".join([header, "--- RESPOSTAS PARCIAIS ---", *group, question_text])
+
+    for level in range(MAP_REDUCE_MAX_LEVELS + 1):
+        if level == MAP_REDUCE_MAX_LEVELS:
+            logger.warning(
+                "Map-reduce LançAI: %d respostas parciais após %d níveis de consolidação; cortando-as para caber no prompt.",
+                len(partials), level
+            )
+            return client.invoke(prompt_for(partials))
+
+        groups: List[List[str]] = [[]]
+        used = 0
+        for partial in partials:
+            size = estimate_tokens(partial)
+            # Um grupo só é fechado com ao menos duas respostas (garante o progresso a cada nível)
+            if len(groups[-1]) >= 2 and used + size > available:
+                groups.append([])
+                used = 0
+            groups[-1].append(partial)
+            used += size
+
+        if len(groups) == 1:
+            return client.invoke(prompt_for(groups[0]))
+        # Mais de um grupo: cada grupo vira uma resposta parcial do próximo nível
+        logger.info("Map-reduce LançAI: consolidação intermediária de %d respostas em %d grupos.", len(partials), len(groups))
+        results = asyncio.run(_map_chunks([prompt_for(group) for group in groups], MAP_REDUCE_CONCURRENCY))
+        failures = [r for r in results if isinstance(r, Exception)]
+        if failures:
+            raise failures[0]
+        partials = [f"### Consolidação parcial {i + 1}\n{text}" for i, text in enumerate(results)]
+
+
+@metrics.timed('generate_map_reduce_answer')
+def generate_map_reduce_answer(
+    df_lancamentos: pd.DataFrame,
+    user_question: str,
+    partition_by: str = 'cfop',
+    chunk_rows: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    use_cache: bool = True
+) -> str:
+    """
+    Analisa DataFrames grandes em partes (map) e consolida as respostas (reduce).
+    partition_by: 'cfop', 'emissor' ou 'linhas'. Cada parte recebe um prompt próprio com
+    estatísticas exatas da parte; a consolidação recebe as estatísticas de todas as linhas.
+    """
+    if df_lancamentos is None or df_lancamentos.empty:
+        return "Não há dados de lançamentos contábeis para analisar."
+
+    chunk_rows = chunk_rows or MAP_REDUCE_CHUNK_ROWS
+    chunk_rows = max(chunk_rows, math.ceil(len(df_lancamentos) / max(1, MAP_REDUCE_MAX_CHUNKS)))
+    max_concurrency = max_concurrency or MAP_REDUCE_CONCURRENCY
+
+    cache_key = None
+    if use_cache and response_cache.enabled:
+        cache_key = make_cache_key(
+            dataframe_fingerprint(df_lancamentos), user_question, LLM_MODEL_NAME,
+            f"{PROMPT_VERSION}|map-reduce:{partition_by}:{chunk_rows}"
+        )
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            logger.info("Resposta do LLM (map-reduce) servida pelo cache.")
+            return cached_response
+
+    try:
+        token_budget = PROMPT_TOKEN_BUDGET
+        with metrics.timer('prompt_build_map_reduce', rows=len(df_lancamentos)) as details:
+            chunks = partition_dataframe(df_lancamentos, partition_by, chunk_rows)
+            prompts = [
+                build_agent_prompt(chunk, user_question, MAP_SYSTEM_PROMPT_LANCAI.replace("{parte}", f"parte {i + 1} de {len(chunks)}: {label}"), token_budget)['prompt']
+                for i, (label, chunk) in enumerate(chunks)
+            ]
+            details['parts'] = len(chunks)
+        logger.info("Map-reduce LançAI: %d linhas em %d partes (por %s), até %d chamadas simultâneas.",
+                    len(df_lancamentos), len(chunks), partition_by, max_concurrency)
+
+        # 1. Map: análise de cada parte em paralelo
+        results = asyncio.run(_map_chunks(prompts, max_concurrency))
+        partials, failed = [], []
+        for i, ((label, chunk), result) in enumerate(zip(chunks, results)):
+            if isinstance(result, Exception):
+                logger.warning("Map-reduce LançAI: parte %d falhou (%s).", i + 1, type(result).__name__)
+                failed.append(result)
+                partials.append(f"### Parte {i + 1} ({label}, {len(chunk)} linhas)\nAnálise indisponível para esta parte.")
+            else:
+                partials.append(f"### Parte {i + 1} ({label}, {len(chunk)} linhas)\n{result}")
+        if len(failed) == len(results):
+            raise failed[0]
+
+        # 2. Reduce: consolidação das respostas parciais com as estatísticas gerais
+        global_stats = build_statistics_section(df_lancamentos, max_groups=10)
+        response_text = _reduce_partials(partials, user_question, global_stats, token_budget)
+        # Respostas com partes indisponíveis não entram no cache
+        if cache_key is not None and response_text and not failed:
+            response_cache.set(cache_key, response_text)
+        return response_text
+
+    except Exception as e:
+        return _llm_error_message(e)
+
+
+# --------------------------------------------------------------------------------
+# --- MODO CONSULTA SQL (O AGENTE VÊ SÓ O ESQUEMA; A CONSULTA RODA LOCALMENTE) ---
+# --------------------------------------------------------------------------------
+
+SQL_SYSTEM_PROMPT_LANCAI = """
+Você é o Agente de Análise Contábil LançAI, especializado em Contabilidade, Fiscal e SQL.
+Os dados NÃO estão neste prompt: eles estão na tabela "dados" de um banco {motor} local, descrita abaixo (esquema e algumas linhas de exemplo).
+Escreva UMA consulta SQL de leitura (SELECT ou WITH ... SELECT) que responda à pergunta do usuário considerando TODAS as linhas:
+1. Use somente a tabela "dados" e as colunas listadas, sempre com o nome entre aspas duplas.
+2. Prefira agregações (SUM, COUNT, AVG, GROUP BY) e ORDER BY com LIMIT a listar linhas soltas: o resultado é cortado em {max_linhas} linhas.
+3. Nos lançamentos, o valor em reais está em "Valor_Lancamento" e as contas sem regra têm o texto 'Regra Não Mapeada'.
+4. Responda APENAS com a consulta, em um bloco ```sql```, sem explicações.
+"""
+
+SQL_ANSWER_PROMPT_LANCAI = """
+Você é o Agente de Análise Contábil LançAI, especializado em Contabilidade e Fiscal para a Indústria Metalúrgica.
+A pergunta do usuário foi respondida por uma consulta SQL executada localmente sobre TODAS as linhas; o resultado abaixo é exato.
+1. **SEMPRE** comece com um resumo conciso do que foi consultado.
+2. Responda à pergunta usando apenas os números do resultado (não estime nem invente valores) e formate valores em reais (R$).
+3. Se o resultado foi cortado, avise que apenas as primeiras linhas foram consideradas.
+"""
+
+# Tentativas de gerar a consulta (a segunda recebe o erro da primeira para corrigi-la)
+SQL_MAX_ATTEMPTS = 2
+SQL_PROMPT_VERSION = "1-" + hashlib.sha256(SQL_SYSTEM_PROMPT_LANCAI.encode('utf-8')).hexdigest()[:8]
+
+
+def _sql_generation_prompt(schema: str, user_question: str, previous: Optional[Tuple[str, str]] = None) -> str:
+    header = SQL_SYSTEM_PROMPT_LANCAI.replace("{motor}", sql_engine_name()).replace("{max_linhas}", str(SQL_MAX_ROWS))
+    sections = [header, "--- TABELA ---", schema]
+    if previous is not None:
+        sections += ["--- TENTATIVA ANTERIOR (CORRIJA) ---", f"```sql\n{previous[0]}\n```\nErro: {previous[1]}"]
+    sections.append(f"PERGUNTA/TAREFA DO USUÁRIO: {user_question}")
+    return "\n\n".join(sections)
+
+
+@metrics.timed('answer_with_sql')
+def answer_with_sql(df: pd.DataFrame, user_question: str, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Modo consulta SQL: o Agente recebe só o esquema e algumas linhas de exemplo (prompt de tamanho
+    constante, qualquer que seja o número de linhas) e devolve uma consulta, executada localmente
+    em modo somente leitura (sql_query.run_query). Retorna o resultado de run_query mais 'error'
+    (None em caso de sucesso). Consultas que funcionaram ficam no cache de respostas.
+    """
+    if df is None or df.empty:
+        return {'sql': None, 'error': "Não há dados para consultar."}
+
+    cache_key = None
+    if use_cache and response_cache.enabled:
+        cache_key = make_cache_key(dataframe_fingerprint(df), user_question, LLM_MODEL_NAME, f"{SQL_PROMPT_VERSION}|sql")
+        cached_sql = response_cache.get(cache_key)
+        if cached_sql is not None:
+            try:
+                logger.info("Consulta SQL servida pelo cache.")
+                return {**run_query(df, cached_sql), 'error': None}
+            except SQLQueryError as e:
+                logger.info("Consulta SQL do cache falhou (%s); gerando outra.", e)
+
+    with metrics.timer('prompt_build_sql', rows=len(df)) as details:
+        schema = describe_table(df)
+        details['prompt_tokens'] = estimate_tokens(schema)
+    previous: Optional[Tuple[str, str]] = None
+    for attempt in range(SQL_MAX_ATTEMPTS):
+        try:
+            sql = extract_sql(get_llm_client().invoke(_sql_generation_prompt(schema, user_question, previous)))
+        except Exception as e:
+            return {'sql': None, 'error': _llm_error_message(e)}
+        try:
+            query = run_query(df, sql)
+        except SQLQueryError as e:
+            logger.info("Consulta SQL recusada ou com erro (tentativa %d de %d): %s", attempt + 1, SQL_MAX_ATTEMPTS, e)
+            previous = (sql, str(e))
+            continue
+        if cache_key is not None:
+            response_cache.set(cache_key, query['sql'])
+        return {**query, 'error': None}
+
+    return {'sql': previous[0] if previous else None, 'error': f"Não foi possível gerar uma consulta SQL válida. Detalhes: {previous[1] if previous else ''}"}
+
+
+def stream_sql_answer_summary(user_question: str, query: Dict[str, Any]) -> Iterator[str]:
+    """Resumo em linguagem natural do resultado de answer_with_sql (em streaming, para st.write_stream)."""
+    result = query['result']
+    result_text = result.to_csv(index=False).strip() if not result.empty else "(nenhuma linha)"
+    if query['truncated']:
+        result_text += f"\n(resultado cortado nas primeiras {len(result)} linhas)"
+    prompt = "\n\n".join([
+        SQL_ANSWER_PROMPT_LANCAI,
+        f"--- CONSULTA EXECUTADA ---\n```sql\n{query['sql']}\n```",
+        f"--- RESULTADO (CSV) ---\n{result_text}",
+        f"PERGUNTA/TAREFA DO USUÁRIO: {user_question}",
+    ])
+    chunks: List[str] = []
+    try:
+        for chunk in get_llm_client().stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        yield ("\n\n" if chunks else "") + _llm_error_message(e)
+
+
+# --------------------------------------------------------------------------------
+# --- RESPOSTAS LOCAIS (SEM LLM) PARA PERGUNTAS QUANTITATIVAS ---
+# --------------------------------------------------------------------------------
+
+# Perguntas com estes termos pedem interpretação ou um recorte (tributo, situação, mês, faixa de
+# valor) que as respostas locais não aplicam: seguem sempre para o LLM
+_LLM_ONLY_TERMS = re.compile(
+    r'\b(por que|porque|explique|justifique|impacto|tributac|imposto|aliquota|compliance|legislac|risco|sugira|sugestao|recomend|deveria'
+    r'|(?:icms|ipi|pis|cofins)\b|cancelad'
+    r'|(?:janeiro|fevereiro|marco|abril|maio|junho|julho|agosto|setembro|outubro|novembro|dezembro)\b'
+    r'|acima|abaixo|maior que|menor que|superior|inferior)'
+)
+# Palavras que não restringem a pergunta; qualquer outro termo que sobre além da intenção
+# (ex.: "vendas", "2024", o nome de um emitente) faz a pergunta seguir para o LLM
+_LOCAL_FILLER = frozenset(
+    "valor valores total totais geral soma somam somatorio lancamento lancamentos nota notas nfe nf fiscal fiscais "
+    "linha linhas registro registros chave chaves acesso existem existe temos estao esta foram todos todas todo toda "
+    "carregado carregados carregada carregadas dados arquivo planilha base dataframe me mostre mostra liste lista "
+    "listar exiba quais qual agrupado agrupados agrupada agrupadas cada regra regras mapeado mapeados mapeada mapeadas".split()
+)
+_GROUP_COLUMNS = {
+    'cfop': ('CFOP_Principal', 'CFOP'),
+    'emissor': ('Emissor', 'Emissor'),
+    'emitente': ('Emissor', 'Emissor'),
+    'fornecedor': ('Emissor', 'Emissor'),
+    'conta de credito': ('Conta_Credito', 'Conta de Crédito'),
+    'conta credito': ('Conta_Credito', 'Conta de Crédito'),
+    'conta de debito': ('Conta_Debito', 'Conta de Débito'),
+    'conta debito': ('Conta_Debito', 'Conta de Débito'),
+    'conta': ('Conta_Debito', 'Conta de Débito'),
+}
+# Perguntas que citam um emitente, nota, CFOP ou conta específicos: o total/contagem geral não as responde
+_SCOPED_ENTITY = re.compile(
+    r'\b(?:cfop|nf-?e|nota fiscal|nota|chave(?: de acesso)?)\s+(?:n[o.]?\s*)?[\w.-]*\d'
+    r'|\b(?:fornecedor|emissor|emitente|cliente|conta|empresa)\s+'
+    r'(?!(?:e|ou|de|do|da|com|sem|por|que|nao|mais|menos|debito|credito|mapead\w*)\b)\w'
+)
+_GROUP_PATTERN = '|'.join(sorted(map(re.escape, _GROUP_COLUMNS), key=len, reverse=True))
+_GROUP_SEARCH = re.compile(rf'\b({_GROUP_PATTERN})')
+# Agrupamentos citados ("fornecedores", "por conta") não são valores dos dados
+_GROUP_WORDS = re.compile(rf'\b(?:{_GROUP_PATTERN})\w*')
+_MAX_LISTED = 50
+
+
+def _normalize_question(text: str) -> str:
+    """Minúsculas e sem acentos, para casar os padrões de intenção."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c)).strip()
+
+
+def format_brl(value: float) -> str:
+    """Formata um valor em reais (R$ 1.234,56)."""
+    return 'R$ ' + f"{value:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def _table(df: pd.DataFrame) -> str:
+    """Tabela Markdown simples (sem depender do pacote tabulate)."""
+    header = '| ' + ' | '.join(map(str, df.columns)) + ' |'
+    separator = '| ' + ' | '.join('---' for _ in df.columns) + ' |'
+    rows = ['| ' + ' | '.join(map(str, row)) + ' |' for row in df.itertuples(index=False)]
+    return '\n'.join([header, separator] + rows)
+
+
+def _grouped_totals(df: pd.DataFrame, column: str, label: str, top_n: Optional[int] = None) -> pd.DataFrame:
+    grouped = (
+        df.groupby(column, observed=True)['Valor_Lancamento']
+        .agg(['count', 'sum'])
+        .sort_values('sum', ascending=False)
+    )
+    if top_n:
+        grouped = grouped.head(top_n)
+    return pd.DataFrame({
+        label: grouped.index.astype(str),
+        'Lançamentos': grouped['count'].astype(int).to_numpy(),
+        'Valor Total': [format_brl(v) for v in grouped['sum']],
+    })
+
+
+def _answer_unmapped(df: pd.DataFrame, match: re.Match) -> str:
+    unmapped = df[(df['Conta_Debito'] == UNMAPPED_ACCOUNT) | (df['Conta_Credito'] == UNMAPPED_ACCOUNT)]
+    if unmapped.empty:
+        return "Todos os lançamentos possuem regra contábil mapeada (nenhuma 'Regra Não Mapeada')."
+    cfops = sorted(unmapped['CFOP_Principal'].astype(str).unique())
+    lines = [
+        f"**{len(unmapped)}** lançamento(s) com 'Regra Não Mapeada', somando **{format_brl(unmapped['Valor_Lancamento'].sum())}**.",
+        f"CFOPs sem regra: {', '.join(cfops)}. Sugestão: incluir regras para esses CFOPs no arquivo de regras contábeis.",
+        "",
+    ]
+    columns = [c for c in ('NFe_Chave', 'Emissor', 'CFOP_Principal', 'Valor_Lancamento') if c in unmapped.columns]
+    listed = unmapped[columns].head(_MAX_LISTED).copy()
+    listed['Valor_Lancamento'] = [format_brl(v) for v in listed['Valor_Lancamento']]
+    lines.append(_table(listed))
+    if len(unmapped) > _MAX_LISTED:
+        lines.append(f"\n... e mais {len(unmapped) - _MAX_LISTED} lançamento(s).")
+    return '\n'.join(lines)
+
+
+def _answer_top_n(df: pd.DataFrame, match: re.Match) -> str:
+    top_n = int(match.group('n') or match.group('n_antes') or 5)
+    # O agrupamento pode aparecer em qualquer ponto da pergunta ("maiores fornecedores", "top 3 por CFOP")
+    group = _GROUP_SEARCH.search(match.string)
+    if group:
+        column, label = _GROUP_COLUMNS[group.group(1)]
+        return f"Top {top_n} por {label} (valor total):\n\n" + _table(_grouped_totals(df, column, label, top_n))
+    columns = [c for c in ('NFe_Chave', 'Emissor', 'CFOP_Principal', 'Valor_Lancamento') if c in df.columns]
+    top = df.nlargest(top_n, 'Valor_Lancamento')[columns].copy()
+    top['Valor_Lancamento'] = [format_brl(v) for v in top['Valor_Lancamento']]
+    return f"Top {top_n} lançamentos por valor:\n\n" + _table(top)
+
+
+def _answer_group_by(df: pd.DataFrame, match: re.Match) -> str:
+    column, label = _GROUP_COLUMNS[match.group('grupo')]
+    return f"Totais por {label}:\n\n" + _table(_grouped_totals(df, column, label))
+
+
+def _answer_total(df: pd.DataFrame, match: re.Match) -> str:
+    return (
+        f"O valor total dos **{len(df)}** lançamentos é **{format_brl(df['Valor_Lancamento'].sum())}** "
+        f"(soma da coluna 'Valor_Lancamento')."
+    )
+
+
+def _answer_count(df: pd.DataFrame, match: re.Match) -> str:
+    if 'NFe_Chave' in df.columns:
+        return f"Há **{len(df)}** lançamentos, referentes a **{df['NFe_Chave'].nunique()}** NF-e distintas."
+    return f"O DataFrame possui **{len(df)}** linhas."
+
+
+def _question_scope(df: pd.DataFrame, question: str) -> Optional[Tuple[Optional[np.ndarray], List[str]]]:
+    """
+    Linhas a que a pergunta (já sem o trecho da intenção) se restringe: (None, []) = todas;
+    (posições, critérios) = só as das chaves/CFOPs citados (índices exatos do row_index);
+    None = cita um emitente, nota, CFOP ou conta que deve seguir para o LLM (com as linhas relacionadas).
+    """
+    retrieval = select_relevant_rows(df, _GROUP_WORDS.sub(' ', question))
+    if retrieval is None:
+        return None if _SCOPED_ENTITY.search(question) else (None, [])
+    # Coincidências por termos (ex.: parte do nome de um emitente) não são filtros exatos
+    if not retrieval['criteria'] or any(criterion.startswith('termos:') for criterion in retrieval['criteria']):
+        return None
+    return retrieval['matched'], retrieval['criteria']
+
+
+def _fully_understood(rest: str, criteria: List[str]) -> bool:
+    """
+    A pergunta, sem o trecho da intenção, só pode conter palavras vazias, agrupamentos citados
+    e as chaves/CFOPs usados como filtros exatos: do contrário, a resposta local ignoraria um recorte.
+    """
+    rest = _GROUP_WORDS.sub(' ', strip_exact_filters(rest, criteria))
+    return all(term in _LOCAL_FILLER for term in tokenize(rest))
+
+
+# Ordem importa: a primeira intenção que casar responde a pergunta
+_LOCAL_INTENTS: List[Tuple[re.Pattern, Callable[[pd.DataFrame, re.Match], str], bool]] = [
+    (re.compile(r'nao mapead|sem regra|sem mapeamento'), _answer_unmapped, True),
+    (re.compile(r'(?:\b(?P<n_antes>\d+)\s+)?\b(?:top|maiores|principais)\b\s*(?P<n>\d+)?'), _answer_top_n, True),
+    (re.compile(rf'\b(?:por|agrupad[oa]s? por)\s+(?P<grupo>{_GROUP_PATTERN})\b'), _answer_group_by, True),
+    (re.compile(r'valor total|total geral|soma (?:dos|das|de)|somatorio|qual o total|quanto (?:soma|totaliza)'), _answer_total, True),
+    (re.compile(r'quant[oa]s (?:notas|nf-?e|lancamentos|linhas|registros)|numero de (?:notas|nf-?e|lancamentos|linhas|registros)|quantidade de (?:notas|nf-?e|lancamentos|linhas|registros)'), _answer_count, False),
+]
+
+
+def answer_locally(df: pd.DataFrame, user_question: str) -> Optional[str]:
+    """
+    Responde direto com pandas as perguntas quantitativas comuns (totais, contagens,
+    agrupamentos por CFOP/Emissor/Conta, não mapeados e top-N), sem chamar o LLM.
+    Perguntas restritas a chaves de acesso ou CFOPs citados são respondidas só com essas linhas;
+    as que citam um emitente, nota ou conta, ou trazem qualquer outro termo além da intenção
+    (mês, tributo, faixa de valor, "vendas"...), seguem para o LLM.
+    Retorna None quando a pergunta deve seguir para o LLM.
+    """
+    if df is None or df.empty or not user_question:
+        return None
+    df_source = df
+    df = expand_lancamentos(df)
+    question = _normalize_question(user_question)
+    if _LLM_ONLY_TERMS.search(question):
+        metrics.increment('local_answers_total', result='sent_to_llm')
+        return None
+
+    fiscal_frame = is_lancamentos_frame(df)
+    for pattern, handler, requires_fiscal_frame in _LOCAL_INTENTS:
+        if requires_fiscal_frame and not fiscal_frame:
+            continue
+        match = pattern.search(question)
+        if match:
+            # O trecho da intenção (ex.: "nao mapead", "top 5") não conta como citação de valores dos dados
+            rest = question[:match.start()] + ' ' + question[match.end():]
+            scope = _question_scope(df_source, rest)
+            if scope is None or not _fully_understood(rest, scope[1]):
+                break
+            positions, criteria = scope
+            logger.info("Pergunta respondida localmente pela intenção '%s'.", handler.__name__)
+            metrics.increment('local_answers_total', result='answered')
+            if positions is None:
+                return handler(df, match)
+            return f"Considerando apenas os lançamentos de {', '.join(criteria)}:\n\n" + handler(df.iloc[positions], match)
+    metrics.increment('local_answers_total', result='sent_to_llm')
+    return None
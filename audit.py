@@ -0,0 +1,194 @@
+# audit.py - LançAI: Auditoria Local dos Lançamentos (vetorizada, sem chamada ao LLM)
+
+import os
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from rules_engine import UNMAPPED_ACCOUNT
+from compact_dtypes import valor_em_reais
+from metrics import metrics
+
+# Outliers: desvio robusto (mediana e MAD do grupo) acima deste limite, em grupos com ao menos OUTLIER_MIN_GROUP linhas
+OUTLIER_THRESHOLD = float(os.getenv("LANCAI_AUDIT_OUTLIER_THRESHOLD", "3.5"))
+OUTLIER_MIN_GROUP = int(os.getenv("LANCAI_AUDIT_OUTLIER_MIN_GROUP", "8"))
+# Itens listados em cada seção do relatório (as contagens sempre cobrem todas as linhas)
+MAX_LISTED = 50
+# Colunas de agrupamento da busca de outliers
+OUTLIER_GROUPS = (('CFOP_Principal', 'CFOP'), ('Emissor', 'Emissor'))
+# Constante que torna o MAD comparável ao desvio padrão (distribuição normal)
+MAD_SCALE = 0.6745
+
+
+def _records(df: pd.DataFrame, limit: Optional[int] = MAX_LISTED) -> List[Dict[str, Any]]:
+    """Linhas como dicionários simples (o relatório fica em df.attrs e precisa ser leve e comparável)."""
+    if limit is not None:
+        df = df.head(limit)
+    return [
+        {column: (value.item() if isinstance(value, np.generic) else value) for column, value in row.items()}
+        for row in df.to_dict('records')
+    ]
+
+
+def _unmapped_section(df: pd.DataFrame, values: pd.Series) -> Dict[str, Any]:
+    unmapped = ((df['Conta_Debito'] == UNMAPPED_ACCOUNT) | (df['Conta_Credito'] == UNMAPPED_ACCOUNT)).to_numpy()
+    section: Dict[str, Any] = {'quantidade': int(unmapped.sum()), 'valor': round(float(values[unmapped].sum()), 2)}
+    if not unmapped.any():
+        section.update(por_cfop=[], chaves=[])
+        return section
+    df_unmapped = df.loc[unmapped, ['CFOP_Principal']].assign(Valor=values[unmapped].to_numpy())
+    by_cfop = (
+        df_unmapped.groupby('CFOP_Principal', observed=True)['Valor']
+        .agg(['count', 'sum'])
+        .sort_values('count', ascending=False)
+        .reset_index()
+    )
+    section['por_cfop'] = _records(pd.DataFrame({
+        'CFOP': by_cfop['CFOP_Principal'].astype(str),
+        'Lançamentos': by_cfop['count'].astype(int),
+        'Valor': by_cfop['sum'].round(2),
+    }), limit=None)
+    if 'NFe_Chave' in df.columns:
+        section['chaves'] = df.loc[unmapped, 'NFe_Chave'].astype(str).drop_duplicates().head(MAX_LISTED).tolist()
+    else:
+        section['chaves'] = []
+    return section
+
+
+def _duplicates_section(df: pd.DataFrame, values: pd.Series) -> Dict[str, Any]:
+    if 'NFe_Chave' not in df.columns:
+        return {'quantidade': 0, 'linhas': 0, 'removidas': 0, 'itens': []}
+    keys = df['NFe_Chave'].astype(str)
+    duplicated = (keys.duplicated(keep=False) & (keys != '')).to_numpy()
+    if not duplicated.any():
+        return {'quantidade': 0, 'linhas': 0, 'removidas': 0, 'itens': []}
+    grouped = (
+        pd.DataFrame({'NFe_Chave': keys[duplicated].to_numpy(), 'Valor': values[duplicated].to_numpy()})
+        .groupby('NFe_Chave')['Valor']
+        .agg(['count', 'sum'])
+        .sort_values('count', ascending=False)
+        .reset_index()
+    )
+    return {
+        'quantidade': len(grouped),
+        'linhas': int(duplicated.sum()),
+        # Repetições descartadas pela ingestão (preenchido por duplicate_keys_section)
+        'removidas': 0,
+        'itens': _records(pd.DataFrame({
+            'NFe_Chave': grouped['NFe_Chave'],
+            'Ocorrências': grouped['count'].astype(int),
+            'Valor': grouped['sum'].round(2),
+        })),
+    }
+
+
+def duplicate_keys_section(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Seção de chaves repetidas calculada à parte: a ingestão a monta antes de descartar as
+    repetições (cada chave fica com um lançamento) e a repassa a build_audit_report.
+    """
+    return _duplicates_section(df, pd.Series(valor_em_reais(df), index=df.index, dtype='float64'))
+
+
+def _listing(df: pd.DataFrame, mask: np.ndarray, values: pd.Series) -> pd.DataFrame:
+    columns = [column for column in ('NFe_Chave', 'Emissor', 'CFOP_Principal') if column in df.columns]
+    listed = df.loc[mask, columns].astype(str)
+    listed['Valor'] = values[mask].round(2).to_numpy()
+    return listed.rename(columns={'CFOP_Principal': 'CFOP'})
+
+
+def _invalid_values_section(df: pd.DataFrame, values: pd.Series) -> Dict[str, Any]:
+    invalid = (values <= 0).to_numpy()
+    return {'quantidade': int(invalid.sum()), 'itens': _records(_listing(df, invalid, values)) if invalid.any() else []}
+
+
+def _outliers_section(df: pd.DataFrame, values: pd.Series) -> Dict[str, Any]:
+    """
+    Valores atípicos dentro de cada CFOP e de cada emitente: desvio em relação à mediana do grupo,
+    medido em MADs (robusto aos próprios outliers). Tudo por groupby/transform, sem laço por linha.
+    """
+    frames = []
+    for column, label in OUTLIER_GROUPS:
+        if column not in df.columns:
+            continue
+        groups = df[column]
+        median = values.groupby(groups, observed=True).transform('median')
+        mad = (values - median).abs().groupby(groups, observed=True).transform('median')
+        size = values.groupby(groups, observed=True).transform('size')
+        score = (MAD_SCALE * (values - median) / mad.where(mad > 0)).abs()
+        mask = ((size >= OUTLIER_MIN_GROUP) & (score > OUTLIER_THRESHOLD)).to_numpy()
+        if not mask.any():
+            continue
+        listed = _listing(df, mask, values)
+        listed['Grupo'] = f"{label} " + groups[mask].astype(str).to_numpy()
+        listed['Mediana do Grupo'] = median[mask].round(2).to_numpy()
+        listed['Desvio (MADs)'] = score[mask].round(1).to_numpy()
+        frames.append(listed)
+
+    if not frames:
+        return {'quantidade': 0, 'linhas': 0, 'itens': []}
+    outliers = pd.concat(frames, ignore_index=True).sort_values('Desvio (MADs)', ascending=False)
+    return {
+        'quantidade': len(outliers),
+        'linhas': int(outliers['NFe_Chave'].nunique()) if 'NFe_Chave' in outliers.columns else len(outliers),
+        'itens': _records(outliers),
+    }
+
+
+def _account_totals(df: pd.DataFrame, values: pd.Series, column: str) -> List[Dict[str, Any]]:
+    grouped = (
+        pd.DataFrame({'Conta': df[column].astype(str).to_numpy(), 'Valor': values.to_numpy()})
+        .groupby('Conta')['Valor']
+        .agg(['count', 'sum'])
+        .sort_values('sum', ascending=False)
+        .reset_index()
+    )
+    return _records(pd.DataFrame({
+        'Conta': grouped['Conta'],
+        'Lançamentos': grouped['count'].astype(int),
+        'Valor': grouped['sum'].round(2),
+    }), limit=None)
+
+
+@metrics.timed('audit_report')
+def build_audit_report(df: pd.DataFrame, duplicates: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Auditoria dos lançamentos calculada localmente (segundos, sem o LLM): CFOPs sem regra e suas
+    chaves, chaves de acesso repetidas, valores zerados ou negativos, valores atípicos por CFOP e
+    por emitente e totais por conta de débito e de crédito.
+    Aceita o DataFrame em reais ou na forma compacta (centavos). O resultado só contém tipos
+    simples (números, textos, listas e dicionários): pode ficar em df.attrs e virar JSON.
+    duplicates: seção de chaves repetidas já calculada antes da deduplicação (duplicate_keys_section);
+    sem ela, as repetições são procuradas no próprio df.
+    """
+    values = pd.Series(valor_em_reais(df), index=df.index, dtype='float64')
+    period = None
+    if 'Data_Emissao' in df.columns:
+        dates = df['Data_Emissao'].astype(str)
+        dates = dates[dates != '']
+        if not dates.empty:
+            period = [dates.min(), dates.max()]
+
+    report = {
+        'resumo': {
+            'lancamentos': len(df),
+            'notas': int(df['NFe_Chave'].nunique()) if 'NFe_Chave' in df.columns else len(df),
+            'emitentes': int(df['Emissor'].nunique()) if 'Emissor' in df.columns else 0,
+            'valor_total': round(float(values.sum()), 2),
+            'periodo': period,
+        },
+        'nao_mapeados': _unmapped_section(df, values),
+        'chaves_duplicadas': duplicates if duplicates is not None else _duplicates_section(df, values),
+        'valores_invalidos': _invalid_values_section(df, values),
+        'outliers': _outliers_section(df, values),
+        'totais_por_conta': {
+            'debito': _account_totals(df, values, 'Conta_Debito'),
+            'credito': _account_totals(df, values, 'Conta_Credito'),
+        },
+    }
+    report['alertas'] = sum(
+        report[section]['quantidade'] for section in ('nao_mapeados', 'chaves_duplicadas', 'valores_invalidos', 'outliers')
+    )
+    metrics.increment('rows_total', len(df), stage='audit_report')
+    return report
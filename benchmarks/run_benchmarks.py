@@ -0,0 +1,252 @@
+# run_benchmarks.py - LançAI: Benchmarks do Pipeline de Ingestão (offline, com LLM simulado)
+#
+# Uso:
+#   python benchmarks/run_benchmarks.py --notes 5000 --items 5 --unmapped-ratio 0.15
+#   python benchmarks/run_benchmarks.py --baseline benchmarks/results/<anterior>.json
+#
+# Os tempos são gravados em JSON (benchmarks/results/) para comparar versões.
+
+import os
+import sys
+
+# Execução sempre offline: backend simulado, sem cache de respostas e sem a base de notas
+# (a base faria as execuções repetidas pularem o parsing). Definido antes de importar o app.
+os.environ['LANCAI_LLM_BACKEND'] = 'stub'
+os.environ['LANCAI_LLM_CACHE'] = '0'
+os.environ['LANCAI_LEDGER'] = '0'
+# Sem arquivo de regras vale o MAPPING_RULES do data_handler (o mesmo da mistura padrão de CFOPs)
+os.environ.setdefault('LANCAI_RULES_FILE', '')
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, Any, Optional, List, Callable
+
+import pandas as pd
+
+from synthetic_corpus import generate_nfe_zip, generate_data_files, parse_cfop_mix
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# Variação (em %) do tempo mediano a partir da qual uma etapa é apontada como regressão
+REGRESSION_THRESHOLD_PCT = 20.0
+QUESTION = "Faça um resumo dos lançamentos e aponte os CFOPs sem regra contábil."
+
+
+def measure(
+    name: str,
+    func: Callable[[Any], Any],
+    repeat: int,
+    items: int,
+    setup: Optional[Callable[[], Any]] = None
+) -> Dict[str, Any]:
+    """
+    Executa func `repeat` vezes e resume os tempos (mín., mediana, média e itens/s pela mediana).
+    O setup (ex.: cópia do DataFrame de entrada) roda antes de cada execução, fora da medição.
+    """
+    times = []
+    for _ in range(max(1, repeat)):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        func(argument)
+        times.append(time.perf_counter() - started)
+    median = statistics.median(times)
+    result = {
+        'runs': len(times),
+        'min_s': round(min(times), 6),
+        'median_s': round(median, 6),
+        'mean_s': round(statistics.fmean(times), 6),
+        'items': items,
+        'items_per_s': round(items / median, 1) if median > 0 else None,
+    }
+    print(f"  {name:<55} mediana {median * 1000:10.1f} ms  ({result['items_per_s']} itens/s)")
+    return result
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(args: argparse.Namespace, corpus_dir: str) -> Dict[str, Any]:
+    """Gera o corpus, mede cada etapa do pipeline e devolve o resultado completo."""
+    import data_handler
+    from agent_brain import SYSTEM_PROMPT_LANCAI, generate_accounting_summary_and_answer
+    from ledger_store import LedgerStore
+    from prompt_builder import build_agent_prompt
+    from row_index import RowIndex, select_relevant_rows
+    from audit import build_audit_report
+
+    print(f"Gerando corpus em {corpus_dir}...")
+    corpus = generate_nfe_zip(
+        os.path.join(corpus_dir, 'nfe.zip'), args.notes, args.items, parse_cfop_mix(args.cfop_mix),
+        args.unmapped_ratio, seed=args.seed
+    )
+    data_files = generate_data_files(corpus_dir, args.csv_rows, args.seed)
+
+    results: Dict[str, Any] = {}
+    print("Medindo etapas:")
+    with zipfile.ZipFile(corpus['path']) as zip_ref:
+        members = [m for m in zip_ref.namelist() if m.lower().endswith('.xml')]
+        # Conteúdo já lido do ZIP: mede apenas o parsing
+        contents = [(member, zip_ref.read(member)) for member in members]
+
+        def parse_all(parser: Callable[..., Optional[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+            return [data for data in (parser(BytesIO(content), member) for member, content in contents) if data]
+
+        results['parse_xml_to_dict'] = measure(
+            'parse_xml_to_dict (etree, sequencial)', lambda _: parse_all(data_handler.parse_xml_to_dict),
+            args.repeat, len(contents)
+        )
+        results['parse_nfe_fast'] = measure(
+            'parse_nfe_fast (sequencial)', lambda _: parse_all(data_handler.parse_nfe_fast),
+            args.repeat, len(contents)
+        )
+        parsed = parse_all(data_handler.get_xml_parser())
+
+        ledger = LedgerStore(enabled=False)
+        results['process_xml_files'] = measure(
+            f'process_xml_files ({data_handler.XML_PARSER_WORKERS} workers)',
+            lambda _: data_handler.process_xml_files(zip_ref, members, ledger=ledger),
+            args.repeat, len(members)
+        )
+
+    df_parsed = pd.DataFrame(parsed)
+    rules = data_handler.get_accounting_rules()
+    results['apply_accounting_rules'] = measure(
+        'apply_accounting_rules', lambda df: data_handler.apply_accounting_rules(df, rules),
+        args.repeat, len(df_parsed), setup=df_parsed.copy
+    )
+
+    for info in data_files:
+        results[f"load_and_validate_csv[{info['variant']}]"] = measure(
+            f"load_and_validate_csv[{info['variant']}]",
+            lambda _, path=info['path']: data_handler.load_and_validate_csv(path),
+            args.repeat, info['rows']
+        )
+
+    df_lancamentos = data_handler.process_xml_files(zipfile.ZipFile(corpus['path']), members, ledger=LedgerStore(enabled=False))
+    # Auditoria local exibida antes da análise do LLM (calculada na ingestão)
+    results['build_audit_report'] = measure(
+        'build_audit_report', lambda _: build_audit_report(df_lancamentos), args.repeat, len(df_lancamentos)
+    )
+    prompt_info = build_agent_prompt(df_lancamentos, QUESTION, SYSTEM_PROMPT_LANCAI)
+    results['build_agent_prompt'] = measure(
+        'build_agent_prompt', lambda _: build_agent_prompt(df_lancamentos, QUESTION, SYSTEM_PROMPT_LANCAI),
+        args.repeat, len(df_lancamentos)
+    )
+    results['build_agent_prompt']['prompt_tokens'] = prompt_info['token_usage']['total']
+    # Índice de recuperação: montagem (uma vez por DataFrame) e seleção das linhas de uma pergunta focada
+    results['row_index_build'] = measure(
+        'RowIndex (montagem do índice)', lambda _: RowIndex(df_lancamentos), args.repeat, len(df_lancamentos)
+    )
+    focused_question = f"Quais lançamentos do emitente {df_lancamentos['Emissor'].iloc[0]}?"
+    results['select_relevant_rows'] = measure(
+        'select_relevant_rows (pergunta sobre um emitente)',
+        lambda _: select_relevant_rows(df_lancamentos, focused_question), args.repeat, len(df_lancamentos)
+    )
+    # Chamada completa com o backend simulado: montagem do prompt + cliente (sem rede)
+    results['generate_accounting_summary_and_answer'] = measure(
+        'generate_accounting_summary_and_answer (stub)',
+        lambda _: generate_accounting_summary_and_answer(df_lancamentos, QUESTION, use_cache=False),
+        args.repeat, len(df_lancamentos)
+    )
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'xml_parser': data_handler.XML_PARSER,
+            'xml_workers': data_handler.XML_PARSER_WORKERS,
+        },
+        'params': {
+            'notes': args.notes, 'items_per_note': args.items, 'cfop_mix': args.cfop_mix,
+            'unmapped_ratio': args.unmapped_ratio, 'csv_rows': args.csv_rows, 'repeat': args.repeat, 'seed': args.seed,
+        },
+        'corpus': {
+            'xml_zip_bytes': corpus['bytes'], 'xml_items': corpus['items'], 'unmapped_notes': corpus['unmapped_notes'],
+            'data_files': {info['variant']: info['bytes'] for info in data_files},
+        },
+        'results': results,
+    }
+
+
+def compare_with_baseline(current: Dict[str, Any], baseline_path: str, threshold_pct: float) -> List[str]:
+    """Compara as medianas com um resultado anterior. Retorna as etapas que ficaram mais lentas que o limite."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('params') != current['params']:
+        print("Aviso: parâmetros diferentes dos da linha de base; a comparação é apenas indicativa.")
+
+    regressions = []
+    print(f"\nComparação com {baseline_path} ({baseline['meta'].get('git_revision')}):")
+    for name, result in current['results'].items():
+        previous = baseline['results'].get(name)
+        if not previous or not previous.get('median_s'):
+            continue
+        change = 100.0 * (result['median_s'] - previous['median_s']) / previous['median_s']
+        flag = ' <-- REGRESSÃO' if change > threshold_pct else ''
+        print(f"  {name:<55} {previous['median_s'] * 1000:10.1f} -> {result['median_s'] * 1000:10.1f} ms ({change:+.1f}%){flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks do pipeline de ingestão do LançAI (offline).")
+    parser.add_argument('--notes', type=int, default=2000, help="Quantidade de NF-e no ZIP sintético.")
+    parser.add_argument('--items', type=int, default=3, help="Média de itens por nota.")
+    parser.add_argument('--cfop-mix', default=None, help="Pesos dos CFOPs mapeados, ex.: '5102=0.6,1101=0.4'.")
+    parser.add_argument('--unmapped-ratio', type=float, default=0.1, help="Proporção de notas com CFOP sem regra.")
+    parser.add_argument('--csv-rows', type=int, default=50000, help="Linhas de cada CSV/XLSX sintético.")
+    parser.add_argument('--repeat', type=int, default=3, help="Execuções por etapa (vale a mediana).")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--corpus-dir', default=None, help="Pasta do corpus (padrão: pasta temporária descartada).")
+    parser.add_argument('--output', default=None, help="Arquivo JSON de saída (padrão: benchmarks/results/).")
+    parser.add_argument('--baseline', default=None, help="JSON de uma execução anterior para comparação.")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD_PCT, help="Limite de regressão (%%).")
+    args = parser.parse_args()
+
+    if args.corpus_dir:
+        os.makedirs(args.corpus_dir, exist_ok=True)
+        report = run_benchmarks(args, args.corpus_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='lancai_bench_') as corpus_dir:
+            report = run_benchmarks(args, corpus_dir)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench_{datetime.now():%Y%m%d_%H%M%S}_{report['meta']['git_revision'] or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(report, args.baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} etapa(s) acima do limite de {args.threshold:.0f}%.")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# synthetic_corpus.py - LançAI: Gerador de Corpus Sintético (ZIP de NF-e e CSV/XLSX "bagunçados")
+
+import argparse
+import csv
+import os
+import random
+import zipfile
+from datetime import date, timedelta
+from typing import Dict, Any, Optional, List, Tuple
+
+# Mistura padrão de CFOPs mapeados (os do MAPPING_RULES do data_handler) e CFOPs sem regra
+DEFAULT_CFOP_MIX: Dict[str, float] = {'5102': 0.6, '1101': 0.4}
+DEFAULT_UNMAPPED_CFOPS: Tuple[str, ...] = ('5405', '6102', '1556', '2102', '5949')
+NCM_CODES = ('72080000', '72085100', '72104910', '73089010', '84314990', '39269090')
+UF_CODES = ('35', '41', '31', '33', '42')
+# Proporção de emitentes do Simples Nacional (informam CSOSN no lugar do CST)
+SIMPLES_RATIO = 0.2
+
+_NAME_PREFIXES = ('Metalúrgica', 'Siderúrgica', 'Aços', 'Comércio de Sucata', 'Indústria', 'Distribuidora')
+_NAME_SUFFIXES = ('São João', 'Paraná', 'Vale do Aço', 'Ação & Cia', 'Irmãos Peçanha', 'Conceição')
+
+# Variantes de CSV: (nome, encoding, separador, separador decimal, acentos só no meio do arquivo)
+CSV_VARIANTS: Tuple[Tuple[str, str, str, str, bool], ...] = (
+    ('utf8_virgula', 'utf-8', ',', '.', False),
+    ('utf8bom_ponto_virgula', 'utf-8-sig', ';', ',', False),
+    ('latin1_ponto_virgula', 'latin-1', ';', ',', False),
+    ('cp1252_tab', 'cp1252', '\t', ',', False),
+    ('utf8_pipe', 'utf-8', '|', '.', False),
+    # Início e fim só ASCII, latin-1 no meio (fora das amostras): força a releitura do csv_loader
+    ('latin1_acentos_no_meio', 'latin-1', ';', ',', True),
+)
+
+try:
+    import openpyxl  # noqa: F401
+    XLSX_AVAILABLE = True
+except ImportError:
+    XLSX_AVAILABLE = False
+
+
+def _check_digit(key43: str) -> str:
+    """Dígito verificador da chave de acesso (módulo 11, pesos 2 a 9)."""
+    total = sum(int(digit) * (2 + i % 8) for i, digit in enumerate(reversed(key43)))
+    remainder = total % 11
+    return '0' if remainder < 2 else str(11 - remainder)
+
+
+def make_nfe_key(rng: random.Random, cnpj: str, issued: date, number: int) -> str:
+    """Chave de acesso de 44 dígitos com UF, AAMM, CNPJ, modelo 55, série, número e DV."""
+    key43 = (
+        f"{rng.choice(UF_CODES)}{issued:%y%m}{cnpj}55001{number:09d}1{rng.randrange(10 ** 8):08d}"
+    )
+    return key43 + _check_digit(key43)
+
+
+def _issuers(rng: random.Random, count: int) -> List[Tuple[str, str, bool]]:
+    """Emitentes sintéticos: (razão social, CNPJ, optante do Simples)."""
+    issuers = []
+    for i in range(count):
+        name = f"{rng.choice(_NAME_PREFIXES)} {rng.choice(_NAME_SUFFIXES)} {i + 1} Ltda"
+        issuers.append((name, f"{rng.randrange(10 ** 13, 10 ** 14):014d}", rng.random() < SIMPLES_RATIO))
+    return issuers
+
+
+def build_nfe_xml(
+    key: str,
+    issuer: Tuple[str, str, bool],
+    issued: date,
+    items: List[Tuple[str, str, float]],
+) -> bytes:
+    """Monta um XML de NF-e 4.00 (nfeProc) com os itens informados: (CFOP, NCM, valor)."""
+    name, cnpj, simples = issuer
+    det = []
+    for n_item, (cfop, ncm, value) in enumerate(items, start=1):
+        if simples:
+            icms = "<ICMSSN102><orig>0</orig><CSOSN>102</CSOSN></ICMSSN102>"
+        else:
+            icms = f"<ICMS00><orig>0</orig><CST>00</CST><vBC>{value:.2f}</vBC><pICMS>18.00</pICMS><vICMS>{value * 0.18:.2f}</vICMS></ICMS00>"
+        det.append(
+            f'<det nItem="{n_item}"><prod><cProd>{n_item:05d}</cProd><xProd>Bobina de aço laminado {n_item}</xProd>'
+            f'<NCM>{ncm}</NCM><CFOP>{cfop}</CFOP><uCom>KG</uCom><qCom>1.0000</qCom><vUnCom>{value:.2f}</vUnCom>'
+            f'<vProd>{value:.2f}</vProd></prod><imposto><ICMS>{icms}</ICMS></imposto></det>'
+        )
+    total = sum(value for _, _, value in items)
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+        '<NFe xmlns="http://www.portalfiscal.inf.br/nfe">'
+        f'<infNFe Id="NFe{key}" versao="4.00">'
+        f'<ide><cUF>{key[:2]}</cUF><natOp>Venda de mercadoria</natOp><mod>55</mod><serie>1</serie>'
+        f'<nNF>{int(key[25:34])}</nNF><dhEmi>{issued:%Y-%m-%d}T10:30:00-03:00</dhEmi><tpNF>1</tpNF></ide>'
+        f'<emit><CNPJ>{cnpj}</CNPJ><xNome>{name.replace("&", "&amp;")}</xNome>'
+        f'<enderEmit><xMun>São Paulo</xMun><UF>SP</UF></enderEmit><CRT>{1 if simples else 3}</CRT></emit>'
+        '<dest><CNPJ>11222333000181</CNPJ><xNome>Cliente Industrial SA</xNome></dest>'
+        + ''.join(det) +
+        f'<total><ICMSTot><vProd>{total:.2f}</vProd><vNF>{total:.2f}</vNF></ICMSTot></total>'
+        '</infNFe></NFe>'
+        f'<protNFe versao="4.00"><infProt><chNFe>{key}</chNFe><cStat>100</cStat></infProt></protNFe>'
+        '</nfeProc>'
+    )
+    return xml.encode('utf-8')
+
+
+def generate_nfe_zip(
+    path: str,
+    notes: int = 1000,
+    items_per_note: int = 3,
+    cfop_mix: Optional[Dict[str, float]] = None,
+    unmapped_ratio: float = 0.1,
+    unmapped_cfops: Tuple[str, ...] = DEFAULT_UNMAPPED_CFOPS,
+    issuers: int = 200,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """
+    Gera um ZIP com `notes` XMLs de NF-e (arquivos '<chave>-nfe.xml').
+    A quantidade de itens de cada nota varia entre 1 e 2 * items_per_note - 1 (média items_per_note);
+    o CFOP vem de cfop_mix (pesos) ou, na proporção unmapped_ratio, de um CFOP sem regra.
+    Retorna um resumo do corpus gerado.
+    """
+    rng = random.Random(seed)
+    cfop_mix = cfop_mix or DEFAULT_CFOP_MIX
+    mapped_cfops, weights = list(cfop_mix), list(cfop_mix.values())
+    issuer_list = _issuers(rng, issuers)
+    start = date(2024, 1, 1)
+    total_items = unmapped = 0
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for number in range(1, notes + 1):
+            issuer = rng.choice(issuer_list)
+            issued = start + timedelta(days=rng.randrange(365))
+            if rng.random() < unmapped_ratio:
+                cfop = rng.choice(unmapped_cfops)
+                unmapped += 1
+            else:
+                cfop = rng.choices(mapped_cfops, weights)[0]
+            n_items = rng.randint(1, max(1, 2 * items_per_note - 1))
+            items = [(cfop, rng.choice(NCM_CODES), round(rng.uniform(50, 50000), 2)) for _ in range(n_items)]
+            total_items += n_items
+            key = make_nfe_key(rng, issuer[1], issued, number)
+            zf.writestr(f"{key}-nfe.xml", build_nfe_xml(key, issuer, issued, items))
+
+    return {
+        'path': path, 'notes': notes, 'items': total_items, 'unmapped_notes': unmapped,
+        'bytes': os.path.getsize(path), 'seed': seed,
+    }
+
+
+def _csv_rows(rng: random.Random, rows: int, decimal: str, middle_accents: bool) -> List[List[str]]:
+    """Linhas de uma exportação de ERP: acentos, campos com aspas/separadores, valores e células vazias."""
+    issuer_list = _issuers(rng, 50)
+    # Com middle_accents, só as linhas do meio do arquivo (~10%) mantêm os acentos
+    accent_rows = range(int(rows * 0.45), int(rows * 0.55) + 1) if middle_accents else range(rows)
+    data = []
+    for i in range(rows):
+        name = issuer_list[rng.randrange(len(issuer_list))][0]
+        history = rng.choice((
+            'Compra de bobinas; lote "A"', 'Venda, conforme pedido', 'Devolução de sucata',
+            'Frete s/ compra | transportadora', 'Ajuste de estoque', '',
+        ))
+        if i not in accent_rows:
+            name, history = name.encode('ascii', 'ignore').decode(), history.encode('ascii', 'ignore').decode()
+        value = f"{rng.uniform(1, 100000):.2f}"
+        if decimal == ',':
+            value = value.replace('.', ',')
+        data.append([
+            (date(2024, 1, 1) + timedelta(days=rng.randrange(365))).strftime('%d/%m/%Y'),
+            name,
+            history,
+            rng.choice(('1.01.01.002', '1.01.03.002', '3.01.01.001', '2.01.01.001')),
+            rng.choice(('2.01.01.001', '3.01.01.001', '')),
+            value,
+            rng.choice(('5102', '1101', '5405', '')),
+        ])
+    return data
+
+
+CSV_HEADER = ['Data', 'Fornecedor/Cliente', 'Histórico', 'Conta Débito', 'Conta Crédito', 'Valor', 'CFOP']
+
+
+def generate_messy_csv(
+    path: str, rows: int, encoding: str, delimiter: str, decimal: str = ',',
+    middle_accents: bool = False, seed: int = 42
+) -> Dict[str, Any]:
+    """Gera um CSV no encoding/separador informados, com quebras CRLF e campos entre aspas."""
+    rng = random.Random(seed)
+    header = [h.encode('ascii', 'ignore').decode() for h in CSV_HEADER] if middle_accents else CSV_HEADER
+    with open(path, 'w', encoding=encoding, errors='replace', newline='') as f:
+        writer = csv.writer(f, delimiter=delimiter, lineterminator='\r\n')
+        writer.writerow(header)
+        writer.writerows(_csv_rows(rng, rows, decimal, middle_accents))
+    return {'path': path, 'rows': rows, 'encoding': encoding, 'delimiter': delimiter, 'bytes': os.path.getsize(path)}
+
+
+def generate_messy_xlsx(path: str, rows: int, seed: int = 42) -> Optional[Dict[str, Any]]:
+    """Gera a mesma exportação em XLSX (requer openpyxl; retorna None se não estiver instalado)."""
+    if not XLSX_AVAILABLE:
+        return None
+    import pandas as pd
+    rng = random.Random(seed)
+    pd.DataFrame(_csv_rows(rng, rows, ',', False), columns=CSV_HEADER).to_excel(path, index=False)
+    return {'path': path, 'rows': rows, 'bytes': os.path.getsize(path)}
+
+
+def generate_data_files(out_dir: str, rows: int = 20000, seed: int = 42) -> List[Dict[str, Any]]:
+    """Gera todas as variantes de CSV (e o XLSX, se possível) em out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
+    generated = []
+    for name, encoding, delimiter, decimal, middle_accents in CSV_VARIANTS:
+        info = generate_messy_csv(
+            os.path.join(out_dir, f"exportacao_{name}.csv"), rows, encoding, delimiter, decimal, middle_accents, seed
+        )
+        generated.append(dict(info, variant=name))
+    xlsx = generate_messy_xlsx(os.path.join(out_dir, "exportacao.xlsx"), rows, seed)
+    if xlsx:
+        generated.append(dict(xlsx, variant='xlsx'))
+    return generated
+
+
+def parse_cfop_mix(text: Optional[str]) -> Optional[Dict[str, float]]:
+    """Converte '5102=0.6,1101=0.4' em {'5102': 0.6, '1101': 0.4}."""
+    if not text:
+        return None
+    mix = {}
+    for part in text.split(','):
+        cfop, _, weight = part.partition('=')
+        mix[cfop.strip()] = float(weight or 1)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gera um corpus sintético de NF-e (ZIP) e exportações CSV/XLSX.")
+    parser.add_argument('--out', default='./benchmarks/corpus', help="Pasta de saída.")
+    parser.add_argument('--notes', type=int, default=1000, help="Quantidade de NF-e no ZIP.")
+    parser.add_argument('--items', type=int, default=3, help="Média de itens por nota.")
+    parser.add_argument('--cfop-mix', default=None, help="Pesos dos CFOPs mapeados, ex.: '5102=0.6,1101=0.4'.")
+    parser.add_argument('--unmapped-ratio', type=float, default=0.1, help="Proporção de notas com CFOP sem regra.")
+    parser.add_argument('--csv-rows', type=int, default=20000, help="Linhas de cada CSV/XLSX.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    summary = generate_nfe_zip(
+        os.path.join(args.out, 'nfe.zip'), args.notes, args.items, parse_cfop_mix(args.cfop_mix),
+        args.unmapped_ratio, seed=args.seed
+    )
+    print(f"ZIP: {summary['path']} ({summary['notes']} notas, {summary['items']} itens, {summary['bytes'] / 1e6:.1f} MB)")
+    for info in generate_data_files(args.out, args.csv_rows, args.seed):
+        print(f"{info['variant']}: {info['path']} ({info['rows']} linhas, {info['bytes'] / 1e6:.1f} MB)")
+    if not XLSX_AVAILABLE:
+        print("openpyxl não instalado: XLSX não gerado.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# compact_dtypes.py - LançAI: Representação Compacta dos Lançamentos em Memória
+
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Valores monetários guardados em centavos (inteiros exatos) no lugar de Valor_Total/Valor_Lancamento
+CENTS_COLUMN = 'Valor_Centavos'
+VALUE_COLUMN = 'Valor_Lancamento'
+# Colunas de valor em reais removidas na compactação (Valor_Total é cópia de Valor_Lancamento)
+_MONEY_COLUMNS = ('Valor_Lancamento', 'Valor_Total')
+# Texto com até esta proporção de valores distintos vira categoria (dicionário + códigos inteiros)
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+try:
+    import pyarrow  # noqa: F401
+    _STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    _STRING_DTYPE = None
+
+
+def frame_memory_bytes(df: pd.DataFrame) -> int:
+    """Memória ocupada pelo DataFrame, incluindo o conteúdo das strings."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _is_text(series: pd.Series) -> bool:
+    return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+
+def compact_lancamentos(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Converte os lançamentos para a forma compacta:
+    * textos repetidos (contas, emitente, CFOP, NCM, CST...) viram categorias;
+    * textos quase únicos (chave, caminho do XML) viram strings Arrow, sem um objeto Python por linha;
+    * Valor_Lancamento/Valor_Total (float) viram Valor_Centavos (int64, exato).
+    Retorna o DataFrame compacto e o relatório de memória (antes, depois e economia).
+    """
+    before = frame_memory_bytes(df)
+    compact = pd.DataFrame(index=df.index)
+    n_rows = len(df)
+
+    for column in df.columns:
+        series = df[column]
+        if column in _MONEY_COLUMNS:
+            continue
+        if isinstance(series.dtype, pd.CategoricalDtype) or not _is_text(series):
+            compact[column] = series
+        elif n_rows and series.nunique(dropna=False) <= n_rows * CATEGORY_MAX_UNIQUE_RATIO:
+            compact[column] = series.astype('category')
+        elif _STRING_DTYPE and series.dtype == object:
+            compact[column] = series.astype(_STRING_DTYPE)
+        else:
+            compact[column] = series
+
+    money_source = next((c for c in _MONEY_COLUMNS if c in df.columns), None)
+    if money_source is not None:
+        reais = pd.to_numeric(df[money_source], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+        compact[CENTS_COLUMN] = np.round(reais * 100).astype(np.int64)
+
+    after = frame_memory_bytes(compact)
+    report = {
+        'bytes_antes': before,
+        'bytes_depois': after,
+        'economia_bytes': before - after,
+        'economia_pct': round(100.0 * (before - after) / before, 1) if before else 0.0,
+    }
+    logger.info(
+        "Lançamentos compactados: %.1f MB -> %.1f MB (%.1f%% menor).",
+        before / 1e6, after / 1e6, report['economia_pct']
+    )
+    compact.attrs['compactacao'] = report
+    return compact, report
+
+
+def valor_em_reais(df: pd.DataFrame) -> pd.Series:
+    """Valor do lançamento em reais (float), a partir de Valor_Centavos ou de Valor_Lancamento."""
+    if CENTS_COLUMN in df.columns:
+        return (df[CENTS_COLUMN] / 100.0).rename(VALUE_COLUMN)
+    return df[VALUE_COLUMN]
+
+
+def expand_lancamentos(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Devolve o formato usado pelo prompt, pelas respostas locais e pela exportação: a coluna
+    Valor_Lancamento em reais no lugar de Valor_Centavos. Categorias são mantidas (os
+    consumidores as tratam como texto). DataFrames já expandidos são devolvidos sem cópia.
+    """
+    if CENTS_COLUMN not in df.columns:
+        return df
+    expanded = df.drop(columns=[CENTS_COLUMN])
+    expanded[VALUE_COLUMN] = valor_em_reais(df)
+    return expanded
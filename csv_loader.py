@@ -0,0 +1,200 @@
+# csv_loader.py - LançAI: Leitura de CSV em Passagem Única (detecção de encoding/separador)
+
+import codecs
+import csv
+import io
+import logging
+import os
+import time
+from collections import Counter
+from typing import Dict, Any, Optional, Iterator, Tuple, Union, IO
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Bytes lidos do início (e do fim) do arquivo para detectar encoding e separador
+CSV_SNIFF_BYTES = int(os.getenv("LANCAI_CSV_SNIFF_KB", "64")) * 1024
+# Motor de leitura: 'auto' (pyarrow se instalado), 'pyarrow' ou 'c'
+CSV_ENGINE = os.getenv("LANCAI_CSV_ENGINE", "auto")
+# Separadores aceitos, na ordem de preferência em caso de empate
+CSV_DELIMITERS = (';', ',', '\t', '|')
+# Encoding usado quando o arquivo não é UTF-8 válido (exportações de ERPs brasileiros)
+CSV_FALLBACK_ENCODING = 'latin-1'
+
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+CsvSource = Union[str, IO[bytes]]
+
+
+def _read_samples(source: CsvSource, size: int) -> Tuple[bytes, bytes]:
+    """Lê uma amostra do início e outra do fim do arquivo (sem consumir o buffer)."""
+    handle = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        handle.seek(0)
+        head = handle.read(size)
+        tail = b''
+        if len(head) == size:
+            total = handle.seek(0, io.SEEK_END)
+            if total > size:
+                handle.seek(max(size, total - size))
+                tail = handle.read(size)
+        return head, tail
+    finally:
+        if isinstance(source, str):
+            handle.close()
+        else:
+            source.seek(0)
+
+
+def _is_utf8(sample: bytes) -> bool:
+    """Valida UTF-8 tolerando um caractere multibyte cortado no limite da amostra."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        decoder.decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_encoding(head: bytes, tail: bytes = b'') -> str:
+    """Detecta o encoding pelas amostras: BOM, UTF-8 válido ou o encoding de fallback."""
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    # A amostra do fim pode começar no meio de um caractere: descarta os bytes de continuação
+    tail = tail.lstrip(bytes(range(0x80, 0xC0)))
+    if _is_utf8(head) and _is_utf8(tail):
+        return 'utf-8'
+    return CSV_FALLBACK_ENCODING
+
+
+def detect_delimiter(text: str) -> str:
+    """
+    Escolhe o separador que gera a quantidade de colunas mais consistente entre as linhas
+    da amostra (respeitando aspas). Em caso de empate, vence o que gera mais colunas.
+    """
+    # A última linha da amostra pode estar cortada
+    if '\n' in text:
+        text = text[:text.rfind('\n')]
+    best_delimiter, best_score = ',', (0.0, 0)
+    for delimiter in CSV_DELIMITERS:
+        try:
+            counts = [len(row) for row in csv.reader(io.StringIO(text), delimiter=delimiter) if row]
+        except csv.Error:
+            continue
+        if not counts:
+            continue
+        n_columns, frequency = Counter(counts).most_common(1)[0]
+        if n_columns <= 1:
+            continue
+        score = (frequency / len(counts), n_columns)
+        if score > best_score:
+            best_delimiter, best_score = delimiter, score
+    return best_delimiter
+
+
+def sniff_csv(source: CsvSource, sample_bytes: int = CSV_SNIFF_BYTES) -> Dict[str, str]:
+    """Detecta encoding e separador a partir de amostras pequenas do arquivo."""
+    head, tail = _read_samples(source, sample_bytes)
+    encoding = detect_encoding(head, tail)
+    text = head.decode(encoding, errors='ignore')
+    return {'encoding': encoding, 'sep': detect_delimiter(text)}
+
+
+def _resolve_engine(engine: Optional[str]) -> str:
+    engine = (engine or CSV_ENGINE).lower()
+    if engine == 'auto':
+        return 'pyarrow' if PYARROW_AVAILABLE else 'c'
+    if engine == 'pyarrow' and not PYARROW_AVAILABLE:
+        logger.warning("pyarrow não instalado: usando o motor 'c' na leitura do CSV.")
+        return 'c'
+    return engine
+
+
+def _has_binary_columns(df: pd.DataFrame) -> bool:
+    for column in df.select_dtypes(include='object').columns:
+        values = df[column].dropna()
+        if not values.empty and isinstance(values.iloc[0], bytes):
+            return True
+    return False
+
+
+def read_csv_single_pass(
+    source: CsvSource,
+    encoding: Optional[str] = None,
+    sep: Optional[str] = None,
+    engine: Optional[str] = None,
+    dtype: Optional[Any] = None,
+    **read_csv_kwargs: Any
+) -> pd.DataFrame:
+    """
+    Lê o CSV uma única vez: encoding e separador vêm das amostras (ou dos parâmetros)
+    e a leitura usa o motor pyarrow quando disponível. Se o arquivo tiver bytes que não
+    são UTF-8 além das amostras, a leitura é refeita uma vez com o encoding de fallback.
+    """
+    name = source if isinstance(source, str) else getattr(source, 'name', 'buffer')
+    started = time.perf_counter()
+    dialect = sniff_csv(source) if encoding is None or sep is None else {}
+    encoding = encoding or dialect['encoding']
+    sep = sep or dialect['sep']
+    engine = _resolve_engine(engine)
+    sniffed = time.perf_counter()
+
+    def parse(current_encoding: str) -> pd.DataFrame:
+        if not isinstance(source, str):
+            source.seek(0)
+        return pd.read_csv(source, encoding=current_encoding, sep=sep, engine=engine, dtype=dtype, **read_csv_kwargs)
+
+    try:
+        df = parse(encoding)
+        # O pyarrow não falha com UTF-8 inválido: a coluna afetada vem como binária
+        if engine == 'pyarrow' and encoding != CSV_FALLBACK_ENCODING and _has_binary_columns(df):
+            raise UnicodeDecodeError(encoding, b'', 0, 1, 'coluna binária na leitura do pyarrow')
+    except UnicodeDecodeError:
+        if encoding == CSV_FALLBACK_ENCODING:
+            raise
+        logger.warning("CSV %s: bytes inválidos em %s fora da amostra; relendo como %s.", name, encoding, CSV_FALLBACK_ENCODING)
+        encoding = CSV_FALLBACK_ENCODING
+        df = parse(encoding)
+    parsed = time.perf_counter()
+
+    logger.info(
+        "CSV %s: encoding=%s, separador=%r, motor=%s | detecção %.1f ms, leitura %.1f ms | %d linhas x %d colunas.",
+        name, encoding, sep, engine, (sniffed - started) * 1000, (parsed - sniffed) * 1000, len(df), len(df.columns)
+    )
+    return df
+
+
+def iter_csv_chunks(
+    source: CsvSource,
+    chunk_rows: int,
+    encoding: Optional[str] = None,
+    sep: Optional[str] = None,
+    dtype: Optional[Any] = None,
+    **read_csv_kwargs: Any
+) -> Iterator[pd.DataFrame]:
+    """
+    Modo em blocos para arquivos maiores que a memória: devolve DataFrames de até
+    chunk_rows linhas (motor 'c', o único com leitura em blocos no pandas).
+    """
+    name = source if isinstance(source, str) else getattr(source, 'name', 'buffer')
+    dialect = sniff_csv(source) if encoding is None or sep is None else {}
+    encoding = encoding or dialect['encoding']
+    sep = sep or dialect['sep']
+    # Em blocos não há como reler do início: bytes inválidos viram o caractere de substituição
+    started = time.perf_counter()
+    total_rows = 0
+    with pd.read_csv(
+        source, encoding=encoding, encoding_errors='replace', sep=sep, engine='c',
+        dtype=dtype, chunksize=chunk_rows, **read_csv_kwargs
+    ) as reader:
+        for chunk in reader:
+            total_rows += len(chunk)
+            yield chunk
+    logger.info(
+        "CSV %s (em blocos de %d linhas): encoding=%s, separador=%r | %d linhas em %.1f ms.",
+        name, chunk_rows, encoding, sep, total_rows, (time.perf_counter() - started) * 1000
+    )
@@ -2,16 +2,47 @@
 
 import zipfile
 import os
+import time
+import shutil
+import tempfile
+import atexit
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import xml.etree.ElementTree as ET
 import pandas as pd
-import streamlit as st
-from typing import Dict, Any, Optional, Any
+from typing import Dict, Any, Optional, List, Tuple, Union, IO, Callable, Iterator
 from io import BytesIO
+from rules_engine import CompiledRules, load_compiled_rules
+from csv_loader import read_csv_single_pass
+from ledger_store import LedgerStore, ledger_store, nfe_key_from_filename
+from compact_dtypes import compact_lancamentos
+from audit import build_audit_report, duplicate_keys_section
+from metrics import metrics, StageCancelled
+
+logger = logging.getLogger(__name__)
 
 # --- CONFIGURAÇÃO DE PASTAS ---
 TEMP_FOLDER = "./temp_data"
 if not os.path.exists(TEMP_FOLDER):
     os.makedirs(TEMP_FOLDER)
+# Cada sessão usa uma subpasta própria de TEMP_FOLDER; as abandonadas há mais tempo que isto são removidas
+WORKSPACE_PREFIX = "sessao_"
+WORKSPACE_TTL_SECONDS = int(os.getenv("LANCAI_WORKSPACE_TTL_HOURS", "24")) * 3600
+
+# --- CONFIGURAÇÃO DO PARSING PARALELO DE XML ---
+# LANCAI_XML_WORKERS=0 (padrão) usa todos os núcleos; 1 desativa o pool de processos.
+XML_PARSER_WORKERS = int(os.getenv("LANCAI_XML_WORKERS", "0")) or (os.cpu_count() or 1)
+# Quantidade de XMLs enviada a cada processo de trabalho por vez
+XML_BATCH_SIZE = int(os.getenv("LANCAI_XML_BATCH_SIZE", "500"))
+# Parser de NF-e padrão: 'fast' (leitura única, sem árvore dos itens repetidos) ou 'etree' (referência)
+XML_PARSER = os.getenv("LANCAI_XML_PARSER", "fast")
+# CSV/XLSX de um mesmo ZIP lidos ao mesmo tempo (threads: o motor pyarrow e o parser C liberam o GIL)
+DATA_FILE_WORKERS = int(os.getenv("LANCAI_DATA_FILE_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+# Coluna com o nome do arquivo de origem quando vários CSV/XLSX do ZIP são concatenados
+SOURCE_FILE_COLUMN = 'Arquivo_Origem'
 
 # --- REGRAS DO MÓDULO DE MAPEAMENTO (USADO PARA XML) ---
 MAPPING_RULES = {
@@ -22,149 +53,309 @@ MAPPING_RULES = {
     # ... (demais regras)
 }
 
+# Arquivo de regras (CSV ou JSON) com chaves compostas CFOP + NCM + CST + CNPJ do emitente,
+# intervalos/curingas e prioridade. Se não existir, vale o MAPPING_RULES acima.
+RULES_FILE = os.getenv("LANCAI_RULES_FILE", "./regras_contabeis.csv")
+_compiled_rules_cache: Dict[str, Any] = {'key': None, 'rules': None}
+_compiled_rules_lock = threading.Lock()
+
+def get_accounting_rules() -> CompiledRules:
+    """Retorna as regras compiladas, recompilando apenas quando o arquivo de regras muda."""
+    mtime = os.path.getmtime(RULES_FILE) if RULES_FILE and os.path.exists(RULES_FILE) else None
+    cache_key = (RULES_FILE, mtime)
+    with _compiled_rules_lock:
+        if _compiled_rules_cache['key'] != cache_key:
+            _compiled_rules_cache['rules'] = load_compiled_rules(RULES_FILE, MAPPING_RULES)
+            _compiled_rules_cache['key'] = cache_key
+        return _compiled_rules_cache['rules']
+
+def ingestion_config_signature() -> str:
+    """Assinatura da configuração que altera o resultado da ingestão (arquivo de regras e parser)."""
+    mtime = os.path.getmtime(RULES_FILE) if RULES_FILE and os.path.exists(RULES_FILE) else None
+    return f"{RULES_FILE}:{mtime}:{XML_PARSER}"
+
+# --------------------------------------------------------------------------------
+# --- ÁREAS DE TRABALHO POR SESSÃO ---
+# --------------------------------------------------------------------------------
+
+def cleanup_stale_workspaces(max_age_seconds: int = WORKSPACE_TTL_SECONDS) -> int:
+    """Remove as pastas de sessão sem uso há mais de max_age_seconds. Retorna quantas foram removidas."""
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(TEMP_FOLDER):
+        if not entry.is_dir() or not entry.name.startswith(WORKSPACE_PREFIX):
+            continue
+        try:
+            if now - entry.stat().st_mtime > max_age_seconds:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+def get_session_workspace(current: Optional[str] = None) -> str:
+    """
+    Retorna a pasta de trabalho da sessão: reaproveita a atual (marcando-a como em uso)
+    ou cria uma nova, isolada das demais sessões, dentro de TEMP_FOLDER.
+    """
+    if current and os.path.isdir(current):
+        os.utime(current)
+        return current
+    os.makedirs(TEMP_FOLDER, exist_ok=True)
+    cleanup_stale_workspaces()
+    return tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=TEMP_FOLDER)
+
+# --------------------------------------------------------------------------------
+# --- MENSAGENS E PROGRESSO (INDEPENDENTES DA INTERFACE) ---
+# --------------------------------------------------------------------------------
+
+class IngestionCancelled(StageCancelled):
+    """Ingestão interrompida a pedido do usuário (lançada pelo reporter em check_cancelled)."""
+
+
+class IngestionReporter:
+    """
+    Destino das mensagens e do progresso da ingestão. O padrão registra tudo no log
+    (uso em linha de comando); os jobs em segundo plano (ingestion_jobs.JobReporter)
+    guardam as mensagens e o progresso para a interface e atendem ao cancelamento.
+    """
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = f"[{prefix}] " if prefix else ''
+
+    def error(self, message: str) -> None:
+        logger.error("%s%s", self.prefix, message)
+
+    def warning(self, message: str) -> None:
+        logger.warning("%s%s", self.prefix, message)
+
+    def info(self, message: str) -> None:
+        logger.info("%s%s", self.prefix, message)
+
+    def progress(self, done: int, total: int, text: str) -> None:
+        logger.debug("%s%s: %d de %d", self.prefix, text, done, total)
+
+    def progress_done(self) -> None:
+        pass
+
+    def check_cancelled(self) -> None:
+        """Ponto de interrupção entre etapas: lança IngestionCancelled se o cancelamento foi pedido."""
+        pass
+
+
+class CollectingReporter(IngestionReporter):
+    """Registra no log e guarda os erros e avisos (ex.: por arquivo, para um relatório ou resumo final)."""
+
+    def __init__(self, prefix: str = ''):
+        super().__init__(prefix)
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+
+    def error(self, message: str) -> None:
+        super().error(message)
+        self.errors.append(message)
+
+    def warning(self, message: str) -> None:
+        super().warning(message)
+        self.warnings.append(message)
+
+
+default_reporter = IngestionReporter()
+
 # --------------------------------------------------------------------------------
 # --- LÓGICA DE PROCESSAMENTO CSV/XLSX (VISUALIZAÇÃO DE DADOS) ---
 # --------------------------------------------------------------------------------
 
-def load_and_validate_csv(filepath: str) -> Optional[pd.DataFrame]:
+@metrics.timed('load_and_validate_csv')
+def load_and_validate_csv(
+    source: Union[str, bytes, IO[bytes]],
+    filename: Optional[str] = None,
+    reporter: Optional[IngestionReporter] = None
+) -> Optional[pd.DataFrame]:
     """
-    Carrega o DataFrame a partir do caminho do arquivo (CSV ou XLSX), 
-    tentando diferentes encodings e delimitadores para resolver problemas de leitura.
+    Carrega o DataFrame a partir do caminho do arquivo, dos bytes ou de um buffer em memória (CSV ou XLSX).
+    O CSV é lido uma única vez, com encoding e separador detectados por amostras (ver csv_loader).
     """
+    reporter = reporter or default_reporter
+    filename = filename or (source if isinstance(source, str) else getattr(source, 'name', ''))
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
     try:
-        if filepath.lower().endswith(('.xlsx', '.xls')):
+        if filename.lower().endswith(('.xlsx', '.xls')):
             # Leitura de Excel (normalmente não tem problemas de encoding)
-            df = pd.read_excel(filepath)
+            df = pd.read_excel(source)
             
-        elif filepath.lower().endswith('.csv'):
-            # Tenta diferentes encodings e delimitadores para CSV
-            encodings_to_try = ['utf-8', 'latin-1', 'iso-8859-1']
-            delimiters_to_try = [',', ';']
-            df = None
-            
-            for encoding in encodings_to_try:
-                for delimiter in delimiters_to_try:
-                    try:
-                        # Tenta ler com a combinação atual de encoding e delimiter
-                        df = pd.read_csv(filepath, encoding=encoding, sep=delimiter)
-                        # Se a leitura for bem-sucedida e o DataFrame não estiver vazio, para o loop
-                        if not df.empty:
-                            # Heurística de validação: se tiver muitas colunas (indicando delimiter errado), tenta o próximo
-                            if len(df.columns) > 1 and len(df.columns) < 50: # Assume um limite razoável de colunas
-                                break # Sucesso na leitura
-                            elif len(df.columns) == 1 and delimiter == ',':
-                                # Se só tem 1 coluna, mas esperava vírgula, tenta ponto e vírgula na próxima
-                                continue
-                            elif len(df.columns) > 1:
-                                break
-                    except Exception:
-                        continue # Tenta a próxima combinação
-                if df is not None and not df.empty and len(df.columns) > 1:
-                    break
+        elif filename.lower().endswith('.csv'):
+            # Leitura única: encoding e separador detectados por amostras do arquivo
+            try:
+                df = read_csv_single_pass(source)
+            except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError, ValueError):
+                df = None
             
             if df is None or df.empty:
-                st.error("Falha ao ler o arquivo CSV. Verifique a codificação (encoding) e o separador (vírgula ou ponto e vírgula).")
+                reporter.error("Falha ao ler o arquivo CSV. Verifique a codificação (encoding) e o separador (vírgula ou ponto e vírgula).")
                 return None
         
         else:
-            st.error("Formato de arquivo não suportado para visualização.")
+            reporter.error("Formato de arquivo não suportado para visualização.")
             return None
         
         # Validação final
         if df.empty:
-            st.error("O arquivo de dados está vazio. Não foi possível carregar os dados.")
+            reporter.error("O arquivo de dados está vazio. Não foi possível carregar os dados.")
             return None
             
+        metrics.increment('rows_total', len(df), stage='load_and_validate_csv')
         return df
         
     except Exception as e:
         # Erro genérico de leitura
-        st.error(f"Erro ao ler ou processar o arquivo de dados. Detalhes: {type(e).__name__} - {e}")
+        reporter.error(f"Erro ao ler ou processar o arquivo de dados. Detalhes: {type(e).__name__} - {e}")
         return None
 
-def find_first_data_file(zip_ref: zipfile.ZipFile) -> Optional[str]:
-    """Encontra o primeiro arquivo de dados (CSV ou XLSX) dentro do ZIP."""
-    for name in zip_ref.namelist():
-        lower_name = name.lower()
-        if lower_name.endswith(('.csv', '.xlsx')):
-            return name
-    return None
+def split_zip_members(zip_ref: zipfile.ZipFile) -> Tuple[List[str], List[str]]:
+    """Separa os membros do ZIP em XMLs (LançAI) e arquivos de dados (CSV/XLSX)."""
+    xml_members, data_members = [], []
+    for info in zip_ref.infolist():
+        if info.is_dir():
+            continue
+        lower_name = info.filename.lower()
+        if lower_name.endswith('.xml'):
+            xml_members.append(info.filename)
+        elif lower_name.endswith(('.csv', '.xlsx')):
+            data_members.append(info.filename)
+    return xml_members, data_members
 
-def unpack_data_zip(uploaded_zip_file: Any) -> Optional[str]:
-    """Descompacta o primeiro arquivo CSV/XLSX de um ZIP para o Módulo de Visualização."""
-    
-    zip_path = os.path.join(TEMP_FOLDER, uploaded_zip_file.name)
-    
+@metrics.timed('open_upload_zip')
+def open_upload_zip(uploaded_zip_file: Any, reporter: Optional[IngestionReporter] = None) -> Optional[zipfile.ZipFile]:
+    """
+    Abre o ZIP uma única vez: caminho em disco, bytes ou buffer em memória (como o arquivo
+    enviado pelo Streamlit), sem gravar o arquivo na pasta temporária.
+    """
+    reporter = reporter or default_reporter
     try:
-        # Garante que o buffer do arquivo enviado seja salvo no sistema de arquivos
-        with open(zip_path, "wb") as f:
-            f.write(uploaded_zip_file.getbuffer())
-
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            first_data_file = find_first_data_file(zip_ref)
-            
-            if first_data_file:
-                # Extrai apenas o primeiro arquivo de dados encontrado
-                zip_ref.extract(first_data_file, TEMP_FOLDER)
-                return os.path.join(TEMP_FOLDER, first_data_file)
-            else:
-                return None
+        if isinstance(uploaded_zip_file, (str, os.PathLike)):
+            return zipfile.ZipFile(uploaded_zip_file, 'r')
+        if isinstance(uploaded_zip_file, (bytes, bytearray, memoryview)):
+            return zipfile.ZipFile(BytesIO(uploaded_zip_file), 'r')
+        # O UploadedFile do Streamlit já é um buffer em memória (BytesIO)
+        uploaded_zip_file.seek(0)
+        return zipfile.ZipFile(uploaded_zip_file, 'r')
     except zipfile.BadZipFile as e:
-        st.error(f"Erro ao descompactar o arquivo ZIP: Arquivo corrompido ou formato inválido. Detalhes: {e}")
+        reporter.error(f"Erro ao descompactar o arquivo ZIP: Arquivo corrompido ou formato inválido. Detalhes: {e}")
         return None
     except Exception as e:
-        st.error(f"Erro ao descompactar o arquivo ZIP (para dados): {e}")
+        reporter.error(f"Erro ao descompactar o arquivo ZIP: {e}")
         return None
-    finally:
-        # CORREÇÃO CRÍTICA: Lida com PermissionError (WinError 32)
-        if os.path.exists(zip_path):
-            try:
-                os.remove(zip_path)
-            except Exception:
-                # Ignora a exceção se não conseguir remover imediatamente (arquivo em uso)
-                pass
+
+def _load_data_member(zip_ref: zipfile.ZipFile, member: str) -> Tuple[Optional[pd.DataFrame], Dict[str, Any]]:
+    """Lê um CSV/XLSX direto do ZIP (executado nas threads de load_data_members)."""
+    started = time.perf_counter()
+    member_reporter = CollectingReporter(prefix=member)
+    try:
+        df = load_and_validate_csv(BytesIO(zip_ref.read(member)), member, member_reporter)
+    except Exception as e:
+        # Ex.: membro corrompido no ZIP (erro de CRC)
+        member_reporter.error(f"Erro ao descompactar o arquivo: {type(e).__name__} - {e}")
+        df = None
+    report = {
+        'Arquivo': member,
+        'Linhas': len(df) if df is not None else 0,
+        'Colunas': len(df.columns) if df is not None else 0,
+        'Tempo (s)': round(time.perf_counter() - started, 3),
+        'Status': 'ok' if df is not None else 'falha',
+        'Erro': member_reporter.errors[-1] if member_reporter.errors else '',
+    }
+    return df, report
+
+@metrics.timed('load_data_members')
+def load_data_members(
+    zip_ref: zipfile.ZipFile,
+    data_members: List[str],
+    max_workers: Optional[int] = None,
+    reporter: Optional[IngestionReporter] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Lê todos os CSV/XLSX do ZIP ao mesmo tempo (direto do arquivo em memória) e concatena
+    os resultados na ordem do ZIP. As colunas são alinhadas pelo nome (sem espaços nas pontas):
+    colunas ausentes em um arquivo ficam vazias nas linhas dele. Com mais de um arquivo, a coluna
+    SOURCE_FILE_COLUMN indica a origem de cada linha. O relatório por arquivo (linhas, tempo,
+    falha) fica em df.attrs['arquivos_origem']. Retorna None se nenhum arquivo pôde ser lido.
+    """
+    reporter = reporter or default_reporter
+    if not data_members:
+        return None
+    max_workers = max(1, min(max_workers or DATA_FILE_WORKERS, len(data_members)))
+
+    loaded: Dict[str, Tuple[Optional[pd.DataFrame], Dict[str, Any]]] = {}
+    reporter.progress(0, len(data_members), "Lendo arquivos de dados")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lancai-dados") as pool:
+        futures = {pool.submit(_load_data_member, zip_ref, member): member for member in data_members}
+        try:
+            for future in as_completed(futures):
+                loaded[futures[future]] = future.result()
+                reporter.progress(len(loaded), len(data_members), "Lendo arquivos de dados")
+        except BaseException:
+            # Cancelamento (ou falha inesperada): os arquivos ainda não iniciados são descartados
+            for future in futures:
+                future.cancel()
+            raise
+    reporter.progress_done()
+
+    frames, file_report = [], []
+    for member in data_members:
+        df, report = loaded[member]
+        file_report.append(report)
+        if df is not None:
+            df.columns = [str(column).strip() for column in df.columns]
+            if len(data_members) > 1:
+                df.insert(0, SOURCE_FILE_COLUMN, member)
+            frames.append(df)
+
+    failed = [report for report in file_report if report['Status'] != 'ok']
+    if failed:
+        reporter.warning(
+            f"{len(failed)} de {len(data_members)} arquivos de dados não puderam ser lidos: "
+            + "; ".join(f"{report['Arquivo']} ({report['Erro']})" for report in failed)
+        )
+    if not frames:
+        return None
+
+    if len(frames) > 1:
+        column_sets = [set(frame.columns) for frame in frames]
+        partial_columns = sorted(set.union(*column_sets) - set.intersection(*column_sets))
+        if partial_columns:
+            reporter.warning(f"Colunas presentes em apenas parte dos arquivos (vazias nos demais): {', '.join(partial_columns)}")
+    df = pd.concat(frames, ignore_index=True, sort=False) if len(frames) > 1 else frames[0]
+    if SOURCE_FILE_COLUMN in df.columns:
+        df[SOURCE_FILE_COLUMN] = df[SOURCE_FILE_COLUMN].astype('category')
+
+    df.attrs['arquivos_origem'] = file_report
+    reporter.info(f"{len(frames)} de {len(data_members)} arquivos de dados carregados ({len(df)} linhas).")
+    return df
 
 
 # --------------------------------------------------------------------------------
 # --- LÓGICA DE PROCESSAMENTO XML (MÓDULO CONTÁBIL-FISCAL) ---
 # --------------------------------------------------------------------------------
 
-def unpack_xml_zip_lancai(uploaded_zip_file: Any) -> bool:
-    """Descompacta um arquivo ZIP e salva os XMLs na pasta temporária para o LançAI."""
-    zip_path = os.path.join(TEMP_FOLDER, uploaded_zip_file.name)
-    try:
-        with open(zip_path, "wb") as f:
-            f.write(uploaded_zip_file.getbuffer())
-
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            xml_files = [f for f in zip_ref.namelist() if f.lower().endswith('.xml')]
-            
-            if not xml_files:
-                return False
-
-            zip_ref.extractall(TEMP_FOLDER, members=xml_files)
-        
-        return True
-    except zipfile.BadZipFile as e:
-        st.error(f"Erro ao descompactar o arquivo ZIP (XML): Arquivo corrompido ou formato inválido. Detalhes: {e}")
-        return False
-    except Exception as e:
-        st.error(f"Erro ao descompactar o arquivo ZIP (XML): {e}")
-        return False
-    finally:
-        # CORREÇÃO CRÍTICA: Lida com PermissionError (WinError 32)
-        if os.path.exists(zip_path):
-            try:
-                os.remove(zip_path)
-            except Exception:
-                # Ignora a exceção se não conseguir remover imediatamente (arquivo em uso)
-                pass
+@metrics.timed('unpack_xml_zip_lancai')
+def unpack_xml_zip_lancai(zip_ref: zipfile.ZipFile) -> List[str]:
+    """Lista os XMLs do ZIP (aberto em memória) que serão processados pelo LançAI."""
+    xml_members, _ = split_zip_members(zip_ref)
+    metrics.increment('xml_files_total', len(xml_members), status='found')
+    return xml_members
 
 
-def parse_xml_to_dict(xml_path: str) -> Optional[Dict[str, Any]]:
-    """Analisa um XML de NF-e e extrai campos fiscais chave (CFOP, Valor, Emitente)."""
+def parse_xml_to_dict(xml_source: Union[str, IO[bytes]], xml_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Analisa um XML de NF-e e extrai campos fiscais chave (CFOP, NCM, CST, Valor, Emitente, Data de Emissão).
+    Aceita um caminho em disco ou um arquivo aberto diretamente do ZIP.
+    """
+    if xml_name is None:
+        xml_name = xml_source if isinstance(xml_source, str) else getattr(xml_source, 'name', '')
     try:
-        tree = ET.parse(xml_path)
+        tree = ET.parse(xml_source)
         root = tree.getroot()
         namespace = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
         inf_nfe = root.find('.//nfe:infNFe', namespace)
@@ -184,68 +375,448 @@ def parse_xml_to_dict(xml_path: str) -> Optional[Dict[str, Any]]:
         x_nome_emit_elem = root.find('.//nfe:emit/nfe:xNome', namespace)
         nome_emitente = x_nome_emit_elem.text if x_nome_emit_elem is not None else 'Emitente Desconhecido'
 
+        # Chaves adicionais usadas pelo motor de regras (CNPJ do emitente, NCM e CST do primeiro item)
+        cnpj_emit_elem = root.find('.//nfe:emit/nfe:CNPJ', namespace)
+        cnpj_emitente = cnpj_emit_elem.text if cnpj_emit_elem is not None else ''
+        ncm_elem = root.find('.//nfe:det/nfe:prod/nfe:NCM', namespace)
+        ncm = ncm_elem.text if ncm_elem is not None else ''
+        cst_elem = root.find('.//nfe:det/nfe:imposto/nfe:ICMS/*/nfe:CST', namespace)
+        if cst_elem is None:
+            # Empresas do Simples Nacional informam CSOSN no lugar do CST
+            cst_elem = root.find('.//nfe:det/nfe:imposto/nfe:ICMS/*/nfe:CSOSN', namespace)
+        cst = cst_elem.text if cst_elem is not None else ''
+        # Data de emissão (dhEmi na NF-e 3.10/4.00, dEmi nas versões anteriores): define o período
+        dh_emi_elem = root.find('.//nfe:ide/nfe:dhEmi', namespace)
+        if dh_emi_elem is None:
+            dh_emi_elem = root.find('.//nfe:ide/nfe:dEmi', namespace)
+        data_emissao = (dh_emi_elem.text or '')[:10] if dh_emi_elem is not None else ''
+
         return {
             'NFe_Chave': chave_nfe,
             'Emissor': nome_emitente,
+            'Emissor_CNPJ': cnpj_emitente,
             'CFOP_Principal': cfop,
+            'NCM_Principal': ncm,
+            'CST_Principal': cst,
             'Valor_Total': valor_total,
-            'XML_Path': os.path.basename(xml_path)
+            'Data_Emissao': data_emissao,
+            'XML_Path': os.path.basename(xml_name)
         }
     except Exception:
         # Erro de parsing (XML inválido ou não NF-e esperado)
         return None
 
-def apply_accounting_rules(df_parsed: pd.DataFrame) -> pd.DataFrame:
-    """Aplica as regras contábeis (débito/crédito) baseadas no CFOP."""
-    df_parsed['Conta_Debito'] = 'Regra Não Mapeada'
-    df_parsed['Conta_Credito'] = 'Regra Não Mapeada'
-    df_parsed['Valor_Lancamento'] = df_parsed['Valor_Total']
+# Parser rápido: caminhos de tags pré-compilados (namespace já resolvido), agrupados pelo
+# elemento que os contém. Cada caminho equivale a uma busca './/<contêiner>/<caminho>' do
+# parse_xml_to_dict; '*' aceita qualquer tag naquela posição.
+_NFE_TAG_PREFIX = '{http://www.portalfiscal.inf.br/nfe}'
 
-    def map_cfop_to_accounts(row):
-        cfop = str(row['CFOP_Principal'])
-        rule = MAPPING_RULES.get(cfop)
-        
-        if rule:
-            row['Conta_Debito'] = rule['DEBITO']
-            row['Conta_Credito'] = rule['CREDITO']
-            
-        return row
 
-    return df_parsed.apply(map_cfop_to_accounts, axis=1)
+def _nfe_path(*tags: str) -> Tuple[str, ...]:
+    return tuple(tag if tag == '*' else _NFE_TAG_PREFIX + tag for tag in tags)
 
-def process_xml_files() -> Optional[pd.DataFrame]:
-    """Orquestra a leitura, parsing e aplicação de regras nos XMLs."""
-    xml_files = [os.path.join(TEMP_FOLDER, f) for f in os.listdir(TEMP_FOLDER) if f.lower().endswith('.xml')]
-    
-    if not xml_files:
+
+_TAG_INF_NFE = _NFE_TAG_PREFIX + 'infNFe'
+_TAG_DET = _NFE_TAG_PREFIX + 'det'
+_FAST_PATHS: Dict[str, Tuple[Tuple[str, Tuple[str, ...]], ...]] = {
+    _TAG_DET: (
+        ('CFOP', _nfe_path('prod', 'CFOP')),
+        ('NCM', _nfe_path('prod', 'NCM')),
+        ('CST', _nfe_path('imposto', 'ICMS', '*', 'CST')),
+        ('CSOSN', _nfe_path('imposto', 'ICMS', '*', 'CSOSN')),
+    ),
+    _NFE_TAG_PREFIX + 'emit': (('xNome', _nfe_path('xNome')), ('CNPJ', _nfe_path('CNPJ'))),
+    _NFE_TAG_PREFIX + 'ide': (('dhEmi', _nfe_path('dhEmi')), ('dEmi', _nfe_path('dEmi'))),
+    _NFE_TAG_PREFIX + 'ICMSTot': (('vNF', _nfe_path('vNF')),),
+}
+# Campos alternativos: só são procurados enquanto o campo principal não aparece no documento
+_FALLBACK_OF = {'CSOSN': 'CST', 'dEmi': 'dhEmi'}
+# Tamanho dos blocos entregues ao parser (os <det> já lidos são descartados entre um bloco e outro)
+_FAST_PARSER_CHUNK_BYTES = 64 * 1024
+
+
+def _first_at_path(elem: ET.Element, path: Tuple[str, ...]) -> Optional[ET.Element]:
+    """Primeiro elemento no caminho de tags a partir dos filhos de elem, na ordem do documento (como o find)."""
+    tag, rest = path[0], path[1:]
+    for child in (list(elem) if tag == '*' else elem.findall(tag)):
+        if not rest:
+            return child
+        found = _first_at_path(child, rest)
+        if found is not None:
+            return found
+    return None
+
+
+def _pull_events(data: bytes) -> Iterator[Tuple[str, ET.Element]]:
+    """Eventos 'end' do documento, entregue ao parser em blocos (os eventos de um bloco saem antes do próximo)."""
+    parser = ET.XMLPullParser(events=('end',))
+    for offset in range(0, len(data), _FAST_PARSER_CHUNK_BYTES):
+        parser.feed(data[offset:offset + _FAST_PARSER_CHUNK_BYTES])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def parse_nfe_fast(xml_source: Union[str, IO[bytes]], xml_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Versão rápida do parse_xml_to_dict, com o mesmo resultado, em uma única passagem do
+    parser incremental do ElementTree (XMLPullParser, a base do iterparse): ao fechar
+    cada contêiner (det, emit, ide, ICMSTot), os campos ainda pendentes são lidos pelos
+    caminhos de tags do próprio contêiner, e cada <det> é descartado (clear) logo em seguida.
+    Não há buscas './/' na árvore inteira; o documento é lido até o fim, então XMLs
+    malformados continuam sendo recusados.
+    """
+    if xml_name is None:
+        xml_name = xml_source if isinstance(xml_source, str) else getattr(xml_source, 'name', '')
+    try:
+        if isinstance(xml_source, str):
+            with open(xml_source, 'rb') as f:
+                data = f.read()
+        else:
+            data = xml_source.read()
+
+        found: Dict[str, Tuple[ET.Element, Optional[str]]] = {}
+        inf_nfe = elem = None
+        for _, elem in _pull_events(data):
+            tag = elem.tag
+            paths = _FAST_PATHS.get(tag)
+            if paths is None:
+                if tag == _TAG_INF_NFE and inf_nfe is None:
+                    inf_nfe = elem
+                continue
+            for field, path in paths:
+                if field in found or _FALLBACK_OF.get(field) in found:
+                    continue
+                target = _first_at_path(elem, path)
+                if target is not None:
+                    found[field] = (elem, target.text)
+            if tag == _TAG_DET:
+                elem.clear()
+
+        # O último elemento fechado é a raiz: as buscas './/' nunca partem dela
+        root = elem
+        if inf_nfe is None or inf_nfe is root:
+            return None
+        values = {field: text for field, (container, text) in found.items() if container is not root}
+
+        v_total = values.get('vNF')
+        cst = values['CST'] if 'CST' in values else values.get('CSOSN', '')
+        dh_emi = values['dhEmi'] if 'dhEmi' in values else values.get('dEmi')
+        return {
+            'NFe_Chave': inf_nfe.attrib.get('Id', '').replace('NFe', ''),
+            'Emissor': values.get('xNome', 'Emitente Desconhecido'),
+            'Emissor_CNPJ': values.get('CNPJ', ''),
+            'CFOP_Principal': values.get('CFOP', "0000"),
+            'NCM_Principal': values.get('NCM', ''),
+            'CST_Principal': cst,
+            'Valor_Total': float(v_total) if v_total else 0.0,
+            'Data_Emissao': (dh_emi or '')[:10],
+            'XML_Path': os.path.basename(xml_name)
+        }
+    except Exception:
+        # Erro de parsing (XML inválido ou não NF-e esperado)
         return None
-        
-    parsed_data = []
-    
-    # 1. Parsing dos XMLs
-    parsing_bar = st.progress(0, text="Analisando XMLs...")
-    for i, xml_file in enumerate(xml_files):
-        data = parse_xml_to_dict(xml_file)
+
+# Parsers disponíveis (o 'etree' é mantido como referência para testes de equivalência)
+XML_PARSERS: Dict[str, Callable[..., Optional[Dict[str, Any]]]] = {
+    'fast': parse_nfe_fast,
+    'etree': parse_xml_to_dict,
+}
+
+def get_xml_parser(name: Optional[str] = None) -> Callable[..., Optional[Dict[str, Any]]]:
+    """Retorna a função de parsing de NF-e pelo nome (padrão: XML_PARSER)."""
+    name = name or XML_PARSER
+    if name not in XML_PARSERS:
+        raise ValueError(f"Parser de XML desconhecido: '{name}'. Opções: {', '.join(XML_PARSERS)}.")
+    return XML_PARSERS[name]
+
+def _parse_xml_batch(batch: List[Tuple[str, bytes]], parser: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Analisa um lote de XMLs já lidos do ZIP (executado dentro dos processos de trabalho)."""
+    parse = get_xml_parser(parser)
+    parsed = []
+    for member, content in batch:
+        data = parse(BytesIO(content), member)
         if data:
-            parsed_data.append(data)
-        parsing_bar.progress((i + 1) / len(xml_files), text=f"Analisando XMLs: {i+1} de {len(xml_files)}")
-    parsing_bar.empty()
+            parsed.append(data)
+    return parsed
+
+# Pool de processos compartilhado por todas as sessões (criado no primeiro uso)
+_parser_pool: Optional[ProcessPoolExecutor] = None
+_parser_pool_workers = 0
+_parser_pool_lock = threading.Lock()
+
+def _get_parser_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Retorna o pool de parsing, recriando-o se o número de workers mudar."""
+    global _parser_pool, _parser_pool_workers
+    with _parser_pool_lock:
+        if _parser_pool is None or _parser_pool_workers != max_workers:
+            if _parser_pool is not None:
+                _parser_pool.shutdown(wait=False, cancel_futures=True)
+            # 'spawn' evita o fork de um servidor Streamlit com várias threads e se comporta igual no Windows
+            _parser_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _parser_pool_workers = max_workers
+        return _parser_pool
+
+def _reset_parser_pool() -> None:
+    """Descarta o pool atual (ex.: após um worker encerrar de forma inesperada)."""
+    global _parser_pool
+    with _parser_pool_lock:
+        if _parser_pool is not None:
+            _parser_pool.shutdown(wait=False, cancel_futures=True)
+        _parser_pool = None
+
+atexit.register(_reset_parser_pool)
+
+def parse_xml_members(
+    zip_ref: zipfile.ZipFile,
+    xml_members: List[str],
+    max_workers: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    parser: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Analisa os XMLs do ZIP em lotes distribuídos entre os núcleos disponíveis.
+    O progresso é reportado a cada lote concluído via progress_callback(processados, total).
+    O parser é escolhido pelo nome em XML_PARSERS (padrão: XML_PARSER).
+    A ordem do resultado segue a ordem dos membros no ZIP.
+    """
+    max_workers = max_workers or XML_PARSER_WORKERS
+    parser = parser or XML_PARSER
+    get_xml_parser(parser)  # valida o nome antes de distribuir os lotes
+    batch_size = max(1, batch_size or XML_BATCH_SIZE)
+    total = len(xml_members)
+    batches = [xml_members[i:i + batch_size] for i in range(0, total, batch_size)]
+
+    def read_batch(members: List[str]) -> List[Tuple[str, bytes]]:
+        return [(member, zip_ref.read(member)) for member in members]
+
+    # Poucos XMLs (ou 1 worker): o custo de subir processos não compensa
+    if max_workers <= 1 or len(batches) <= 1:
+        parsed_data = []
+        done = 0
+        for members in batches:
+            parsed_data.extend(_parse_xml_batch(read_batch(members), parser))
+            done += len(members)
+            if progress_callback:
+                progress_callback(done, total)
+        return parsed_data
+
+    results: Dict[int, List[Dict[str, Any]]] = {}
+    done = 0
+    try:
+        pool = _get_parser_pool(max_workers)
+        pending = {}
+        next_batch = 0
+        # Mantém no máximo 2 lotes por worker em memória ao mesmo tempo
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) < max_workers * 2:
+                future = pool.submit(_parse_xml_batch, read_batch(batches[next_batch]), parser)
+                pending[future] = next_batch
+                next_batch += 1
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = pending.pop(future)
+                results[index] = future.result()
+                done += len(batches[index])
+                if progress_callback:
+                    progress_callback(done, total)
+    except BrokenProcessPool:
+        # Um worker morreu: descarta o pool e conclui os lotes restantes no processo atual
+        _reset_parser_pool()
+        for index, members in enumerate(batches):
+            if index not in results:
+                results[index] = _parse_xml_batch(read_batch(members), parser)
+                done += len(members)
+                if progress_callback:
+                    progress_callback(done, total)
+
+    return [data for index in range(len(batches)) for data in results[index]]
+
+@metrics.timed('apply_accounting_rules')
+def apply_accounting_rules(df_parsed: pd.DataFrame, rules: Optional[CompiledRules] = None) -> pd.DataFrame:
+    """
+    Aplica as regras contábeis (débito/crédito) baseadas no CFOP, NCM, CST e CNPJ do emitente.
+    As regras compiladas são aplicadas de forma vetorizada (merge por grupo de chaves).
+    """
+    rules = rules or get_accounting_rules()
+    debito, credito = rules.apply(df_parsed)
+    df_parsed['Conta_Debito'] = debito
+    df_parsed['Conta_Credito'] = credito
+    df_parsed['Valor_Lancamento'] = df_parsed['Valor_Total']
+    metrics.increment('rows_total', len(df_parsed), stage='apply_accounting_rules')
+    return df_parsed
+
+@metrics.timed('process_xml_files')
+def process_xml_files(
+    zip_ref: zipfile.ZipFile,
+    xml_members: List[str],
+    max_workers: Optional[int] = None,
+    ledger: Optional[LedgerStore] = None,
+    reporter: Optional[IngestionReporter] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Orquestra a leitura (direto do ZIP em memória), parsing e aplicação de regras nos XMLs.
+    Com a base de notas ativa, XMLs cuja chave (no nome do arquivo) já foi gravada não são
+    reprocessados: seus dados vêm da base. As notas novas são acrescentadas à base.
+    Com ou sem a base, a mesma chave de acesso enviada mais de uma vez gera um único lançamento.
+    """
+    if not xml_members:
+        return None
+    ledger = ledger or ledger_store
+    reporter = reporter or default_reporter
+
+    # 1. Notas já gravadas na base (chave de acesso no nome do arquivo) não passam pelo parsing
+    with metrics.timer('ledger_lookup'):
+        member_keys = {member: nfe_key_from_filename(member) for member in xml_members}
+        known_keys = ledger.known_keys(key for key in member_keys.values() if key)
+        members_to_parse = [member for member in xml_members if member_keys[member] not in known_keys]
+    metrics.increment('xml_files_total', len(xml_members) - len(members_to_parse), status='in_ledger')
+    if known_keys:
+        reporter.info(f"{len(xml_members) - len(members_to_parse)} XMLs já estavam na base de notas e não foram reprocessados.")
+
+    # 2. Parsing dos XMLs em paralelo (cada lote é lido direto do ZIP, sem passar pelo disco)
+    reporter.check_cancelled()
+    parsed_data: List[Dict[str, Any]] = []
+    if members_to_parse:
+        reporter.progress(0, len(members_to_parse), "Analisando XMLs")
+
+        def report_progress(done: int, total: int) -> None:
+            reporter.progress(done, total, "Analisando XMLs")
+
+        with metrics.timer('parse_xml_members', files=len(members_to_parse)):
+            parsed_data = parse_xml_members(zip_ref, members_to_parse, max_workers=max_workers, progress_callback=report_progress)
+        reporter.progress_done()
+        metrics.increment('xml_files_total', len(parsed_data), status='parsed')
+        metrics.increment('xml_files_total', len(members_to_parse) - len(parsed_data), status='invalid')
+
+    # Último ponto de cancelamento antes de gravar as notas novas na base
+    reporter.check_cancelled()
+    frames = []
+    with metrics.timer('ledger_sync'):
+        if parsed_data:
+            df_new = pd.DataFrame(parsed_data)
+            ledger.append(df_new)
+            frames.append(df_new)
+        if known_keys:
+            frames.append(ledger.load(keys=known_keys))
+    frames = [frame for frame in frames if not frame.empty]
     
-    if not parsed_data:
-        st.error("Nenhum XML válido de nota fiscal foi encontrado ou analisado com sucesso.")
+    if not frames:
+        reporter.error("Nenhum XML válido de nota fiscal foi encontrado ou analisado com sucesso.")
         return None
 
-    df_parsed = pd.DataFrame(parsed_data)
+    df_parsed = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
     
-    # 2. Aplicação das Regras
+    # 3. Aplicação das Regras
     df_lancamentos = apply_accounting_rules(df_parsed.copy())
-    
-    # 3. Limpeza dos arquivos temporários
-    # Adicionando try...except aqui também por segurança na limpeza dos XMLs
-    for f in xml_files:
-        try:
-            os.remove(f)
-        except Exception:
-            pass
+
+    # A mesma nota enviada mais de uma vez (no mesmo ZIP ou em nomes diferentes) gera um único
+    # lançamento, com ou sem a base de notas: o resultado da ingestão não depende de LANCAI_LEDGER.
+    # A auditoria conta as repetições antes do descarte (e quantas linhas foram descartadas)
+    duplicates = duplicate_keys_section(df_lancamentos)
+    with_key = df_lancamentos['NFe_Chave'].astype(str) != ''
+    kept = ~(with_key & df_lancamentos['NFe_Chave'].duplicated())
+    duplicates['removidas'] = int((~kept).sum())
+    df_lancamentos = df_lancamentos[kept].reset_index(drop=True)
+
+    # 4. Forma compacta para a sessão (categorias e valores em centavos)
+    with metrics.timer('compact_lancamentos'):
+        df_lancamentos, _ = compact_lancamentos(df_lancamentos)
+
+    # 5. Auditoria local (exibida na hora, antes da análise do LLM)
+    df_lancamentos.attrs['auditoria'] = build_audit_report(df_lancamentos, duplicates)
         
-    return df_lancamentos
\ No newline at end of file
+    return df_lancamentos
+
+
+@metrics.timed('load_ledger_lancamentos')
+def load_ledger_lancamentos(periods: Optional[List[str]] = None, ledger: Optional[LedgerStore] = None) -> Optional[pd.DataFrame]:
+    """Monta os lançamentos a partir da base de notas (todos os períodos ou os informados), sem reenviar arquivos."""
+    ledger = ledger or ledger_store
+    df_parsed = ledger.load(periods=periods)
+    if df_parsed.empty:
+        return None
+    df_lancamentos, _ = compact_lancamentos(apply_accounting_rules(df_parsed))
+    df_lancamentos.attrs['auditoria'] = build_audit_report(df_lancamentos)
+    return df_lancamentos
+
+
+# --------------------------------------------------------------------------------
+# --- PIPELINE COMPLETO DE UM ZIP (INTERFACE E LINHA DE COMANDO) ---
+# --------------------------------------------------------------------------------
+
+def ingest_zip(
+    source: Union[str, bytes, IO[bytes]],
+    ledger: Optional[LedgerStore] = None,
+    max_workers: Optional[int] = None,
+    reporter: Optional[IngestionReporter] = None,
+    allow_data_files: bool = True
+) -> Optional[Tuple[str, pd.DataFrame]]:
+    """
+    Processa um ZIP (caminho, bytes ou buffer): tenta o modo LançAI (XMLs de NF-e) e, sem
+    lançamentos válidos, todos os CSV/XLSX do ZIP concatenados (modo visualização, se allow_data_files).
+    Retorna (modo, DataFrame), com modo 'lancai' ou 'data_analysis', ou None se nada foi aproveitado.
+    """
+    reporter = reporter or default_reporter
+    zip_ref = open_upload_zip(source, reporter)
+    if zip_ref is None:
+        return None
+
+    with zip_ref:
+        # Tenta 1: MODO LANÇAI CONTÁBIL (XML)
+        xml_members = unpack_xml_zip_lancai(zip_ref)
+        reporter.check_cancelled()
+        if xml_members:
+            reporter.info(f"{len(xml_members)} XMLs encontrados. Processando lançamentos contábeis...")
+            df_lancamentos = process_xml_files(zip_ref, xml_members, max_workers=max_workers, ledger=ledger, reporter=reporter)
+            if df_lancamentos is not None:
+                return 'lancai', df_lancamentos
+            if allow_data_files:
+                reporter.warning("XMLs encontrados, mas o Agente LançAI não conseguiu gerar lançamentos válidos. Tentando modo Visualização de Dados...")
+
+        if not allow_data_files:
+            return None
+
+        # Tenta 2: MODO VISUALIZAÇÃO DE DADOS (TODOS OS CSV/XLSX DO ZIP, LIDOS EM PARALELO)
+        reporter.warning("Tentando ler CSV/XLSX para visualização...")
+        _, data_members = split_zip_members(zip_ref)
+        df = load_data_members(zip_ref, data_members, reporter=reporter)
+        if df is not None:
+            return 'data_analysis', df
+
+    return None
+
+
+def ingest_upload(
+    source: Union[str, bytes, IO[bytes]],
+    filename: str,
+    ledger: Optional[LedgerStore] = None,
+    max_workers: Optional[int] = None,
+    reporter: Optional[IngestionReporter] = None
+) -> Optional[Tuple[str, pd.DataFrame]]:
+    """
+    Arquivo enviado pela interface: CSV/XLSX direto (modo visualização) ou ZIP (ingest_zip).
+    Retorna (modo, DataFrame) ou None; as falhas são comunicadas pelo reporter.
+    """
+    reporter = reporter or default_reporter
+    file_name = filename.lower()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    # CENÁRIO 1: CSV/XLSX Direto (MODO VISUALIZAÇÃO)
+    if file_name.endswith(('.csv', '.xlsx')):
+        reporter.info("Arquivo de dados detectado. Carregando para visualização simples...")
+        df = load_and_validate_csv(source, filename, reporter)
+        return ('data_analysis', df) if df is not None else None
+
+    # CENÁRIO 2: ZIP (Tenta LançAI Contábil primeiro, depois Visualização)
+    if file_name.endswith('.zip'):
+        result = ingest_zip(source, ledger=ledger, max_workers=max_workers, reporter=reporter)
+        if result is None:
+            reporter.error("Falha ao processar o arquivo ZIP. Ele não continha XMLs de NF-e válidas para o LançAI nem arquivos CSV/XLSX para visualização de dados.")
+        return result
+
+    # CENÁRIO 3: NENHUM ARQUIVO VÁLIDO ENCONTRADO
+    reporter.warning("Nenhum modo de processamento foi ativado. Por favor, carregue um arquivo válido.")
+    return None
@@ -0,0 +1,164 @@
+# exporter.py - LançAI: Exportação dos Lançamentos (CSV, Parquet e Layout de Integração)
+
+import hashlib
+import os
+import pandas as pd
+from typing import Dict, List, Optional, Sequence, Tuple
+from compact_dtypes import CENTS_COLUMN, expand_lancamentos
+
+# Colunas exportadas (mesma ordem do CSV de integração original)
+EXPORT_COLUMNS = ['NFe_Chave', 'Emissor', 'CFOP_Principal', 'Conta_Debito', 'Conta_Credito', 'Valor_Lancamento']
+# Linhas convertidas por vez: o arquivo é escrito em blocos, sem montar o conteúdo inteiro em memória
+EXPORT_CHUNK_ROWS = int(os.getenv("LANCAI_EXPORT_CHUNK_ROWS", "50000"))
+EXPORT_FILE_PREFIX = "lancamentos_lancai_"
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Layout posicional para importação em sistemas contábeis: (campo, largura, alinhamento)
+# Contas exportadas apenas pelo código (parte antes de " - "); valor em centavos, com zeros à esquerda
+FIXED_WIDTH_LAYOUT: List[Tuple[str, int, str]] = [
+    ('NFe_Chave', 44, 'left'),
+    ('Data_Emissao', 8, 'left'),
+    ('CFOP_Principal', 4, 'left'),
+    ('Conta_Debito', 20, 'left'),
+    ('Conta_Credito', 20, 'left'),
+    ('Valor_Centavos', 15, 'zero'),
+    ('Emissor', 60, 'left'),
+]
+
+EXPORT_FORMATS: Dict[str, Dict[str, str]] = {
+    'csv': {'label': 'CSV - Formato de Integração', 'extension': 'csv', 'mime': 'text/csv'},
+    'parquet': {'label': 'Parquet', 'extension': 'parquet', 'mime': 'application/octet-stream'},
+    'txt': {'label': 'Layout Posicional (TXT)', 'extension': 'txt', 'mime': 'text/plain'},
+}
+
+
+def available_export_formats() -> Dict[str, Dict[str, str]]:
+    """Formatos disponíveis no ambiente (Parquet exige o pyarrow)."""
+    return {fmt: spec for fmt, spec in EXPORT_FORMATS.items() if fmt != 'parquet' or PARQUET_AVAILABLE}
+
+
+def _columns_tag(columns: Optional[Sequence[str]]) -> str:
+    """Identificador curto do conjunto de colunas exportadas (None = todas as colunas)."""
+    if columns is None:
+        return 'todas'
+    return hashlib.sha256('\x1f'.join(map(str, columns)).encode('utf-8')).hexdigest()[:8]
+
+
+def export_file_path(
+    workspace: str, data_version: str, fmt: str, columns: Optional[Sequence[str]] = EXPORT_COLUMNS
+) -> str:
+    """Caminho do arquivo exportado (um arquivo por versão dos dados, formato e conjunto de colunas)."""
+    name = f"{EXPORT_FILE_PREFIX}{data_version[:16]}_{_columns_tag(columns)}.{EXPORT_FORMATS[fmt]['extension']}"
+    return os.path.join(workspace, name)
+
+
+def _chunks(df: pd.DataFrame, chunk_rows: int):
+    for start in range(0, len(df), max(1, chunk_rows)):
+        yield start, df.iloc[start:start + chunk_rows]
+
+
+def _account_code(accounts: pd.Series) -> pd.Series:
+    return accounts.astype(str).str.split(' - ', n=1).str[0]
+
+
+def _value_cents(chunk: pd.DataFrame) -> pd.Series:
+    """Valor em centavos: a coluna inteira da forma compacta, quando existe (sem passar por float)."""
+    if CENTS_COLUMN in chunk.columns:
+        return chunk[CENTS_COLUMN].astype('int64')
+    return (chunk['Valor_Lancamento'].astype(float) * 100).round().astype('int64')
+
+
+def format_fixed_width(chunk: pd.DataFrame) -> pd.Series:
+    """Formata as linhas no layout posicional (operações vetorizadas por coluna)."""
+    fields = {
+        'NFe_Chave': chunk['NFe_Chave'].astype(str),
+        'Data_Emissao': (
+            chunk['Data_Emissao'].fillna('').astype(str).str.replace('-', '', regex=False)
+            if 'Data_Emissao' in chunk.columns else pd.Series('', index=chunk.index)
+        ),
+        'CFOP_Principal': chunk['CFOP_Principal'].astype(str),
+        'Conta_Debito': _account_code(chunk['Conta_Debito']),
+        'Conta_Credito': _account_code(chunk['Conta_Credito']),
+        'Valor_Centavos': _value_cents(chunk).astype(str),
+        'Emissor': chunk['Emissor'].fillna('').astype(str).str.replace(r'[\r\n]+', ' ', regex=True),
+    }
+    line = None
+    for name, width, align in FIXED_WIDTH_LAYOUT:
+        values = fields[name].str.slice(0, width)
+        values = values.str.zfill(width) if align == 'zero' else values.str.ljust(width)
+        line = values if line is None else line + values
+    return line
+
+
+def write_export(
+    df: pd.DataFrame, fmt: str, path: str, chunk_rows: int = EXPORT_CHUNK_ROWS,
+    columns: Optional[Sequence[str]] = EXPORT_COLUMNS
+) -> str:
+    """
+    Escreve o arquivo de exportação em blocos de linhas (memória limitada ao bloco atual).
+    A escrita vai para um arquivo temporário, renomeado ao final (nunca há arquivo pela metade).
+    columns=None exporta todas as colunas (DataFrames genéricos do modo de análise de dados).
+    """
+    if fmt not in available_export_formats():
+        raise ValueError(f"Formato de exportação indisponível: '{fmt}'.")
+    temp_path = f"{path}.tmp"
+    if fmt != 'txt':
+        # O layout posicional usa os centavos inteiros; CSV e Parquet saem em reais
+        df = expand_lancamentos(df)
+        columns = list(df.columns) if columns is None else [c for c in columns if c in df.columns]
+
+    if fmt == 'csv':
+        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+            for start, chunk in _chunks(df[columns], chunk_rows):
+                chunk.to_csv(f, index=False, header=(start == 0))
+            if df.empty:
+                pd.DataFrame(columns=columns).to_csv(f, index=False)
+    elif fmt == 'parquet':
+        writer = None
+        try:
+            for _, chunk in _chunks(df[columns], chunk_rows):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(temp_path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+            if writer is None:
+                pq.write_table(pa.Table.from_pandas(df[columns], preserve_index=False), temp_path)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        # Layout posicional em latin-1 com quebra CRLF (padrão dos importadores de ERPs)
+        with open(temp_path, 'w', encoding='latin-1', errors='replace', newline='\r\n') as f:
+            for _, chunk in _chunks(df, chunk_rows):
+                f.write('\n'.join(format_fixed_width(chunk)))
+                f.write('\n')
+
+    os.replace(temp_path, path)
+    return path
+
+
+def prepare_export(
+    df: pd.DataFrame, fmt: str, workspace: str, data_version: str,
+    columns: Optional[Sequence[str]] = EXPORT_COLUMNS
+) -> str:
+    """
+    Retorna o arquivo exportado da versão dos dados e das colunas pedidas, gerando-o apenas se
+    ainda não existir. Exportações de versões anteriores na mesma pasta de trabalho são removidas.
+    """
+    path = export_file_path(workspace, data_version, fmt, columns)
+    if os.path.exists(path):
+        return path
+    current_prefix = f"{EXPORT_FILE_PREFIX}{data_version[:16]}_"
+    for name in os.listdir(workspace):
+        if name.startswith(EXPORT_FILE_PREFIX) and not name.startswith(current_prefix):
+            try:
+                os.remove(os.path.join(workspace, name))
+            except OSError:
+                pass
+    return write_export(df, fmt, path, columns=columns)
@@ -0,0 +1,92 @@
+# ingestion_cache.py - LançAI: Cache de Ingestão por Conteúdo do Arquivo Enviado
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+import pandas as pd
+from metrics import metrics
+
+# Limites do cache em memória (compartilhado por todas as sessões do processo)
+INGESTION_CACHE_MAX_ENTRIES = int(os.getenv("LANCAI_INGESTION_CACHE_MAX_ENTRIES", "8"))
+INGESTION_CACHE_MAX_BYTES = int(os.getenv("LANCAI_INGESTION_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+
+def upload_digest(data: bytes) -> str:
+    """SHA-256 do conteúdo enviado."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_upload_key(data: bytes, filename: str, config_signature: str = '') -> str:
+    """
+    Chave do cache: conteúdo do arquivo + extensão (CSV, XLSX e ZIP são lidos de formas
+    diferentes) + assinatura da configuração que altera o resultado (regras, parser).
+    """
+    extension = os.path.splitext(filename.lower())[1]
+    raw = '\x1f'.join([upload_digest(data), extension, config_signature])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class IngestionCache:
+    """
+    Cache LRU dos DataFrames já montados a partir de um upload (modo + DataFrame).
+    Limitado por quantidade de entradas e pela memória ocupada pelos DataFrames.
+    Os DataFrames devolvidos são cópias rasas: as sessões podem criar/alterar colunas
+    sem afetar a entrada em cache.
+    """
+
+    def __init__(self, max_entries: int = INGESTION_CACHE_MAX_ENTRIES, max_bytes: int = INGESTION_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, Tuple[str, pd.DataFrame, int]]' = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, pd.DataFrame]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                metrics.increment('cache_requests_total', cache='ingestion', result='miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.increment('cache_requests_total', cache='ingestion', result='hit')
+            mode, df, _ = entry
+        return mode, df.copy(deep=False)
+
+    def put(self, key: str, mode: str, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if self.max_entries <= 0 or size > self.max_bytes:
+            # DataFrame maior que o próprio limite: não vale a pena guardar
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (mode, df.copy(deep=False), size)
+            self._total_bytes += size
+            # Remove as entradas usadas há mais tempo até voltar aos limites
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+            }
+
+
+# Instância única compartilhada por todas as sessões do processo
+ingestion_cache = IngestionCache()
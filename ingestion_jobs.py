@@ -0,0 +1,217 @@
+# ingestion_jobs.py - LançAI: Fila de Ingestão em Segundo Plano (uploads processados fora da thread do script)
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, Optional, List, Tuple, Union, IO
+
+import pandas as pd
+
+from data_handler import IngestionReporter, IngestionCancelled, ingest_upload
+from ingestion_cache import ingestion_cache
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuração (compartilhada por todas as sessões do processo)
+# Jobs executados ao mesmo tempo; os demais aguardam na fila
+JOB_WORKERS = int(os.getenv("LANCAI_JOB_WORKERS", "2"))
+# Jobs aguardando na fila além dos que estão em execução (acima disso o upload é recusado)
+JOB_MAX_PENDING = int(os.getenv("LANCAI_JOB_MAX_PENDING", "8"))
+# Jobs concluídos e não recolhidos (ex.: a sessão foi fechada) são descartados após este tempo
+JOB_TTL_SECONDS = int(os.getenv("LANCAI_JOB_TTL_SECONDS", "900"))
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINAL_STATUSES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class IngestionJob:
+    """
+    Um upload em processamento. O worker atualiza estado, progresso e mensagens;
+    a thread do script só lê (sob o lock) e pede o cancelamento.
+    """
+
+    def __init__(self, job_id: str, filename: str, source: Union[str, bytes, IO[bytes]], upload_key: Optional[str] = None):
+        self.id = job_id
+        self.filename = filename
+        self.source: Optional[Union[str, bytes, IO[bytes]]] = source
+        self.upload_key = upload_key
+        self.status = JOB_QUEUED
+        self.progress: Tuple[int, int, str] = (0, 0, '')
+        self.messages: List[Tuple[str, str]] = []
+        self.result: Optional[Tuple[str, pd.DataFrame]] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL_STATUSES
+
+    @property
+    def elapsed(self) -> float:
+        """Segundos em execução (ou na fila, se ainda não começou)."""
+        start = self.started_at or self.created_at
+        return (self.finished_at or time.time()) - start
+
+    def add_message(self, level: str, message: str) -> None:
+        with self._lock:
+            self.messages.append((level, message))
+
+    def set_progress(self, done: int, total: int, text: str) -> None:
+        with self._lock:
+            self.progress = (done, total, text)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cópia consistente do estado para a interface."""
+        with self._lock:
+            return {
+                'id': self.id, 'filename': self.filename, 'status': self.status,
+                'progress': self.progress, 'messages': list(self.messages),
+                'elapsed': self.elapsed, 'cancel_requested': self.cancel_event.is_set(),
+            }
+
+    def _finish(self, status: str) -> None:
+        with self._lock:
+            self.status = status
+            self.finished_at = time.time()
+            # Libera o upload (pode ter alguns GB) assim que o job termina
+            self.source = None
+
+
+class JobReporter(IngestionReporter):
+    """Guarda mensagens e progresso no job (além do log) e interrompe a ingestão quando ele é cancelado."""
+
+    def __init__(self, job: IngestionJob):
+        super().__init__(prefix=job.filename)
+        self.job = job
+
+    def error(self, message: str) -> None:
+        super().error(message)
+        self.job.add_message('error', message)
+
+    def warning(self, message: str) -> None:
+        super().warning(message)
+        self.job.add_message('warning', message)
+
+    def info(self, message: str) -> None:
+        super().info(message)
+        self.job.add_message('info', message)
+
+    def progress(self, done: int, total: int, text: str) -> None:
+        self.job.set_progress(done, total, text)
+        self.check_cancelled()
+
+    def check_cancelled(self) -> None:
+        if self.job.cancel_event.is_set():
+            raise IngestionCancelled(f"Ingestão de '{self.job.filename}' cancelada.")
+
+
+class IngestionJobManager:
+    """
+    Fila de ingestão do processo: um pool de threads limita quantos uploads são processados
+    ao mesmo tempo (somando todas as sessões). O parsing pesado continua no pool de processos
+    do data_handler; aqui só se tira o trabalho da thread do script do Streamlit, que fica livre
+    para reruns e para as outras telas enquanto o upload é processado.
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING, ttl_seconds: int = JOB_TTL_SECONDS):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(0, max_pending)
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="lancai-ingestao")
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, source: Union[str, bytes, IO[bytes]], filename: str, upload_key: Optional[str] = None) -> Optional[str]:
+        """Enfileira o upload e retorna o id do job, ou None se a fila estiver cheia."""
+        self._purge()
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if not job.done)
+            if active >= self.max_workers + self.max_pending:
+                metrics.increment('ingestion_jobs_total', status='rejected')
+                return None
+            job = IngestionJob(uuid.uuid4().hex[:12], filename, source, upload_key)
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job)
+        metrics.increment('ingestion_jobs_total', status='submitted')
+        return job.id
+
+    def _run(self, job: IngestionJob) -> None:
+        if job.cancel_event.is_set():
+            job._finish(JOB_CANCELLED)
+            metrics.increment('ingestion_jobs_total', status=JOB_CANCELLED)
+            return
+        with job._lock:
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+        metrics.observe('ingestion_job_wait_seconds', job.started_at - job.created_at)
+
+        status = JOB_FAILED
+        try:
+            with metrics.timer('ingestion_job', file=job.filename):
+                job.result = ingest_upload(job.source, job.filename, reporter=JobReporter(job))
+            if job.result is not None:
+                status = JOB_DONE
+                if job.upload_key:
+                    # Reenviar o mesmo arquivo (nesta ou em outra sessão) não refaz o processamento
+                    ingestion_cache.put(job.upload_key, *job.result)
+        except IngestionCancelled:
+            status = JOB_CANCELLED
+            job.add_message('info', "Processamento cancelado.")
+        except Exception as e:
+            logger.exception("Falha no job de ingestão %s (%s).", job.id, job.filename)
+            job.add_message('error', f"Erro inesperado ao processar o arquivo. Detalhes: {type(e).__name__} - {e}")
+        finally:
+            job._finish(status)
+            metrics.increment('ingestion_jobs_total', status=status)
+
+    def get(self, job_id: Optional[str]) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def cancel(self, job_id: Optional[str]) -> bool:
+        """
+        Pede o cancelamento. Jobs na fila são descartados na hora; em execução, param no
+        próximo ponto de interrupção (entre lotes de XML ou entre etapas), sem gravar na base.
+        """
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job._finish(JOB_CANCELLED)
+            metrics.increment('ingestion_jobs_total', status=JOB_CANCELLED)
+        return True
+
+    def pop(self, job_id: Optional[str]) -> Optional[IngestionJob]:
+        """Remove o job da fila (após o resultado ser entregue à sessão)."""
+        with self._lock:
+            return self._jobs.pop(job_id, None) if job_id else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (JOB_QUEUED, JOB_RUNNING) + FINAL_STATUSES}
+
+    def _purge(self) -> None:
+        """Descarta jobs concluídos há mais de ttl_seconds que nenhuma sessão recolheu."""
+        limit = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < limit]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+# Instância única compartilhada por todas as sessões do processo
+job_manager = IngestionJobManager()
@@ -0,0 +1,255 @@
+# lancai_cli.py - LançAI: Processamento em Lote pela Linha de Comando (diretórios de ZIPs de NF-e)
+#
+# Uso:
+#   python lancai_cli.py ./lotes/2024-05 --output ./saida --format parquet --workers 8
+#   python lancai_cli.py ./lotes --recursive --audit --summary ./saida/resumo.json
+#
+# Cada ZIP gera um arquivo de lançamentos (e, com --audit, a análise do Agente em Markdown).
+# O resumo em JSON (um item por ZIP) vai para a saída padrão; as mensagens vão para o log (stderr).
+#
+# Códigos de saída:
+#   0 = todos os ZIPs processados; 1 = parte dos ZIPs falhou;
+#   2 = argumentos inválidos ou nenhum ZIP encontrado; 3 = nenhum ZIP processado com sucesso.
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, Optional, List
+
+from data_handler import CollectingReporter, ingest_zip
+from exporter import available_export_formats, write_export
+from ledger_store import LedgerStore, ledger_store
+
+logger = logging.getLogger("lancai_cli")
+
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_USAGE = 2
+EXIT_FAILED = 3
+
+# ZIPs processados ao mesmo tempo (um processo por ZIP) e processos de parsing dentro de cada ZIP
+CLI_WORKERS = int(os.getenv("LANCAI_CLI_WORKERS", "0")) or (os.cpu_count() or 1)
+CLI_XML_WORKERS = int(os.getenv("LANCAI_CLI_XML_WORKERS", "1"))
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure_logging(level: str) -> None:
+    """Configura o log (também chamado em cada processo de trabalho)."""
+    logging.basicConfig(level=getattr(logging, level.upper(), logging.INFO), format=LOG_FORMAT, stream=sys.stderr)
+
+
+def find_zip_files(inputs: List[str], recursive: bool = False) -> List[str]:
+    """ZIPs informados diretamente ou contidos nos diretórios (ordenados, sem repetição)."""
+    found = []
+    for path in inputs:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, '**', '*.zip') if recursive else os.path.join(path, '*.zip')
+            found.extend(glob.glob(pattern, recursive=recursive))
+            found.extend(glob.glob(pattern[:-4] + '.ZIP', recursive=recursive))
+        elif os.path.isfile(path) and path.lower().endswith('.zip'):
+            found.append(path)
+    return sorted({os.path.abspath(path) for path in found})
+
+
+def output_names(zip_paths: List[str]) -> Dict[str, str]:
+    """Nome base de saída por ZIP (nome do arquivo; sufixo numérico quando repetido em subpastas)."""
+    names: Dict[str, str] = {}
+    used: Dict[str, int] = {}
+    for path in zip_paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        used[stem] = used.get(stem, 0) + 1
+        names[path] = stem if used[stem] == 1 else f"{stem}_{used[stem]}"
+    return names
+
+
+def process_zip(
+    zip_path: str,
+    output_dir: str,
+    output_name: str,
+    fmt: str,
+    xml_workers: int = CLI_XML_WORKERS,
+    use_ledger: bool = True,
+    audit: bool = False
+) -> Dict[str, Any]:
+    """
+    Pipeline completo de um ZIP (executado em um processo de trabalho): ingestão dos XMLs,
+    exportação dos lançamentos e, opcionalmente, a análise inicial do Agente.
+    Nunca lança exceção: falhas ficam no status e no campo 'erro' do resultado.
+    """
+    started = time.perf_counter()
+    reporter = CollectingReporter(prefix=os.path.basename(zip_path))
+    result: Dict[str, Any] = {'arquivo': zip_path, 'status': 'erro'}
+    try:
+        ledger = ledger_store if use_ledger else LedgerStore(enabled=False)
+        ingested = ingest_zip(zip_path, ledger=ledger, max_workers=xml_workers, reporter=reporter, allow_data_files=False)
+        if ingested is None:
+            result['erro'] = reporter.errors[-1] if reporter.errors else "O ZIP não contém XMLs de NF-e válidos."
+            return result
+
+        _, df = ingested
+        spec = available_export_formats()[fmt]
+        output_path = write_export(df, fmt, os.path.join(output_dir, f"{output_name}_lancamentos.{spec['extension']}"))
+        report = df.attrs['auditoria']
+        result.update({
+            'status': 'ok',
+            'lancamentos': len(df),
+            'nao_mapeados': report['nao_mapeados']['quantidade'],
+            'valor_total': report['resumo']['valor_total'],
+            'saida': output_path,
+            # Auditoria local (sem LLM): pendências encontradas em cada verificação
+            'pendencias': {
+                'cfops_sem_regra': [item['CFOP'] for item in report['nao_mapeados']['por_cfop']],
+                'chaves_repetidas': report['chaves_duplicadas']['quantidade'],
+                'repeticoes_descartadas': report['chaves_duplicadas'].get('removidas', 0),
+                'valores_zerados_ou_negativos': report['valores_invalidos']['quantidade'],
+                'valores_atipicos': report['outliers']['quantidade'],
+            },
+        })
+
+        if audit:
+            # Import tardio: sem --audit o cliente do LLM nem é carregado
+            from agent_brain import generate_accounting_summary_and_answer, INITIAL_AUDIT_TASK, LLM_ERROR_PREFIX
+            audit_text = generate_accounting_summary_and_answer(df, INITIAL_AUDIT_TASK)
+            audit_path = os.path.join(output_dir, f"{output_name}_auditoria.md")
+            with open(audit_path, 'w', encoding='utf-8') as f:
+                f.write(audit_text)
+            result['auditoria'] = audit_path
+            if audit_text.startswith(LLM_ERROR_PREFIX):
+                result['status'] = 'auditoria_falhou'
+                result['erro'] = audit_text
+    except Exception as e:
+        logger.exception("Falha ao processar %s.", zip_path)
+        result['erro'] = f"{type(e).__name__}: {e}"
+    finally:
+        result['avisos'] = reporter.warnings
+        result['segundos'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_batch(
+    zip_paths: List[str],
+    output_dir: str,
+    fmt: str,
+    workers: int,
+    xml_workers: int,
+    use_ledger: bool,
+    audit: bool,
+    log_level: str
+) -> List[Dict[str, Any]]:
+    """Processa os ZIPs em paralelo (um processo por ZIP) e devolve os resultados na ordem da entrada."""
+    names = output_names(zip_paths)
+    options = dict(fmt=fmt, xml_workers=xml_workers, use_ledger=use_ledger, audit=audit)
+    workers = max(1, min(workers, len(zip_paths)))
+    results: Dict[str, Dict[str, Any]] = {}
+
+    if workers == 1:
+        for path in zip_paths:
+            results[path] = process_zip(path, output_dir, names[path], **options)
+            logger.info("%s: %s (%d de %d).", os.path.basename(path), results[path]['status'], len(results), len(zip_paths))
+    else:
+        if audit:
+            # Cada processo tem o próprio limitador do LLM: a cota por minuto é dividida entre eles
+            from llm_client import LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE
+            os.environ['LANCAI_LLM_RPM'] = str(LLM_REQUESTS_PER_MINUTE / workers)
+            os.environ['LANCAI_LLM_TPM'] = str(LLM_TOKENS_PER_MINUTE / workers)
+        # 'spawn': mesmo comportamento em Linux e Windows (e sem herdar o estado do processo principal)
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_logging, initargs=(log_level,)
+        ) as pool:
+            futures = {pool.submit(process_zip, path, output_dir, names[path], **options): path for path in zip_paths}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    results[path] = future.result()
+                except Exception as e:
+                    # Processo de trabalho encerrado de forma inesperada (ex.: falta de memória)
+                    results[path] = {'arquivo': path, 'status': 'erro', 'erro': f"{type(e).__name__}: {e}"}
+                logger.info("%s: %s (%d de %d).", os.path.basename(path), results[path]['status'], len(results), len(zip_paths))
+
+    return [results[path] for path in zip_paths]
+
+
+def exit_code_for(results: List[Dict[str, Any]]) -> int:
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    if not results:
+        return EXIT_USAGE
+    if succeeded == len(results):
+        return EXIT_OK
+    return EXIT_PARTIAL if succeeded else EXIT_FAILED
+
+
+def build_summary(results: List[Dict[str, Any]], args: argparse.Namespace, seconds: float) -> Dict[str, Any]:
+    return {
+        'parametros': {
+            'entradas': args.inputs, 'saida': os.path.abspath(args.output), 'formato': args.format,
+            'workers': args.workers, 'xml_workers': args.xml_workers, 'base_de_notas': not args.no_ledger,
+            'auditoria': args.audit,
+        },
+        'totais': {
+            'zips': len(results),
+            'ok': sum(1 for result in results if result['status'] == 'ok'),
+            'falhas': sum(1 for result in results if result['status'] != 'ok'),
+            'lancamentos': sum(result.get('lancamentos', 0) for result in results),
+            'nao_mapeados': sum(result.get('nao_mapeados', 0) for result in results),
+            'chaves_repetidas': sum(result.get('pendencias', {}).get('chaves_repetidas', 0) for result in results),
+            'valores_zerados_ou_negativos': sum(result.get('pendencias', {}).get('valores_zerados_ou_negativos', 0) for result in results),
+            'valores_atipicos': sum(result.get('pendencias', {}).get('valores_atipicos', 0) for result in results),
+            'valor_total': round(sum(result.get('valor_total', 0.0) for result in results), 2),
+            'segundos': round(seconds, 3),
+        },
+        'codigo_saida': exit_code_for(results),
+        'arquivos': results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    formats = available_export_formats()
+    parser = argparse.ArgumentParser(
+        description="Processa diretórios de ZIPs de NF-e e grava os lançamentos contábeis (sem interface).",
+        epilog="Códigos de saída: 0 = sucesso; 1 = parte dos ZIPs falhou; 2 = argumentos inválidos ou nenhum ZIP; 3 = todos falharam."
+    )
+    parser.add_argument('inputs', nargs='+', help="Diretórios com ZIPs e/ou arquivos ZIP.")
+    parser.add_argument('-o', '--output', default='./saida_lancai', help="Pasta dos arquivos gerados.")
+    parser.add_argument('-f', '--format', choices=list(formats), default='csv', help="Formato dos lançamentos exportados.")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Procura ZIPs também nas subpastas.")
+    parser.add_argument('-w', '--workers', type=int, default=CLI_WORKERS, help="ZIPs processados ao mesmo tempo (padrão: núcleos).")
+    parser.add_argument('--xml-workers', type=int, default=CLI_XML_WORKERS, help="Processos de parsing dentro de cada ZIP.")
+    parser.add_argument('--no-ledger', action='store_true', help="Não consulta nem grava a base de notas.")
+    parser.add_argument('--audit', action='store_true', help="Gera a análise inicial do Agente (LLM) para cada ZIP.")
+    parser.add_argument('--summary', default=None, help="Grava também o resumo JSON neste arquivo.")
+    parser.add_argument('--log-level', default='INFO', help="Nível do log (DEBUG, INFO, WARNING...).")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    if args.workers < 1 or args.xml_workers < 1:
+        parser.error("--workers e --xml-workers devem ser maiores que zero.")
+
+    zip_paths = find_zip_files(args.inputs, args.recursive)
+    if not zip_paths:
+        logger.error("Nenhum arquivo ZIP encontrado em: %s", ', '.join(args.inputs))
+    os.makedirs(args.output, exist_ok=True)
+
+    started = time.perf_counter()
+    results = run_batch(
+        zip_paths, args.output, args.format, args.workers, args.xml_workers,
+        not args.no_ledger, args.audit, args.log_level
+    ) if zip_paths else []
+    summary = build_summary(results, args, time.perf_counter() - started)
+
+    summary_text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(summary_text)
+    print(summary_text)
+    return summary['codigo_saida']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
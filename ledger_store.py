@@ -0,0 +1,145 @@
+# ledger_store.py - LançAI: Base Persistente de NF-e (deduplicada por NFe_Chave)
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import pandas as pd
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterable, Iterator, List, Set
+
+# Configuração da base (LANCAI_LEDGER=0 desativa)
+LEDGER_ENABLED = os.getenv("LANCAI_LEDGER", "1") not in ("0", "false", "False")
+LEDGER_PATH = os.getenv("LANCAI_LEDGER_PATH", "./.lancai_data/notas.sqlite3")
+
+# Colunas gravadas: o resultado do parsing, antes das regras contábeis (as regras podem mudar)
+LEDGER_COLUMNS = (
+    'NFe_Chave', 'Emissor', 'Emissor_CNPJ', 'CFOP_Principal', 'NCM_Principal',
+    'CST_Principal', 'Valor_Total', 'Data_Emissao', 'XML_Path',
+)
+# Chave de acesso da NF-e (44 dígitos), normalmente presente no nome do arquivo XML
+_NFE_KEY_PATTERN = re.compile(r'(?<!\d)(\d{44})(?!\d)')
+
+
+def nfe_key_from_filename(filename: str) -> Optional[str]:
+    """Extrai a chave de acesso (44 dígitos) do nome do arquivo, se houver."""
+    match = _NFE_KEY_PATTERN.search(os.path.basename(filename))
+    return match.group(1) if match else None
+
+
+def period_from_date(dates: pd.Series) -> pd.Series:
+    """Período 'AAAA-MM' a partir da data de emissão ('AAAA-MM-DD'); vazio se não houver data."""
+    text = dates.fillna('').astype(str)
+    return text.str.slice(0, 7).where(text.str.match(r'^\d{4}-\d{2}'), '')
+
+
+class LedgerStore:
+    """
+    Base local (SQLite) com uma linha por NF-e, indexada pela chave de acesso e pelo período
+    de emissão. Cada upload acrescenta apenas as notas novas; as já gravadas não são
+    reprocessadas e podem ser consultadas por período sem reenviar os arquivos.
+    """
+
+    def __init__(self, path: str = LEDGER_PATH, enabled: bool = LEDGER_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Abre uma conexão curta (uma por operação, segura entre threads) e confirma ao final."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS notas ("
+                    " NFe_Chave TEXT PRIMARY KEY, Emissor TEXT, Emissor_CNPJ TEXT, CFOP_Principal TEXT,"
+                    " NCM_Principal TEXT, CST_Principal TEXT, Valor_Total REAL, Data_Emissao TEXT,"
+                    " XML_Path TEXT, Periodo TEXT, Gravado_Em REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_periodo ON notas(Periodo)")
+                self._initialized = True
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _load_temp_keys(conn: sqlite3.Connection, keys: Iterable[str]) -> None:
+        """Carrega as chaves em uma tabela temporária (consultas com muitas chaves sem IN gigante)."""
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS chaves_consulta (chave TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM chaves_consulta")
+        conn.executemany("INSERT OR IGNORE INTO chaves_consulta (chave) VALUES (?)", ((key,) for key in keys))
+
+    def known_keys(self, keys: Iterable[str]) -> Set[str]:
+        """Retorna, dentre as chaves informadas, as que já estão na base."""
+        keys = [key for key in keys if key]
+        if not self.enabled or not keys or not os.path.exists(self.path):
+            return set()
+        with self._lock, self._transaction() as conn:
+            self._load_temp_keys(conn, keys)
+            rows = conn.execute("SELECT n.NFe_Chave FROM notas n JOIN chaves_consulta c ON c.chave = n.NFe_Chave").fetchall()
+        return {row[0] for row in rows}
+
+    def append(self, df_parsed: pd.DataFrame) -> int:
+        """Grava as notas ainda não presentes na base. Retorna quantas foram acrescentadas."""
+        if not self.enabled or df_parsed.empty:
+            return 0
+        df = df_parsed[df_parsed['NFe_Chave'].astype(str) != ''].reindex(columns=list(LEDGER_COLUMNS))
+        df = df.astype(object).where(df.notna(), None)
+        df['Periodo'] = period_from_date(df_parsed.loc[df.index, 'Data_Emissao']) if 'Data_Emissao' in df_parsed.columns else ''
+        df['Gravado_Em'] = time.time()
+        columns = list(LEDGER_COLUMNS) + ['Periodo', 'Gravado_Em']
+        placeholders = ', '.join('?' for _ in columns)
+        with self._lock, self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                f"INSERT OR IGNORE INTO notas ({', '.join(columns)}) VALUES ({placeholders})",
+                df[columns].itertuples(index=False, name=None)
+            )
+            return conn.total_changes - before
+
+    def load(self, keys: Optional[Iterable[str]] = None, periods: Optional[List[str]] = None) -> pd.DataFrame:
+        """Lê as notas gravadas (todas, as das chaves informadas ou as dos períodos informados)."""
+        empty = pd.DataFrame(columns=list(LEDGER_COLUMNS))
+        if not self.enabled or not os.path.exists(self.path):
+            return empty
+        columns = ', '.join(f"n.{column}" for column in LEDGER_COLUMNS)
+        with self._lock, self._transaction() as conn:
+            if keys is not None:
+                self._load_temp_keys(conn, keys)
+                query, params = f"SELECT {columns} FROM notas n JOIN chaves_consulta c ON c.chave = n.NFe_Chave", []
+            elif periods:
+                query = f"SELECT {columns} FROM notas n WHERE n.Periodo IN ({', '.join('?' for _ in periods)})"
+                params = list(periods)
+            else:
+                query, params = f"SELECT {columns} FROM notas n", []
+            df = pd.read_sql_query(query + " ORDER BY n.Data_Emissao, n.NFe_Chave", conn, params=params)
+        return df if not df.empty else empty
+
+    def periods(self) -> pd.DataFrame:
+        """Resumo por período: quantidade de notas e valor total."""
+        if not self.enabled or not os.path.exists(self.path):
+            return pd.DataFrame(columns=['Periodo', 'Notas', 'Valor_Total'])
+        with self._lock, self._transaction() as conn:
+            return pd.read_sql_query(
+                "SELECT Periodo, COUNT(*) AS Notas, SUM(Valor_Total) AS Valor_Total"
+                " FROM notas GROUP BY Periodo ORDER BY Periodo DESC",
+                conn
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Quantidade de notas e de períodos gravados."""
+        notes, periods = 0, 0
+        if self.enabled and os.path.exists(self.path):
+            with self._lock, self._transaction() as conn:
+                notes, periods = conn.execute("SELECT COUNT(*), COUNT(DISTINCT Periodo) FROM notas").fetchone()
+        return {'enabled': self.enabled, 'notes': notes, 'periods': periods}
+
+
+# Instância única compartilhada por todas as sessões do processo
+ledger_store = LedgerStore()
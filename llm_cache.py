@@ -0,0 +1,172 @@
+# llm_cache.py - LançAI: Cache Persistente de Respostas do LLM
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import pandas as pd
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterator
+from metrics import metrics
+
+# Configuração do cache (LANCAI_LLM_CACHE=0 desativa)
+LLM_CACHE_ENABLED = os.getenv("LANCAI_LLM_CACHE", "1") not in ("0", "false", "False")
+LLM_CACHE_PATH = os.getenv("LANCAI_LLM_CACHE_PATH", "./.lancai_cache/llm_responses.sqlite3")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LANCAI_LLM_CACHE_MAX_ENTRIES", "2000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LANCAI_LLM_CACHE_MAX_MB", "64")) * 1024 * 1024
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LANCAI_LLM_CACHE_TTL_HOURS", "168")) * 3600
+
+
+def dataframe_fingerprint(df: pd.DataFrame) -> str:
+    """Hash do conteúdo do DataFrame (valores, índice, colunas e tipos)."""
+    digest = hashlib.sha256()
+    digest.update(repr(list(df.columns)).encode('utf-8'))
+    digest.update(repr([str(dtype) for dtype in df.dtypes]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def normalize_question(question: str) -> str:
+    """Normaliza a pergunta (caixa, espaços e pontuação final) para aumentar os acertos do cache."""
+    return re.sub(r'\s+', ' ', question.casefold()).strip().rstrip('?!. ')
+
+
+def make_cache_key(fingerprint: str, question: str, model_name: str, prompt_version: str) -> str:
+    """Chave do cache: conteúdo do DataFrame + pergunta normalizada + modelo + versão do prompt."""
+    raw = '\x1f'.join([fingerprint, normalize_question(question), model_name, prompt_version])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Cache de respostas em SQLite, compartilhado entre sessões e reinícios do app.
+    Remove as entradas menos usadas recentemente (LRU) ao passar do limite de
+    entradas ou de tamanho, descarta entradas expiradas (TTL) e conta acertos e falhas.
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+        ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+        enabled: bool = LLM_CACHE_ENABLED
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Abre uma conexão curta (uma por operação, segura entre threads) e confirma ao final."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+                    " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+                self._initialized = True
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[str]:
+        """Retorna a resposta em cache (ou None), atualizando o último acesso."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with self._lock, self._transaction() as conn:
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and self.ttl_seconds > 0 and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    metrics.increment('cache_requests_total', cache='llm_response', result='miss')
+                    return None
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                metrics.increment('cache_requests_total', cache='llm_response', result='hit')
+                return row[0]
+        except (sqlite3.Error, OSError):
+            # Falha no cache nunca impede a chamada ao LLM
+            self.misses += 1
+            metrics.increment('cache_requests_total', cache='llm_response', result='miss')
+            return None
+
+    def set(self, key: str, response: str) -> None:
+        """Grava a resposta e aplica os limites de tamanho/entradas (LRU)."""
+        if not self.enabled:
+            return
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        try:
+            with self._lock, self._transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, response, size, now, now)
+                )
+                if self.ttl_seconds > 0:
+                    conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+                self._evict(conn)
+        except (sqlite3.Error, OSError):
+            pass
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        # Remove a partir das entradas acessadas há mais tempo até voltar aos limites
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total_bytes -= size
+
+    def clear(self) -> None:
+        """Apaga todas as respostas armazenadas."""
+        try:
+            if os.path.exists(self.path):
+                with self._lock, self._transaction() as conn:
+                    conn.execute("DELETE FROM responses")
+        except (sqlite3.Error, OSError):
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Acertos, falhas, entradas e bytes armazenados."""
+        entries, total_bytes = 0, 0
+        if self.enabled and os.path.exists(self.path):
+            try:
+                with self._lock, self._transaction() as conn:
+                    entries, total_bytes = conn.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                    ).fetchone()
+            except (sqlite3.Error, OSError):
+                pass
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': total_bytes,
+        }
+
+
+# Instância única compartilhada por todas as sessões do processo
+response_cache = LLMResponseCache()
@@ -0,0 +1,396 @@
+# llm_client.py - LançAI: Cliente do LLM com Limite de Taxa, Retentativas e Concorrência Controlada
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional
+
+from prompt_builder import estimate_tokens
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Limites compartilhados por todas as sessões do processo
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LANCAI_LLM_RPM", "60"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LANCAI_LLM_TPM", "250000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LANCAI_LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LANCAI_LLM_MAX_RETRIES", "5"))
+# Tokens de resposta reservados por chamada no limite de tokens/minuto
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LANCAI_LLM_EXPECTED_OUTPUT_TOKENS", "1024"))
+
+# Backend do LLM: 'gemini' (padrão) ou 'stub' (local e determinístico, para testes offline e benchmarks)
+LLM_BACKEND = os.getenv("LANCAI_LLM_BACKEND", "gemini").strip().lower()
+# CORREÇÃO: gemini-2.5-pro alterado para gemini-2.5-flash. Maior cota e velocidade.
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+# Latência simulada do backend local (ms por resposta)
+STUB_LATENCY_SECONDS = float(os.getenv("LANCAI_STUB_LATENCY_MS", "0")) / 1000
+
+# Erros de cota ou transitórios que justificam nova tentativa
+_RETRYABLE_ERROR_NAMES = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'DeadlineExceeded',
+    'InternalServerError', 'Aborted', 'RateLimitError', 'APITimeoutError', 'ServerError',
+}
+_RETRYABLE_MESSAGE_MARKERS = ('ResourceExhausted', '429', '503', 'RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'timed out')
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Indica se o erro é de cota/transitório (vale tentar de novo) ou definitivo (ex.: chave inválida)."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in _RETRYABLE_ERROR_NAMES:
+        return True
+    message = str(error)
+    return any(marker in message for marker in _RETRYABLE_MESSAGE_MARKERS)
+
+
+def content_text(content: Any) -> str:
+    """Extrai o texto do conteúdo da mensagem (string ou lista de blocos, conforme a versão do LangChain)."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return ''.join(
+            block if isinstance(block, str) else block.get('text', '')
+            for block in content if isinstance(block, (str, dict))
+        )
+    return str(content or '')
+
+
+class TokenBucket:
+    """
+    Balde de fichas com reabastecimento contínuo (capacidade = limite por minuto).
+    Cada chamada reserva as fichas e recebe quanto tempo deve aguardar; reservas
+    maiores que a capacidade são limitadas a ela para nunca bloquear indefinidamente.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, per_minute)
+        self.rate = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Reserva as fichas e retorna os segundos de espera até que estejam disponíveis."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, amount: float = 1.0) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, amount: float = 1.0) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RateLimitedLLMClient:
+    """
+    Envolve o modelo de chat do LangChain com:
+    * limite de requisições/minuto e tokens/minuto (token bucket);
+    * no máximo N chamadas simultâneas;
+    * retentativas com backoff exponencial e jitter em erros de cota ou transitórios.
+    Uma única instância por processo é compartilhada por todas as sessões do Streamlit.
+    """
+
+    def __init__(
+        self,
+        llm: Any,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0
+    ):
+        self.llm = llm
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self.rate_limited = getattr(llm, 'rate_limited', True)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Backoff exponencial com jitter: metade fixa + metade aleatória."""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _request_tokens(self, prompt: str) -> int:
+        return estimate_tokens(prompt) + LLM_EXPECTED_OUTPUT_TOKENS
+
+    def _wait_for_quota(self, tokens: int) -> None:
+        if self.rate_limited:
+            with metrics.timer('llm_quota_wait'):
+                self.request_bucket.acquire()
+                self.token_bucket.acquire(tokens)
+
+    async def _wait_for_quota_async(self, tokens: int) -> None:
+        if self.rate_limited:
+            with metrics.timer('llm_quota_wait'):
+                await self.request_bucket.acquire_async()
+                await self.token_bucket.acquire_async(tokens)
+
+    @staticmethod
+    def _record_usage(mode: str, prompt: str, text: str, usage: Optional[Dict[str, Any]]) -> None:
+        """Registra a chamada e os tokens: os informados pelo modelo (usage_metadata) ou estimados pelo texto."""
+        prompt_tokens = (usage or {}).get('input_tokens') or estimate_tokens(prompt)
+        response_tokens = (usage or {}).get('output_tokens') or estimate_tokens(text)
+        metrics.increment('llm_requests_total', mode=mode, status='ok')
+        metrics.increment('llm_tokens_total', prompt_tokens, kind='prompt')
+        metrics.increment('llm_tokens_total', response_tokens, kind='response')
+        metrics.observe('llm_prompt_tokens', prompt_tokens)
+        metrics.observe('llm_response_tokens', response_tokens)
+
+    @staticmethod
+    def _record_failure(mode: str, retrying: bool) -> None:
+        metrics.increment('llm_requests_total', mode=mode, status='error')
+        if retrying:
+            metrics.increment('llm_retries_total', mode=mode)
+
+    def invoke(self, prompt: str) -> str:
+        """Chamada síncrona com limite de taxa, concorrência e retentativas. Retorna o texto da resposta."""
+        tokens = self._request_tokens(prompt)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_quota(tokens)
+            try:
+                with self._slots, metrics.timer('llm_invoke'):
+                    message = self.llm.invoke(prompt)
+                text = content_text(message.content)
+                self._record_usage('invoke', prompt, text, getattr(message, 'usage_metadata', None))
+                return text
+            except Exception as e:
+                retrying = attempt < self.max_retries and is_retryable_error(e)
+                self._record_failure('invoke', retrying)
+                if not retrying:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning("Erro transitório do LLM (%s). Nova tentativa em %.1fs.", type(e).__name__, delay)
+                time.sleep(delay)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Chamada em streaming: devolve os trechos de texto à medida que chegam.
+        Só há nova tentativa se o erro ocorrer antes do primeiro trecho (depois dele o
+        texto parcial já foi exibido e o erro é repassado a quem chamou).
+        """
+        tokens = self._request_tokens(prompt)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_quota(tokens)
+            started = False
+            texts: List[str] = []
+            usage: Dict[str, int] = {}
+            try:
+                with self._slots, metrics.timer('llm_stream'):
+                    call_started = time.perf_counter()
+                    for chunk in self.llm.stream(prompt):
+                        # O consumo de tokens chega em incrementos ao longo dos trechos
+                        for field, value in (getattr(chunk, 'usage_metadata', None) or {}).items():
+                            if isinstance(value, int):
+                                usage[field] = usage.get(field, 0) + value
+                        text = content_text(chunk.content)
+                        if text:
+                            if not started:
+                                metrics.observe('llm_first_chunk_seconds', time.perf_counter() - call_started)
+                            started = True
+                            texts.append(text)
+                            yield text
+                self._record_usage('stream', prompt, ''.join(texts), usage)
+                return
+            except Exception as e:
+                retrying = not started and attempt < self.max_retries and is_retryable_error(e)
+                self._record_failure('stream', retrying)
+                if not retrying:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning("Erro transitório do LLM (%s). Nova tentativa em %.1fs.", type(e).__name__, delay)
+                time.sleep(delay)
+
+    async def _acquire_slot_async(self) -> None:
+        """
+        Espera uma vaga sem bloquear o event loop (o semáforo é de threads). Se a tarefa for
+        cancelada durante a espera, a thread ainda obtém a vaga: ela é devolvida assim que isso ocorrer.
+        """
+        acquiring = asyncio.get_running_loop().run_in_executor(None, self._slots.acquire)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            acquiring.add_done_callback(lambda _: self._slots.release())
+            raise
+
+    async def ainvoke(self, prompt: str) -> str:
+        """Versão assíncrona do invoke (as vagas de concorrência são as mesmas das chamadas síncronas)."""
+        tokens = self._request_tokens(prompt)
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_quota_async(tokens)
+            await self._acquire_slot_async()
+            try:
+                with metrics.timer('llm_ainvoke'):
+                    response = await self.llm.ainvoke(prompt)
+                text = content_text(response.content)
+                self._record_usage('ainvoke', prompt, text, getattr(response, 'usage_metadata', None))
+                return text
+            except Exception as e:
+                retrying = attempt < self.max_retries and is_retryable_error(e)
+                self._record_failure('ainvoke', retrying)
+                if not retrying:
+                    raise
+                error_name = type(e).__name__
+            finally:
+                self._slots.release()
+            # A vaga de concorrência é liberada antes da espera do backoff
+            delay = self._backoff_delay(attempt)
+            logger.warning("Erro transitório do LLM (%s). Nova tentativa em %.1fs.", error_name, delay)
+            await asyncio.sleep(delay)
+
+
+# --------------------------------------------------------------------------------
+# --- BACKENDS DO LLM ---
+# --------------------------------------------------------------------------------
+
+class LLMBackend(ABC):
+    """
+    Interface dos backends: invoke/stream/ainvoke recebem o prompt (texto) e devolvem
+    mensagens com o atributo `content`, como os modelos de chat do LangChain.
+    Só invoke é obrigatório (um backend sem ele falha já ao ser instanciado).
+    """
+    model_name = ''
+    # Backends locais não consomem cota: o cliente não aplica os limites por minuto
+    rate_limited = True
+
+    @abstractmethod
+    def invoke(self, prompt: str) -> Any:
+        """Resposta completa do modelo para o prompt."""
+
+    def stream(self, prompt: str) -> Iterator[Any]:
+        yield self.invoke(prompt)
+
+    async def ainvoke(self, prompt: str) -> Any:
+        return await asyncio.to_thread(self.invoke, prompt)
+
+
+class GeminiBackend(LLMBackend):
+    """Gemini via LangChain. A chave e o cliente só são carregados na primeira chamada."""
+    model_name = GEMINI_MODEL_NAME
+
+    def __init__(self, model_name: str = GEMINI_MODEL_NAME):
+        self.model_name = model_name
+        self._llm = None
+        self._lock = threading.Lock()
+
+    def _get_llm(self) -> Any:
+        with self._lock:
+            if self._llm is None:
+                from dotenv import load_dotenv
+                load_dotenv()
+                api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise ValueError("GOOGLE_API_KEY não encontrada. Verifique seu arquivo .env.")
+                # Import tardio: o LangChain/Google só é carregado quando o Agente é usado
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                # As retentativas ficam a cargo do cliente compartilhado (backoff com jitter e limite de taxa)
+                self._llm = ChatGoogleGenerativeAI(model=self.model_name, google_api_key=api_key, temperature=0.0, max_retries=0)
+            return self._llm
+
+    def invoke(self, prompt: str) -> Any:
+        return self._get_llm().invoke(prompt)
+
+    def stream(self, prompt: str) -> Iterator[Any]:
+        yield from self._get_llm().stream(prompt)
+
+    async def ainvoke(self, prompt: str) -> Any:
+        return await self._get_llm().ainvoke(prompt)
+
+
+class _StubMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class LocalStubBackend(LLMBackend):
+    """
+    Backend local e determinístico (sem rede nem chave): a resposta depende apenas do prompt.
+    Útil para testes offline e para medir o restante do pipeline nos benchmarks.
+    """
+    model_name = 'local-stub'
+    rate_limited = False
+
+    def _respond(self, prompt: str) -> str:
+        question = next(
+            (line for line in reversed(prompt.splitlines()) if line.startswith('PERGUNTA/TAREFA DO USUÁRIO:')),
+            ''
+        )
+        signature = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        return (
+            f"**Resposta simulada (backend local `{self.model_name}`).**\n\n"
+            f"{question}\n\n"
+            f"Prompt recebido: {len(prompt)} caracteres (~{estimate_tokens(prompt)} tokens), assinatura `{signature}`."
+        )
+
+    def invoke(self, prompt: str) -> Any:
+        if STUB_LATENCY_SECONDS > 0:
+            time.sleep(STUB_LATENCY_SECONDS)
+        return _StubMessage(self._respond(prompt))
+
+    def stream(self, prompt: str) -> Iterator[Any]:
+        words = self._respond(prompt).split(' ')
+        for i, word in enumerate(words):
+            if STUB_LATENCY_SECONDS > 0:
+                time.sleep(STUB_LATENCY_SECONDS / len(words))
+            yield _StubMessage(word if i == len(words) - 1 else word + ' ')
+
+    async def ainvoke(self, prompt: str) -> Any:
+        if STUB_LATENCY_SECONDS > 0:
+            await asyncio.sleep(STUB_LATENCY_SECONDS)
+        return _StubMessage(self._respond(prompt))
+
+
+LLM_BACKENDS = {
+    'gemini': GeminiBackend,
+    'stub': LocalStubBackend,
+}
+
+
+def _backend_class(name: Optional[str]) -> type:
+    name = (name or LLM_BACKEND).strip().lower()
+    if name not in LLM_BACKENDS:
+        raise ValueError(f"Backend de LLM desconhecido: '{name}'. Use {', '.join(LLM_BACKENDS)}.")
+    return LLM_BACKENDS[name]
+
+
+def create_llm_backend(name: Optional[str] = None) -> LLMBackend:
+    """Cria o backend configurado (LANCAI_LLM_BACKEND), sem carregar o cliente do Gemini."""
+    return _backend_class(name)()
+
+
+def llm_model_name(name: Optional[str] = None) -> str:
+    """Nome do modelo do backend configurado (usado nas chaves do cache), sem criá-lo."""
+    return _backend_class(name).model_name
+
+
+_shared_client: Optional[RateLimitedLLMClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def get_llm_client(llm: Any = None) -> RateLimitedLLMClient:
+    """
+    Retorna o cliente compartilhado do processo (criado na primeira chamada).
+    Sem `llm`, usa o backend configurado em LANCAI_LLM_BACKEND.
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None or (llm is not None and _shared_client.llm is not llm):
+            _shared_client = RateLimitedLLMClient(llm if llm is not None else create_llm_backend())
+        return _shared_client
@@ -1,22 +1,49 @@
 import streamlit as st
 import pandas as pd
 import os
-import zipfile
+import time
+from functools import partial
+from typing import List, Optional
 from dotenv import load_dotenv
 
 # Importa a nova função de agente
-from agent_brain import generate_accounting_summary_and_answer 
+from agent_brain import (
+    stream_accounting_summary_and_answer,
+    generate_map_reduce_answer,
+    answer_locally,
+    answer_with_sql,
+    stream_sql_answer_summary,
+    INITIAL_AUDIT_TASK
+)
 from data_handler import (
-    load_and_validate_csv, 
-    unpack_data_zip,        
-    unpack_xml_zip_lancai,  
-    process_xml_files,
-    TEMP_FOLDER
+    load_ledger_lancamentos,
+    get_session_workspace,
+    ingestion_config_signature
 ) 
+from ingestion_cache import ingestion_cache, make_upload_key
+from ingestion_jobs import job_manager, JOB_DONE
+from ledger_store import ledger_store
+from ui_components import (
+    render_ingestion_job,
+    get_data_version,
+    get_summary_counters,
+    render_paginated_grid,
+    render_diagnostics_panel,
+    get_audit_report,
+    render_audit_report
+)
+from exporter import EXPORT_COLUMNS, available_export_formats, prepare_export
+from metrics import metrics
 
 
 # --- 1. CONFIGURAÇÃO INICIAL E PALETA CROMÁTICA ---
 load_dotenv()
+# Início da execução do script (tempo de renderização da página no painel de diagnóstico)
+PAGE_RENDER_STARTED = time.perf_counter()
+# Intervalo (s) entre as atualizações do progresso de um upload em processamento
+JOB_POLL_SECONDS = 1.0
+# Análise inicial do LLM gerada automaticamente após a auditoria local (0 = só quando o usuário pedir)
+AGENT_AUTO_AUDIT = os.getenv("LANCAI_AGENT_AUTO_AUDIT", "1") not in ("0", "false", "False")
 
 # Paleta Cromática (Hex) do Projeto LançAI
 PRIMARY_COLOR = "#C05533"  # Terracota Metálico
@@ -80,9 +107,17 @@ def initialize_session_state():
         st.session_state['mode'] = 'none' 
     if 'initial_summary' not in st.session_state:
         st.session_state['initial_summary'] = None # Armazena o resumo da primeira chamada
+    if 'initial_summary_requested' not in st.session_state:
+        st.session_state['initial_summary_requested'] = AGENT_AUTO_AUDIT # Gerar a análise inicial do LLM
+    if 'data_version' not in st.session_state:
+        st.session_state['data_version'] = None # (id do DataFrame, hash do conteúdo)
+    if 'ingestion_job' not in st.session_state:
+        st.session_state['ingestion_job'] = None # Id do job de ingestão em segundo plano
+    if 'ingestion_messages' not in st.session_state:
+        st.session_state['ingestion_messages'] = [] # Mensagens (nível, texto) do último upload
     
-    if not os.path.exists(TEMP_FOLDER):
-        os.makedirs(TEMP_FOLDER)
+    # Pasta de trabalho própria da sessão (usuários simultâneos não compartilham arquivos)
+    st.session_state['workspace'] = get_session_workspace(st.session_state.get('workspace'))
 
 initialize_session_state()
 
@@ -97,6 +132,26 @@ def render_agent_query_interface(df: pd.DataFrame, is_fiscal_mode: bool = False)
         "Digite sua pergunta sobre os dados/lançamentos (Ex: 'Qual o valor total?', 'Quais as contas não mapeadas?')"
     )
     
+    # Modo consulta SQL: o Agente vê só o esquema e escreve uma consulta, executada localmente
+    use_sql = st.checkbox(
+        "Responder com consulta SQL local (resultado exato)",
+        help="Para arquivos grandes: o Agente recebe apenas as colunas e algumas linhas de exemplo, gera uma consulta SQL "
+             "de leitura executada aqui sobre todas as linhas e depois resume o resultado."
+    )
+    # Modo map-reduce: o Agente analisa todas as linhas em partes e consolida as respostas
+    use_map_reduce = st.checkbox(
+        "Analisar todas as linhas em partes (map-reduce)",
+        help="Para arquivos grandes: cada parte é analisada separadamente e as respostas são consolidadas. Faz várias chamadas à API.",
+        disabled=use_sql
+    ) and not use_sql
+    partition_by = 'linhas'
+    if use_map_reduce and is_fiscal_mode:
+        partition_by = st.selectbox(
+            "Dividir os lançamentos por",
+            options=['cfop', 'emissor', 'linhas'],
+            format_func={'cfop': 'CFOP', 'emissor': 'Emissor', 'linhas': 'Faixas de linhas'}.get
+        )
+
     button_label = "Perguntar ao Agente"
     if not is_fiscal_mode:
         # Modo análise de dados genéricos
@@ -104,107 +159,189 @@ def render_agent_query_interface(df: pd.DataFrame, is_fiscal_mode: bool = False)
 
     if st.button(button_label):
         if user_question:
-            with st.spinner(f"💬 O Agente está processando sua pergunta: '{user_question}'..."):
-                
+            # Perguntas quantitativas comuns são calculadas localmente (exatas e sem chamada à API)
+            response_text = answer_locally(df, user_question)
+
+            st.markdown("#### 💬 Resposta do Agente:")
+            if response_text is not None:
+                st.success(response_text)
+            elif use_sql:
+                render_sql_answer(df, user_question)
+            else:
                 # Prepara a tarefa para o cérebro do agente
                 task = user_question
                 if not is_fiscal_mode:
                     # Se não for modo fiscal, passamos uma tarefa mais genérica
                     task = f"Analise o DataFrame e responda a esta pergunta: {user_question}"
-                
-                response_text = generate_accounting_summary_and_answer(df, task)
-                
-                st.markdown("#### 💬 Resposta do Agente:")
-                st.success(response_text)
+
+                if use_map_reduce:
+                    with st.spinner(f"💬 O Agente está analisando {len(df)} linhas em partes..."):
+                        st.success(generate_map_reduce_answer(df, task, partition_by=partition_by))
+                else:
+                    # A resposta é exibida à medida que o Agente a gera
+                    with st.container(border=True):
+                        st.write_stream(stream_accounting_summary_and_answer(df, task))
         else:
             st.warning("Por favor, digite sua pergunta antes de clicar no botão de envio.")
 
 
-# --- PROCESSAMENTO DE UPLOAD HÍBRIDO (COM CORREÇÃO DE FLUXO) ---
+# --- PROCESSAMENTO DE UPLOAD HÍBRIDO (EM SEGUNDO PLANO) ---
+def render_sql_answer(df: pd.DataFrame, user_question: str):
+    """Consulta SQL gerada pelo Agente, resultado exato (executado localmente) e o resumo do Agente."""
+    with st.spinner(f"💬 O Agente está escrevendo a consulta SQL sobre {len(df)} linhas..."):
+        query = answer_with_sql(df, user_question)
+    if query['error']:
+        st.error(query['error'])
+        if query.get('sql'):
+            st.code(query['sql'], language='sql')
+        return
+
+    with st.expander("🧮 Consulta SQL executada"):
+        st.code(query['sql'], language='sql')
+        st.caption(f"Motor: {query['engine']} | {query['seconds'] * 1000:.0f} ms | consulta somente leitura sobre todas as linhas.")
+    st.dataframe(query['result'], use_container_width=True, hide_index=True)
+    if query['truncated']:
+        st.caption(f"Resultado cortado nas primeiras {len(query['result'])} linhas.")
+    with st.container(border=True):
+        st.write_stream(stream_sql_answer_summary(user_question, query))
+
+
+def apply_ingestion_result(mode: str, df: pd.DataFrame):
+    """Entrega o resultado da ingestão à sessão (modo e DataFrame correspondente)."""
+    st.session_state['mode'] = mode
+    st.session_state['df_lancamentos' if mode == 'lancai' else 'df_data_analysis'] = df
+
+
 def process_uploaded_file(uploaded_file):
     """Lida com arquivos CSV/XLSX diretos ou ZIPs contendo CSVs/XMLs."""
     
-    # Limpa o estado e arquivos temp para começar um NOVO upload
+    # Limpa o estado para começar um NOVO upload
     clear_session_state() 
-    
-    # Limpa arquivos da pasta temp, ignorando erros de permissão
-    for f in os.listdir(TEMP_FOLDER):
-        try:
-            os.remove(os.path.join(TEMP_FOLDER, f))
-        except Exception:
-            pass # Ignora o erro se o arquivo estiver em uso
-
-    file_name = uploaded_file.name.lower()
-    
-    # CENÁRIO 1: CSV/XLSX Direto (MODO VISUALIZAÇÃO)
-    if file_name.endswith(('.csv', '.xlsx')): 
-        st.info("Arquivo de dados detectado. Carregando para visualização simples...")
-        
-        filepath = os.path.join(TEMP_FOLDER, uploaded_file.name)
-        with open(filepath, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-            
-        df = load_and_validate_csv(filepath)
-        if df is not None:
-             st.session_state['mode'] = 'data_analysis' 
-             st.session_state['df_data_analysis'] = df 
-             st.success("Visualização de dados ativada.")
-             st.rerun() # <-- REINTRODUZIDO
-             return 
-
-    # CENÁRIO 2: ZIP (Tenta LançAI Contábil primeiro, depois Visualização)
-    elif file_name.endswith('.zip'):
-        
-        # Tenta 2A: MODO LANÇAI CONTÁBIL (XML)
-        if unpack_xml_zip_lancai(uploaded_file):
-            st.info("XMLs extraídos. Processando lançamentos contábeis...")
-            df_lancamentos = process_xml_files()
-            if df_lancamentos is not None:
-                st.session_state['mode'] = 'lancai'
-                st.session_state['df_lancamentos'] = df_lancamentos
-                st.success("Módulo LançAI Contábil-Fiscal ativado. Resultados prontos para análise.")
-                st.rerun() # <-- REINTRODUZIDO
-                return 
-            else:
-                # O process_xml_files já limpa os XMLs extraídos
-                st.warning("XMLs encontrados, mas o Agente LançAI não conseguiu gerar lançamentos válidos. Tentando modo Visualização de Dados...")
 
-        # Tenta 2B: MODO VISUALIZAÇÃO DE DADOS (CSV/XLSX DENTRO DO ZIP)
-        st.warning("Tentando extrair CSV/XLSX para visualização...")
-        data_filepath = unpack_data_zip(uploaded_file) 
-        
-        if data_filepath:
-            df = load_and_validate_csv(data_filepath)
-            # O unpack_data_zip já removeu o ZIP, mas o load_and_validate_csv usa o arquivo extraído (CSV/XLSX)
-            
-            if df is not None:
-                st.session_state['mode'] = 'data_analysis' 
-                st.session_state['df_data_analysis'] = df 
-                st.success("Visualização de dados ativada. Dados carregados do ZIP.")
-                
-                # Devemos remover o arquivo extraído CSV/XLSX antes do rerun
-                try:
-                    os.remove(data_filepath)
-                except Exception:
-                    pass
-                
-                st.rerun() # <-- REINTRODUZIDO
-                return
-
-        # FALHA EXPLÍCITA NO ZIP: Se chegou aqui, nada funcionou.
-        st.session_state['mode'] = 'none'
-        st.error("Falha ao processar o arquivo ZIP. Ele não continha XMLs de NF-e válidas para o LançAI nem arquivos CSV/XLSX para visualização de dados.")
+    # Reenvio de um arquivo já processado: resultado servido pelo cache (mesmo conteúdo + mesma configuração)
+    upload_key = make_upload_key(uploaded_file.getvalue(), uploaded_file.name.lower(), ingestion_config_signature())
+    cached = ingestion_cache.get(upload_key)
+    if cached is not None:
+        apply_ingestion_result(*cached)
+        st.session_state['ingestion_messages'] = [('success', "Arquivo já processado anteriormente. Resultados carregados do cache.")]
         return
 
-    # CENÁRIO 3: NENHUM ARQUIVO VÁLIDO ENCONTRADO
-    st.session_state['mode'] = 'none'
-    st.warning("Nenhum modo de processamento foi ativado. Por favor, carregue um arquivo válido.")
+    # O processamento (descompactação, parsing e regras) roda em segundo plano: a página continua
+    # respondendo e um rerun não interrompe o trabalho. O progresso é acompanhado por render_ingestion_status.
+    job_id = job_manager.submit(uploaded_file, uploaded_file.name, upload_key)
+    if job_id is None:
+        st.session_state['ingestion_messages'] = [('warning', "Muitos arquivos em processamento no momento. Aguarde alguns instantes e envie o arquivo novamente.")]
+        return
+    st.session_state['ingestion_job'] = job_id
+
+
+def _run_every_fragment(run_every: float):
+    """st.fragment com atualização periódica (st.experimental_fragment nas versões anteriores à 1.37)."""
+    fragment = getattr(st, 'fragment', None) or st.experimental_fragment
+    return fragment(run_every=run_every)
+
+
+@_run_every_fragment(JOB_POLL_SECONDS)
+def render_ingestion_status():
+    """
+    Acompanha o job de ingestão da sessão: só este trecho é atualizado a cada JOB_POLL_SECONDS.
+    Ao terminar, o resultado (ou as mensagens de erro) vai para a sessão e a página é recarregada.
+    """
+    job = job_manager.get(st.session_state.get('ingestion_job'))
+    if job is None:
+        # Job descartado (ex.: reinício do servidor): não há mais o que acompanhar
+        st.session_state['ingestion_job'] = None
+        st.rerun()
+        return
+
+    if not job.done:
+        if render_ingestion_job(job.snapshot()):
+            # O estado "Cancelando" aparece na próxima atualização do trecho
+            job_manager.cancel(job.id)
+        return
+
+    job_manager.pop(job.id)
+    st.session_state['ingestion_job'] = None
+    messages = [message for message in job.messages if message[0] != 'info']
+    if job.status == JOB_DONE:
+        mode, df = job.result
+        apply_ingestion_result(mode, df)
+        if mode == 'lancai':
+            messages.append(('success', "Módulo LançAI Contábil-Fiscal ativado. Resultados prontos para análise."))
+        else:
+            messages.append(('success', "Visualização de dados ativada."))
+    else:
+        st.session_state['mode'] = 'none'
+        messages = messages or job.messages[-1:]
+    st.session_state['ingestion_messages'] = messages
+    st.rerun()
+
+
+def render_ingestion_messages():
+    """Mensagens do último upload (avisos, erros ou a confirmação do modo ativado)."""
+    alerts = {'error': st.error, 'warning': st.warning, 'info': st.info, 'success': st.success}
+    for level, message in st.session_state.get('ingestion_messages', []):
+        alerts.get(level, st.info)(message)
 
 def clear_session_state():
+    # Um upload ainda em processamento é descartado (para no próximo ponto de interrupção)
+    job_manager.cancel(st.session_state.get('ingestion_job'))
+    st.session_state['ingestion_job'] = None
+    st.session_state['ingestion_messages'] = []
     st.session_state['df_data_analysis'] = None
     st.session_state['df_lancamentos'] = None
     st.session_state['mode'] = 'none'
     st.session_state['initial_summary'] = None
+    st.session_state['initial_summary_requested'] = AGENT_AUTO_AUDIT
+    st.session_state['data_version'] = None
+
+
+def _read_file_bytes(path: str) -> bytes:
+    with open(path, 'rb') as export_file:
+        return export_file.read()
+
+
+def render_export_section(
+    df: pd.DataFrame, fmt_options: Optional[List[str]] = None, columns: Optional[List[str]] = EXPORT_COLUMNS,
+    label: str = "Exportar Lançamentos", file_stem: str = "lancamentos_lancai_prontos", key: str = 'export'
+):
+    """
+    Exportação sob demanda: o arquivo só é gerado ao clicar em "Preparar" e fica guardado
+    na pasta de trabalho da sessão para a versão atual dos dados (um novo clique o reaproveita).
+    O arquivo preparado fica registrado na sessão: o botão de download continua disponível nos
+    reruns seguintes e só lê o arquivo quando é clicado.
+    """
+    formats = {f: spec for f, spec in available_export_formats().items() if fmt_options is None or f in fmt_options}
+    if len(formats) > 1:
+        fmt = st.radio(
+            "Formato de exportação",
+            options=list(formats),
+            format_func=lambda f: formats[f]['label'],
+            horizontal=True,
+            key=f'{key}_format'
+        )
+    else:
+        fmt = next(iter(formats))
+    spec = formats[fmt]
+    format_label = spec['label'] if len(formats) > 1 else spec['extension'].upper()
+
+    # O arquivo preparado vale para esta versão dos dados, formato e colunas
+    signature = (get_data_version(df), fmt, tuple(columns) if columns is not None else None)
+    if st.button(f"Preparar arquivo ({format_label})", key=f'{key}_prepare'):
+        with st.spinner(f"Gerando a exportação de {len(df)} linhas..."):
+            export_path = prepare_export(df, fmt, st.session_state['workspace'], signature[0], columns=columns)
+        st.session_state[f'{key}_prepared'] = {'signature': signature, 'path': export_path}
+
+    prepared = st.session_state.get(f'{key}_prepared')
+    if prepared and prepared['signature'] == signature and os.path.exists(prepared['path']):
+        st.download_button(
+            label=f"{label} ({format_label})",
+            data=partial(_read_file_bytes, prepared['path']),
+            file_name=f"{file_stem}.{spec['extension']}",
+            mime=spec['mime'],
+            type="secondary",
+            key=f'{key}_download'
+        )
 
 
 # --- HEADER E IDENTIDADE VISUAL ---
@@ -233,7 +370,7 @@ def on_upload_change():
     uploaded_file = st.session_state.uploader_key
     
     if uploaded_file is not None:
-        # 1. Processa o arquivo (isso chamará st.rerun() se bem-sucedido)
+        # 1. Enfileira o processamento do arquivo (ou carrega o resultado do cache)
         process_uploaded_file(uploaded_file)
         
         # 2. CRÍTICO: Limpa o estado do uploader para que o próximo rerun não chame process_uploaded_file novamente
@@ -253,53 +390,91 @@ with st.sidebar:
         label_visibility="visible"
     )
 
+    # Consulta à base de notas já processadas (todos os uploads anteriores, sem reenviar arquivos)
+    if ledger_store.enabled:
+        with st.expander("📚 Base de Notas (histórico)"):
+            df_periods = ledger_store.periods()
+            if df_periods.empty:
+                st.caption("Nenhuma nota gravada ainda. Os XMLs processados são acrescentados automaticamente.")
+            else:
+                st.caption(f"{int(df_periods['Notas'].sum())} notas em {len(df_periods)} períodos.")
+                selected_periods = st.multiselect(
+                    "Períodos (vazio = todos)",
+                    options=df_periods['Periodo'].tolist(),
+                    format_func=lambda p: p or "Sem data"
+                )
+                if st.button("Carregar lançamentos da base"):
+                    df_ledger = load_ledger_lancamentos(selected_periods or None)
+                    if df_ledger is None:
+                        st.warning("Nenhuma nota encontrada para os períodos selecionados.")
+                    else:
+                        clear_session_state()
+                        st.session_state['mode'] = 'lancai'
+                        st.session_state['df_lancamentos'] = df_ledger
+                        st.rerun()
+
 # ==============================================================================
 # 3. EXIBIÇÃO DA INTERFACE E INVOCACÃO DO AGENTE
 # ==============================================================================
 
+# Upload em processamento (atualizado em segundo plano) e mensagens do último upload
+if st.session_state.get('ingestion_job'):
+    render_ingestion_status()
+render_ingestion_messages()
+
 if st.session_state.get('mode') == 'lancai':
     # --- MODO LANÇAI CONTÁBIL (XML) ---
     df = st.session_state.df_lancamentos
     
     st.subheader("1. Lançamentos Gerados e Análise Inicial")
     
-    # 3.1. Chamada Inicial do Agente (Auditoria e Resumo)
-    if st.session_state.get('initial_summary') is None:
-        
-        with st.spinner(f"🧠 O Agente LançAI está auditando {len(df)} lançamentos e gerando o resumo inicial..."):
-            initial_task = "Faça a análise inicial do DataFrame. Forneça o resumo e a auditoria de mapeamentos (Regra Não Mapeada)."
-            summary_text = generate_accounting_summary_and_answer(df, initial_task)
-            st.session_state['initial_summary'] = summary_text
-            
-            # ESTE RERUN É VITAL para que o spinner desapareça e o resumo seja exibido
+    # 3.1. Auditoria Local (calculada na ingestão, sem esperar o LLM)
+    st.markdown("#### 📋 Auditoria Automática dos Lançamentos:")
+    with metrics.timer('render_audit_report'):
+        render_audit_report(get_audit_report(df))
+
+    # 3.2. Análise Inicial do Agente: o espaço fica reservado aqui e o texto é gerado
+    # no fim do script, depois que o restante da página já foi exibido
+    st.markdown("#### 🧠 Análise e Validação Inicial do Agente LançAI:")
+    initial_summary_slot = st.container()
+    if st.session_state.get('initial_summary') is not None:
+        # Exibir o resumo inicial já gerado
+        initial_summary_slot.info(st.session_state.initial_summary)
+    elif not st.session_state.get('initial_summary_requested'):
+        if initial_summary_slot.button("Gerar análise do Agente (LLM)"):
+            st.session_state['initial_summary_requested'] = True
             st.rerun()
 
-    # Exibir o resumo inicial após a primeira chamada
-    if st.session_state.get('initial_summary'):
-        st.markdown("#### 🧠 Análise e Validação Inicial do Agente LançAI:")
-        st.info(st.session_state.initial_summary)
-
     # 3.2. Interface de Perguntas e Respostas
     render_agent_query_interface(df, is_fiscal_mode=True)
 
     # 3.3. Prévia e Exportação
     with st.expander("📝 Lançamentos Contábeis Gerados (Prévia)"):
-        st.dataframe(df, use_container_width=True)
-        nao_mapeados = len(df[df['Conta_Debito'] == 'Regra Não Mapeada'])
-        st.markdown(f"**Total de Lançamentos Não Mapeados:** {nao_mapeados}")
+        # Apenas a página atual vai para o navegador; filtros e contadores rodam no servidor
+        with metrics.timer('render_preview'):
+            render_paginated_grid(df, key='grid_lancamentos', lancamentos_filters=True)
+        counters = get_summary_counters(df)
+        st.markdown(f"**Total de Lançamentos Não Mapeados:** {counters.get('nao_mapeados', 0)}")
+        compaction = df.attrs.get('compactacao')
+        if compaction:
+            st.caption(
+                f"Memória dos lançamentos: {compaction['bytes_depois'] / 1e6:.1f} MB "
+                f"({compaction['economia_pct']}% a menos com categorias e valores em centavos)."
+            )
 
     st.markdown("---")
     st.markdown("#### ⬇️ 3. Geração de Saída (Exportação)")
-    csv_export = df[['NFe_Chave', 'Emissor', 'CFOP_Principal', 'Conta_Debito', 'Conta_Credito', 'Valor_Lancamento']].to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="Exportar Lançamentos (CSV) - Formato de Integração",
-        data=csv_export,
-        file_name='lancamentos_lancai_prontos.csv',
-        mime='text/csv',
-        type="secondary"
-    )
+    render_export_section(df)
     st.success("✅ Processamento Contábil Concluído e Agente pronto para perguntas.")
 
+    if st.session_state.get('initial_summary') is None and st.session_state.get('initial_summary_requested'):
+        # O resumo é exibido à medida que o Agente o gera; o texto completo fica na sessão
+        with initial_summary_slot:
+            st.caption(f"🧠 O Agente LançAI está auditando {len(df)} lançamentos e gerando o resumo inicial...")
+            with st.container(border=True):
+                summary_text = st.write_stream(stream_accounting_summary_and_answer(df, INITIAL_AUDIT_TASK))
+        st.session_state['initial_summary'] = summary_text if isinstance(summary_text, str) else ''.join(map(str, summary_text))
+
 
 elif st.session_state.get('mode') == 'data_analysis':
     # --- MODO VISUALIZAÇÃO DE DADOS (CSV/XLSX) ---
@@ -309,10 +484,17 @@ elif st.session_state.get('mode') == 'data_analysis':
     st.info("O arquivo foi carregado com sucesso. Abaixo está uma prévia do DataFrame. O Agente de Query está disponível para análise de dados.")
     
     if df is not None:
-        st.dataframe(df, use_container_width=True)
+        with metrics.timer('render_preview'):
+            render_paginated_grid(df, key='grid_dados')
         
         # INCLUSÃO: Exibe as dimensões e as colunas (atendendo ao requisito)
         st.markdown(f"**Dimensões do DataFrame:** {len(df)} linhas e {len(df.columns)} colunas.")
+
+        # ZIP com vários arquivos de dados: linhas, tempo de leitura e falhas de cada um
+        file_report = df.attrs.get('arquivos_origem')
+        if file_report and len(file_report) > 1:
+            with st.expander(f"📂 Arquivos de Dados do ZIP ({len(file_report)})"):
+                st.dataframe(pd.DataFrame(file_report), use_container_width=True, hide_index=True)
         
         with st.expander("▶️ Ver Colunas e Tipos de Dados"):
             # Exibe as colunas e os tipos de dados
@@ -327,13 +509,9 @@ elif st.session_state.get('mode') == 'data_analysis':
         
     st.markdown("---")
     st.markdown("#### ⬇️ 3. Exportação")
-    csv_export = df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="Exportar DataFrame (CSV)",
-        data=csv_export,
-        file_name='dados_lancai_carregados.csv',
-        mime='text/csv',
-        type="secondary"
+    render_export_section(
+        df, fmt_options=['csv'], columns=None,
+        label="Exportar DataFrame", file_stem='dados_lancai_carregados', key='export_dados'
     )
 
 
@@ -349,4 +527,9 @@ else:
             <li><b>Para Automação Contábil-Fiscal (XML/ZIP):</b> O Agente irá processar, auditar e estará pronto para responder perguntas sobre os lançamentos.</li>
             <li><b>Para Visualização de Dados (CSV/XLSX):</b> Apenas a prévia será exibida.</li>
         </ul>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+    """, unsafe_allow_html=True)
+
+# --- DIAGNÓSTICO DE DESEMPENHO (TODOS OS MODOS) ---
+metrics.record_stage('render_page', time.perf_counter() - PAGE_RENDER_STARTED, mode=st.session_state.get('mode'))
+st.markdown("---")
+render_diagnostics_panel()
@@ -0,0 +1,301 @@
+# metrics.py - LançAI: Instrumentação do Pipeline (tempos por etapa, contadores e exportação)
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Any, Optional, List, Tuple, Iterator, Callable
+
+# Configuração (LANCAI_METRICS=0 desativa toda a coleta)
+METRICS_ENABLED = os.getenv("LANCAI_METRICS", "1") not in ("0", "false", "False")
+# Eventos recentes mantidos em memória (cada etapa medida gera um evento)
+METRICS_MAX_EVENTS = int(os.getenv("LANCAI_METRICS_MAX_EVENTS", "2000"))
+# Arquivos opcionais para coleta externa: eventos em JSON lines (acrescentados) e
+# o texto no formato Prometheus (reescrito no máximo a cada METRICS_PROMETHEUS_INTERVAL segundos,
+# para o textfile collector do node_exporter)
+METRICS_JSONL_PATH = os.getenv("LANCAI_METRICS_JSONL_PATH", "")
+METRICS_PROMETHEUS_PATH = os.getenv("LANCAI_METRICS_PROMETHEUS_PATH", "")
+METRICS_PROMETHEUS_INTERVAL = max(0.0, float(os.getenv("LANCAI_METRICS_PROMETHEUS_INTERVAL", "5")))
+# As métricas são do processo (todas as sessões): só uma instalação administrada exibe o botão de zerá-las
+METRICS_ADMIN = os.getenv("LANCAI_METRICS_ADMIN", "0") in ("1", "true", "True")
+METRIC_PREFIX = "lancai"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class StageCancelled(Exception):
+    """Interrupção pedida pelo usuário (ex.: job de ingestão cancelado): a etapa é registrada como 'cancelled'."""
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _prometheus_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas do processo (compartilhado por todas as sessões):
+    * contadores (ex.: XMLs analisados, acertos de cache, tokens);
+    * resumos de valores observados (quantidade, soma, mín., máx. e último), usados
+      para a duração de cada etapa (stage_seconds) e para os tokens por chamada;
+    * eventos recentes, um por etapa medida, exportáveis em JSON lines.
+    O custo por medição é um lock e algumas somas: as medições ficam em torno de
+    etapas inteiras (um upload, uma chamada ao LLM), nunca por linha ou por XML.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = METRICS_ENABLED,
+        max_events: int = METRICS_MAX_EVENTS,
+        jsonl_path: str = METRICS_JSONL_PATH,
+        prometheus_path: str = METRICS_PROMETHEUS_PATH,
+        prometheus_interval: float = METRICS_PROMETHEUS_INTERVAL
+    ):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.prometheus_interval = prometheus_interval
+        self.started_at = time.time()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._summaries: Dict[Tuple[str, LabelKey], Dict[str, float]] = {}
+        self._events: 'deque[Dict[str, Any]]' = deque(maxlen=max(1, max_events))
+        self._lock = threading.Lock()
+        # Arquivos externos: escrita serializada entre threads e regravação do Prometheus adiada
+        self._external_lock = threading.Lock()
+        self._prometheus_written_at = float('-inf')
+        self._prometheus_timer: Optional[threading.Timer] = None
+
+    # --- Coleta ---
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Soma value ao contador name (com os rótulos informados)."""
+        if not self.enabled or not value:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Registra um valor observado (duração, tokens...) no resumo name."""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                self._summaries[key] = {'count': 1, 'sum': value, 'min': value, 'max': value, 'last': value}
+            else:
+                summary['count'] += 1
+                summary['sum'] += value
+                summary['min'] = min(summary['min'], value)
+                summary['max'] = max(summary['max'], value)
+                summary['last'] = value
+
+    def record_stage(self, stage: str, seconds: float, status: str = 'ok', **details: Any) -> None:
+        """Registra a duração de uma etapa e o evento correspondente."""
+        if not self.enabled:
+            return
+        self.observe('stage_seconds', seconds, stage=stage)
+        if status == 'error':
+            self.increment('stage_errors_total', stage=stage)
+        event = {'ts': round(time.time(), 3), 'stage': stage, 'seconds': round(seconds, 6), 'status': status}
+        event.update(details)
+        with self._lock:
+            self._events.append(event)
+        self._write_external(event)
+
+    @contextmanager
+    def timer(self, stage: str, **details: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Mede a duração do bloco como uma etapa. O dicionário devolvido pode receber
+        detalhes durante o bloco (ex.: quantidade de linhas), gravados no evento.
+        """
+        if not self.enabled:
+            yield details
+            return
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            yield details
+        except (GeneratorExit, StageCancelled):
+            # Streaming interrompido por quem consumia (ex.: o usuário saiu da página) ou job cancelado
+            status = 'cancelled'
+            raise
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.record_stage(stage, time.perf_counter() - started, status, **details)
+
+    def timed(self, stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """Decorador: mede cada chamada da função como a etapa stage."""
+        def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+            @wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+            self._events.clear()
+            self.started_at = time.time()
+
+    # --- Consulta e exportação ---
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cópia dos contadores e resumos (para o painel de diagnóstico)."""
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            summaries = [
+                dict({'name': name, 'labels': dict(labels)}, **summary)
+                for (name, labels), summary in sorted(self._summaries.items())
+            ]
+        return {'started_at': self.started_at, 'counters': counters, 'summaries': summaries}
+
+    def stage_table(self) -> List[Dict[str, Any]]:
+        """Uma linha por etapa: chamadas, tempo total, médio, máximo e da última execução."""
+        return [
+            {
+                'Etapa': summary['labels'].get('stage', ''),
+                'Chamadas': int(summary['count']),
+                'Total (s)': round(summary['sum'], 3),
+                'Média (ms)': round(1000 * summary['sum'] / summary['count'], 1),
+                'Máx. (ms)': round(1000 * summary['max'], 1),
+                'Última (ms)': round(1000 * summary['last'], 1),
+            }
+            for summary in self.snapshot()['summaries'] if summary['name'] == 'stage_seconds'
+        ]
+
+    def counter_value(self, name: str, **labels: Any) -> float:
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def recent_events(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            events = list(self._events)
+        return events[-limit:] if limit else events
+
+    def to_json_lines(self) -> str:
+        """Eventos recentes (um por linha) seguidos dos contadores e resumos atuais."""
+        snapshot = self.snapshot()
+        lines = [json.dumps(dict(event, type='event'), ensure_ascii=False) for event in self.recent_events()]
+        lines += [json.dumps(dict(counter, type='counter'), ensure_ascii=False) for counter in snapshot['counters']]
+        lines += [json.dumps(dict(summary, type='summary'), ensure_ascii=False) for summary in snapshot['summaries']]
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+    def to_prometheus(self) -> str:
+        """Contadores e resumos no formato de texto do Prometheus (exposition format 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            summaries = sorted(self._summaries.items())
+
+        lines: List[str] = []
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{_prometheus_labels(labels)} {value:g}")
+        for (name, labels), summary in summaries:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} summary")
+                declared.add(metric)
+            label_text = _prometheus_labels(labels)
+            lines.append(f"{metric}_count{label_text} {summary['count']:g}")
+            lines.append(f"{metric}_sum{label_text} {summary['sum']:.6f}")
+        for suffix, field in (('max', 'max'), ('last', 'last')):
+            gauge = f"{METRIC_PREFIX}_stage_seconds_{suffix}"
+            rows = [(labels, summary) for (name, labels), summary in summaries if name == 'stage_seconds']
+            if rows:
+                lines.append(f"# TYPE {gauge} gauge")
+                lines += [f"{gauge}{_prometheus_labels(labels)} {summary[field]:.6f}" for labels, summary in rows]
+        lines.append(f"# TYPE {METRIC_PREFIX}_metrics_start_time_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_metrics_start_time_seconds {self.started_at:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def _write_external(self, event: Dict[str, Any]) -> None:
+        """Grava o evento no JSON lines e agenda a atualização do arquivo do Prometheus (se configurados)."""
+        if self.jsonl_path:
+            try:
+                with self._external_lock, open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+            except OSError:
+                # Falha na exportação nunca interrompe o pipeline
+                pass
+        if self.prometheus_path:
+            self._schedule_prometheus()
+
+    def _schedule_prometheus(self) -> None:
+        """
+        Regrava o arquivo do Prometheus no máximo uma vez por prometheus_interval: dentro do
+        intervalo, um timer faz uma única regravação ao final dele (com todas as etapas do período).
+        """
+        with self._external_lock:
+            if self._prometheus_timer is not None:
+                return
+            delay = self._prometheus_written_at + self.prometheus_interval - time.monotonic()
+            if delay <= 0:
+                self._write_prometheus()
+                return
+            self._prometheus_timer = threading.Timer(delay, self.flush)
+            self._prometheus_timer.daemon = True
+            self._prometheus_timer.start()
+
+    def flush(self) -> None:
+        """Grava agora a atualização pendente do arquivo do Prometheus (chamado pelo timer e na saída)."""
+        with self._external_lock:
+            if self._prometheus_timer is None:
+                return
+            self._prometheus_timer.cancel()
+            self._prometheus_timer = None
+            self._write_prometheus()
+
+    def _write_prometheus(self) -> None:
+        """Reescreve o arquivo do Prometheus (chamado com _external_lock adquirido)."""
+        self._prometheus_written_at = time.monotonic()
+        temp_path = None
+        try:
+            # Temporário de nome único na mesma pasta + rename: o coletor nunca lê um arquivo pela metade
+            directory = os.path.dirname(os.path.abspath(self.prometheus_path))
+            with tempfile.NamedTemporaryFile(
+                'w', encoding='utf-8', dir=directory, prefix=os.path.basename(self.prometheus_path) + '.',
+                suffix='.tmp', delete=False
+            ) as f:
+                temp_path = f.name
+                f.write(self.to_prometheus())
+            os.replace(temp_path, self.prometheus_path)
+        except OSError:
+            # Falha na exportação nunca interrompe o pipeline
+            if temp_path and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+
+# Instância única compartilhada por todas as sessões do processo
+metrics = MetricsRegistry()
+atexit.register(metrics.flush)
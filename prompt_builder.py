@@ -0,0 +1,254 @@
+# prompt_builder.py - LançAI: Montagem do Prompt do Agente com Orçamento de Tokens
+
+import math
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Optional, List, Tuple
+from rules_engine import UNMAPPED_ACCOUNT
+from compact_dtypes import CENTS_COLUMN, expand_lancamentos
+
+# Orçamento total de tokens do prompt (sistema + dados + pergunta)
+PROMPT_TOKEN_BUDGET = int(os.getenv("LANCAI_PROMPT_TOKEN_BUDGET", "12000"))
+# Estimativa usual para textos em português/CSV: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+# Quantidade máxima de grupos listados em cada agregação (o restante vira "Demais")
+MAX_GROUPS_PER_AGGREGATE = 25
+# Quantidade máxima de lançamentos não mapeados listados individualmente
+MAX_UNMAPPED_LISTED = 50
+
+VALUE_COLUMN = 'Valor_Lancamento'
+
+# Critérios de partição do modo map-reduce: coluna usada (None = faixas de linhas)
+PARTITION_COLUMNS = {
+    'cfop': 'CFOP_Principal',
+    'emissor': 'Emissor',
+    'linhas': None,
+}
+# Quantidade máxima de valores do critério citados na descrição de cada parte
+MAX_PARTITION_KEYS_LISTED = 10
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa rápida (sem tokenizador) da quantidade de tokens de um texto."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def is_lancamentos_frame(df: pd.DataFrame) -> bool:
+    """Indica se o DataFrame é o de lançamentos contábeis gerado a partir dos XMLs."""
+    columns = set(df.columns)
+    return {'CFOP_Principal', 'Conta_Debito', 'Conta_Credito'}.issubset(columns) and bool({VALUE_COLUMN, CENTS_COLUMN} & columns)
+
+
+def build_schema_section(df: pd.DataFrame) -> str:
+    """Descreve as colunas, tipos e a quantidade de linhas do DataFrame."""
+    lines = [f"Linhas: {len(df)} | Colunas: {len(df.columns)}", "Coluna;Tipo;Valores distintos"]
+    for column in df.columns:
+        lines.append(f"{column};{df[column].dtype};{df[column].nunique(dropna=True)}")
+    return "\n".join(lines)
+
+
+def _format_value(value: float) -> str:
+    return f"{value:.2f}"
+
+
+def _aggregate(df: pd.DataFrame, column: str, max_groups: int) -> str:
+    """Totaliza quantidade e valor por coluna, listando os maiores grupos."""
+    grouped = (
+        df.groupby(column, dropna=False, observed=True)[VALUE_COLUMN]
+        .agg(['count', 'sum'])
+        .sort_values('sum', ascending=False)
+    )
+    lines = [f"{column};Quantidade;Valor_Total"]
+    for key, row in grouped.head(max_groups).iterrows():
+        lines.append(f"{key};{int(row['count'])};{_format_value(row['sum'])}")
+    if len(grouped) > max_groups:
+        rest = grouped.iloc[max_groups:]
+        lines.append(f"Demais ({len(rest)} grupos);{int(rest['count'].sum())};{_format_value(rest['sum'].sum())}")
+    return "\n".join(lines)
+
+
+def build_statistics_section(df: pd.DataFrame, max_groups: int = MAX_GROUPS_PER_AGGREGATE) -> str:
+    """
+    Estatísticas pré-calculadas sobre TODAS as linhas: totais por CFOP, conta e emitente,
+    além da lista de lançamentos não mapeados (modo LançAI). Para DataFrames genéricos,
+    um resumo das colunas numéricas e das categorias mais frequentes.
+    """
+    if df.empty:
+        return "DataFrame vazio."
+    df = expand_lancamentos(df)
+
+    if not is_lancamentos_frame(df):
+        parts = []
+        numeric = df.select_dtypes('number')
+        if not numeric.empty:
+            parts.append("Resumo numérico:\n" + numeric.describe().T.round(2).to_csv(sep=';'))
+        for column in df.select_dtypes(exclude='number').columns:
+            counts = df[column].value_counts(dropna=False)
+            if len(counts) <= max_groups:
+                parts.append(f"Frequência de {column}:\n" + counts.to_csv(sep=';', header=False))
+        return "\n".join(parts) if parts else "Sem colunas numéricas ou categóricas para resumir."
+
+    valores = df[VALUE_COLUMN]
+    parts = [
+        f"Total de lançamentos: {len(df)}",
+        f"Valor total ({VALUE_COLUMN}): {_format_value(valores.sum())}",
+        f"Valor médio: {_format_value(valores.mean())} | Mínimo: {_format_value(valores.min())} | Máximo: {_format_value(valores.max())}",
+        "",
+        "Totais por CFOP:\n" + _aggregate(df, 'CFOP_Principal', max_groups),
+        "",
+        "Totais por Conta de Débito:\n" + _aggregate(df, 'Conta_Debito', max_groups),
+        "",
+        "Totais por Conta de Crédito:\n" + _aggregate(df, 'Conta_Credito', max_groups),
+    ]
+    if 'Emissor' in df.columns:
+        parts += ["", "Totais por Emissor:\n" + _aggregate(df, 'Emissor', max_groups)]
+
+    unmapped = df[(df['Conta_Debito'] == UNMAPPED_ACCOUNT) | (df['Conta_Credito'] == UNMAPPED_ACCOUNT)]
+    parts += ["", f"Lançamentos com 'Regra Não Mapeada': {len(unmapped)}"]
+    if not unmapped.empty:
+        columns = [c for c in ('NFe_Chave', 'Emissor', 'CFOP_Principal', VALUE_COLUMN) if c in unmapped.columns]
+        parts.append(f"CFOPs não mapeados: {', '.join(sorted(unmapped['CFOP_Principal'].astype(str).unique()))}")
+        parts.append(unmapped[columns].head(MAX_UNMAPPED_LISTED).to_csv(sep=';', index=False).strip())
+        if len(unmapped) > MAX_UNMAPPED_LISTED:
+            parts.append(f"... e mais {len(unmapped) - MAX_UNMAPPED_LISTED} lançamentos não mapeados.")
+    return "\n".join(parts)
+
+
+def build_rows_section(df: pd.DataFrame, token_budget: int) -> Tuple[str, int]:
+    """
+    Converte para CSV apenas as primeiras linhas que cabem no orçamento de tokens.
+    Retorna o texto e a quantidade de linhas incluídas.
+    """
+    if df.empty or token_budget <= 0:
+        return "", 0
+
+    char_budget = token_budget * CHARS_PER_TOKEN
+    # Estima o tamanho médio da linha por uma amostra e ajusta até caber
+    sample = df.head(200).to_csv(sep=';', index=False)
+    header_chars = len(sample.split('\n', 1)[0]) + 1
+    avg_row_chars = max(1.0, (len(sample) - header_chars) / max(1, min(len(df), 200)))
+    n_rows = min(len(df), int((char_budget - header_chars) / avg_row_chars))
+
+    for _ in range(5):
+        if n_rows <= 0:
+            return "", 0
+        text = df.head(n_rows).to_csv(sep=';', index=False)
+        if len(text) <= char_budget:
+            return text.strip(), n_rows
+        n_rows = int(n_rows * char_budget / len(text) * 0.95)
+    return "", 0
+
+
+def build_agent_prompt(
+    df: pd.DataFrame,
+    user_question: str,
+    system_prompt: str,
+    token_budget: Optional[int] = None,
+    retrieval: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Monta o prompt do agente respeitando o orçamento de tokens: esquema, estatísticas
+    pré-calculadas e tantas linhas brutas quanto couberem no restante.
+    Com retrieval (row_index.select_relevant_rows), as estatísticas cobrem só as linhas
+    relacionadas à pergunta (mais uma linha com os totais gerais) e as linhas enviadas são
+    as mais relevantes, em vez das primeiras do DataFrame.
+    Retorna o prompt, os tokens estimados por seção e quantas linhas foram incluídas.
+    """
+    token_budget = token_budget or PROMPT_TOKEN_BUDGET
+    # Valores em centavos voltam para reais (coluna Valor_Lancamento citada no prompt do sistema)
+    df = expand_lancamentos(df)
+    question_text = f"PERGUNTA/TAREFA DO USUÁRIO: {user_question}"
+    schema_text = build_schema_section(df)
+
+    if retrieval is None:
+        df_stats, df_rows = df, df
+        stats_header = "--- ESTATÍSTICAS PRÉ-CALCULADAS (TODAS AS LINHAS) ---"
+        rows_title = "LINHAS DO DATAFRAME"
+    else:
+        df_stats, df_rows = df.iloc[retrieval['matched']], df.iloc[retrieval['top']]
+        overview = f"Todas as linhas do DataFrame: {len(df)}"
+        if is_lancamentos_frame(df):
+            overview += f" | Valor total ({VALUE_COLUMN}): {_format_value(df[VALUE_COLUMN].sum())}"
+        stats_header = (
+            f"--- ESTATÍSTICAS DAS LINHAS RELACIONADAS À PERGUNTA ({len(df_stats)} de {len(df)} linhas; "
+            f"critério: {'; '.join(retrieval['criteria'])}) ---\n{overview}"
+        )
+        rows_title = "LINHAS MAIS RELEVANTES PARA A PERGUNTA"
+
+    sections: List[Tuple[str, str]] = [
+        ('sistema', system_prompt),
+        ('esquema', f"--- ESQUEMA DO DATAFRAME ---\n{schema_text}"),
+        ('estatisticas', f"{stats_header}\n{build_statistics_section(df_stats)}"),
+    ]
+    used = sum(estimate_tokens(text) for _, text in sections) + estimate_tokens(question_text)
+    if used > token_budget:
+        # Estatísticas reduzidas para caber no orçamento
+        sections[2] = ('estatisticas', f"{stats_header}\n{build_statistics_section(df_stats, max_groups=5)}")
+        used = sum(estimate_tokens(text) for _, text in sections) + estimate_tokens(question_text)
+
+    rows_text, rows_included = build_rows_section(df_rows, token_budget - used - 50)
+    header = f"--- {rows_title} (CSV ';', {rows_included} de {len(df_stats)} linhas) ---"
+    sections.append(('linhas', f"{header}\n{rows_text}" if rows_text else f"{header}\n(nenhuma linha coube no orçamento)"))
+    sections.append(('pergunta', question_text))
+
+    prompt = "\n\n".join(text for _, text in sections)
+    token_usage = {name: estimate_tokens(text) for name, text in sections}
+    token_usage['total'] = estimate_tokens(prompt)
+    return {
+        'prompt': prompt,
+        'token_usage': token_usage,
+        'rows_included': rows_included,
+        'rows_total': len(df_stats),
+    }
+
+
+def partition_dataframe(df: pd.DataFrame, partition_by: str, chunk_rows: int) -> List[Tuple[str, pd.DataFrame]]:
+    """
+    Divide o DataFrame em partes de até chunk_rows linhas para o modo map-reduce.
+    Por CFOP/Emissor, os grupos inteiros são agrupados em partes (um grupo maior que o
+    limite é dividido em faixas de linhas); por 'linhas', faixas consecutivas.
+    Retorna (descrição da parte, DataFrame da parte).
+    """
+    if partition_by not in PARTITION_COLUMNS:
+        raise ValueError(f"Partição inválida: '{partition_by}'. Use {', '.join(PARTITION_COLUMNS)}.")
+    chunk_rows = max(1, chunk_rows)
+    column = PARTITION_COLUMNS[partition_by]
+
+    if column is None or column not in df.columns:
+        return [
+            (f"linhas {start + 1} a {min(start + chunk_rows, len(df))}", df.iloc[start:start + chunk_rows])
+            for start in range(0, len(df), chunk_rows)
+        ]
+
+    # Posições das linhas de cada grupo, dos maiores grupos para os menores
+    groups = sorted(df.groupby(column, dropna=False, observed=True, sort=False).indices.items(), key=lambda item: -len(item[1]))
+    chunks: List[Tuple[str, pd.DataFrame]] = []
+    pending_keys: List[str] = []
+    pending_positions: List[Any] = []
+    pending_size = 0
+
+    def flush():
+        nonlocal pending_keys, pending_positions, pending_size
+        if pending_positions:
+            positions = np.sort(np.concatenate(pending_positions))
+            keys_text = ', '.join(pending_keys[:MAX_PARTITION_KEYS_LISTED])
+            if len(pending_keys) > MAX_PARTITION_KEYS_LISTED:
+                keys_text += f" e mais {len(pending_keys) - MAX_PARTITION_KEYS_LISTED}"
+            chunks.append((f"{column} = {keys_text}", df.iloc[positions]))
+        pending_keys, pending_positions, pending_size = [], [], 0
+
+    for key, positions in groups:
+        if len(positions) > chunk_rows:
+            # Grupo grande: faixas de linhas do próprio grupo
+            for start in range(0, len(positions), chunk_rows):
+                part = positions[start:start + chunk_rows]
+                chunks.append((f"{column} = {key} (linhas {start + 1} a {start + len(part)} de {len(positions)})", df.iloc[part]))
+            continue
+        if pending_size + len(positions) > chunk_rows:
+            flush()
+        pending_keys.append(str(key))
+        pending_positions.append(positions)
+        pending_size += len(positions)
+    flush()
+    return chunks
@@ -0,0 +1,226 @@
+# row_index.py - LançAI: Índice Local de Recuperação de Linhas (TF-IDF em NumPy e índices exatos)
+
+import math
+import os
+import re
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Dict, Any, Optional, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics
+
+# Configuração (LANCAI_RETRIEVAL=0 volta a enviar sempre as primeiras linhas do DataFrame)
+RETRIEVAL_ENABLED = os.getenv("LANCAI_RETRIEVAL", "1") not in ("0", "false", "False")
+# Linhas mais relevantes enviadas no prompt quando a pergunta cita um emitente, nota, CFOP ou conta
+RETRIEVAL_TOP_K = int(os.getenv("LANCAI_RETRIEVAL_TOP_K", "50"))
+# Termos presentes em mais que esta fração das linhas não distinguem nada (tratados como palavras vazias)
+RETRIEVAL_MAX_DF_RATIO = float(os.getenv("LANCAI_RETRIEVAL_MAX_DF_RATIO", "0.5"))
+# Linhas relacionadas: escore de ao menos esta fração do melhor escore (descarta coincidências parciais)
+RETRIEVAL_MIN_RELATIVE_SCORE = 0.5
+# Índices mantidos em memória (um por DataFrame carregado)
+INDEX_CACHE_SIZE = 8
+
+KEY_COLUMN = 'NFe_Chave'
+CFOP_COLUMN = 'CFOP_Principal'
+# Colunas indexadas nos lançamentos; em DataFrames genéricos, as colunas de texto
+LANCAMENTOS_TEXT_COLUMNS = ('Emissor', CFOP_COLUMN, 'Conta_Debito', 'Conta_Credito', KEY_COLUMN)
+MAX_GENERIC_TEXT_COLUMNS = 20
+# Colunas com mais valores distintos que isto (ex.: textos livres) ficam fora do índice de termos
+MAX_DISTINCT_VALUES_PER_COLUMN = 200_000
+
+STOPWORDS = frozenset(
+    "a o as os da do das dos de e em no na nos nas um uma para por com sem que qual quais quanto quantos "
+    "se ao aos ou mais menos foi sao ser ha tem sua seu suas seus este esta esse essa isso pelo pela".split()
+)
+_TERM = re.compile(r'[^\W_]+')
+# Chave de acesso (44 dígitos, aceitando os espaços ou pontos da impressão em grupos)
+_NFE_KEY = re.compile(r'(?<!\w)\d(?:[\s.]?\d){43}(?!\w)')
+# CFOP com ou sem ponto (5102 ou 5.102)
+_CFOP = re.compile(r'(?<!\w)(?<!\d\.)([1-7])\.?(\d{3})(?!\w)(?!\.\d)')
+
+
+def tokenize(text: str) -> List[str]:
+    """Termos do texto: sem acentos, em minúsculas, sem palavras vazias e com ao menos 2 caracteres."""
+    normalized = unicodedata.normalize('NFKD', text.casefold())
+    normalized = ''.join(ch for ch in normalized if not unicodedata.combining(ch))
+    return [term for term in _TERM.findall(normalized) if len(term) >= 2 and term not in STOPWORDS]
+
+
+def strip_exact_filters(text: str, criteria: List[str]) -> str:
+    """Texto sem as chaves de acesso e os CFOPs que viraram filtros exatos (critérios de RowIndex.search)."""
+    used = {criterion.split(' ', 1)[1] for criterion in criteria if criterion.startswith(('chave ', 'CFOP '))}
+    text = _NFE_KEY.sub(lambda m: ' ' if re.sub(r'\D', '', m.group()) in used else m.group(), text)
+    return _CFOP.sub(lambda m: ' ' if ''.join(m.groups()) in used else m.group(), text)
+
+def _positions_by_code(codes: np.ndarray, n_values: int) -> List[np.ndarray]:
+    """Posições das linhas de cada valor distinto (códigos do factorize; -1 = vazio)."""
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(n_values + 1))
+    return [order[bounds[code]:bounds[code + 1]] for code in range(n_values)]
+
+
+class RowIndex:
+    """
+    Índice de recuperação montado uma vez por DataFrame:
+    * TF-IDF (tf binário, similaridade do cosseno) sobre o texto das colunas indexadas. Como os
+      valores se repetem muito (emitentes, CFOPs, contas), os termos são extraídos uma vez por
+      valor distinto e os escores das linhas saem de somas vetorizadas sobre os códigos dos valores;
+    * índices exatos de chave de acesso e CFOP (valor -> posições das linhas).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+        self.columns = [column for column in LANCAMENTOS_TEXT_COLUMNS if column in df.columns]
+        if not self.columns:
+            text_columns = df.select_dtypes(exclude=['number', 'bool', 'datetime', 'timedelta']).columns
+            self.columns = list(text_columns[:MAX_GENERIC_TEXT_COLUMNS])
+
+        # Por coluna: código do valor de cada linha (o último slot dos arrays por valor é o "vazio")
+        self._codes: List[np.ndarray] = []
+        self._n_values: List[int] = []
+        # termo -> [(coluna, códigos dos valores que contêm o termo)]
+        self._postings: Dict[str, List[Tuple[int, np.ndarray]]] = defaultdict(list)
+        term_rows: Dict[str, int] = defaultdict(int)
+        self._exact: Dict[str, Dict[str, np.ndarray]] = {}
+
+        for col_pos, column in enumerate(self.columns):
+            codes, uniques = pd.factorize(df[column], sort=False)
+            codes = np.where(codes < 0, len(uniques), codes)
+            self._codes.append(codes)
+            self._n_values.append(len(uniques))
+            if column in (KEY_COLUMN, CFOP_COLUMN):
+                positions = _positions_by_code(codes, len(uniques))
+                self._exact[column] = {str(value): positions[code] for code, value in enumerate(uniques)}
+            if len(uniques) > MAX_DISTINCT_VALUES_PER_COLUMN:
+                continue
+            rows_per_value = np.bincount(codes, minlength=len(uniques) + 1)
+            term_values: Dict[str, List[int]] = defaultdict(list)
+            for code, value in enumerate(uniques):
+                for term in set(tokenize(str(value))):
+                    term_values[term].append(code)
+            for term, value_codes in term_values.items():
+                value_codes_array = np.asarray(value_codes, dtype=np.int64)
+                self._postings[term].append((col_pos, value_codes_array))
+                term_rows[term] += int(rows_per_value[value_codes_array].sum())
+
+        self._term_rows = dict(term_rows)
+        self._idf = {term: math.log((self.n_rows + 1) / (rows + 1)) + 1.0 for term, rows in term_rows.items()}
+        # Norma de cada linha: raiz da soma dos idf² dos termos dos seus valores
+        value_norm_sq = [np.zeros(n_values + 1) for n_values in self._n_values]
+        for term, postings in self._postings.items():
+            for col_pos, value_codes in postings:
+                value_norm_sq[col_pos][value_codes] += self._idf[term] ** 2
+        norm_sq = np.zeros(self.n_rows)
+        for col_pos, codes in enumerate(self._codes):
+            norm_sq += value_norm_sq[col_pos][codes]
+        self._row_norm = np.sqrt(norm_sq)
+        self._row_norm[self._row_norm == 0] = 1.0
+
+    def _exact_matches(self, question: str) -> Tuple[Optional[np.ndarray], List[str]]:
+        """Linhas das chaves de acesso ou dos CFOPs citados na pergunta (None se nenhum foi citado)."""
+        criteria, found = [], []
+        keys = {re.sub(r'\D', '', match) for match in _NFE_KEY.findall(question)}
+        key_index = self._exact.get(KEY_COLUMN, {})
+        for key in sorted(keys):
+            if key in key_index:
+                found.append(key_index[key])
+                criteria.append(f"chave {key}")
+        if not found:
+            # CFOP só vale como filtro exato quando nenhuma chave foi encontrada
+            cfop_index = self._exact.get(CFOP_COLUMN, {})
+            cfops = {''.join(match) for match in _CFOP.findall(question)}
+            for cfop in sorted(cfops):
+                if cfop in cfop_index:
+                    found.append(cfop_index[cfop])
+                    criteria.append(f"CFOP {cfop}")
+        if not found:
+            return None, []
+        return np.unique(np.concatenate(found)), criteria
+
+    def scores(self, terms: List[str]) -> np.ndarray:
+        """Similaridade do cosseno (TF-IDF) de cada linha com os termos da consulta."""
+        value_scores = [np.zeros(n_values + 1) for n_values in self._n_values]
+        query_norm_sq = 0.0
+        for term in terms:
+            idf = self._idf[term]
+            query_norm_sq += idf ** 2
+            for col_pos, value_codes in self._postings[term]:
+                value_scores[col_pos][value_codes] += idf ** 2
+        row_scores = np.zeros(self.n_rows)
+        for col_pos, codes in enumerate(self._codes):
+            row_scores += value_scores[col_pos][codes]
+        return row_scores / (self._row_norm * math.sqrt(query_norm_sq or 1.0))
+
+    def search(self, question: str, top_k: int = RETRIEVAL_TOP_K) -> Optional[Dict[str, Any]]:
+        """
+        Linhas relacionadas à pergunta: as das chaves/CFOPs citados (refinadas pelos termos, se
+        houver interseção) ou as de escore próximo ao melhor (RETRIEVAL_MIN_RELATIVE_SCORE) para
+        os termos distintivos da pergunta. Retorna as posições
+        de todas as linhas relacionadas ('matched', em ordem), as top_k mais relevantes ('top') e os
+        critérios usados; None quando a pergunta não cita nada específico dos dados.
+        """
+        exact, criteria = self._exact_matches(question)
+        # Chaves e CFOPs são tratados pelos índices exatos: seus dígitos não entram como termos
+        free_text = question
+        for column, pattern in ((KEY_COLUMN, _NFE_KEY), (CFOP_COLUMN, _CFOP)):
+            if column in self._exact:
+                free_text = pattern.sub(' ', free_text)
+        max_rows = RETRIEVAL_MAX_DF_RATIO * self.n_rows
+        terms = sorted({term for term in tokenize(free_text) if term in self._idf and self._term_rows[term] <= max_rows})
+
+        row_scores = self.scores(terms) if terms else np.zeros(self.n_rows)
+        best = row_scores.max() if self.n_rows else 0.0
+        text_matched = np.flatnonzero(row_scores >= best * RETRIEVAL_MIN_RELATIVE_SCORE) if best > 0 else np.array([], dtype=np.int64)
+        if exact is not None:
+            refined = np.intersect1d(exact, text_matched, assume_unique=True)
+            matched = refined if len(refined) else exact
+        else:
+            matched = text_matched
+        if not len(matched):
+            return None
+        if terms and (exact is None or len(refined)):
+            criteria.append("termos: " + ', '.join(terms))
+
+        # Mais relevantes primeiro; empates na ordem original das linhas
+        order = np.lexsort((matched, -row_scores[matched]))
+        return {'matched': matched, 'top': matched[order[:max(1, top_k)]], 'criteria': criteria}
+
+
+# Índices por DataFrame (pelo id, conferindo que o objeto ainda é o mesmo), com limite de entradas
+_indexes: 'OrderedDict[int, Tuple[weakref.ref, Tuple[int, Tuple[str, ...]], RowIndex]]' = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_row_index(df: pd.DataFrame) -> RowIndex:
+    """Índice do DataFrame, montado na primeira pergunta e reutilizado nas seguintes."""
+    signature = (len(df), tuple(map(str, df.columns)))
+    with _indexes_lock:
+        entry = _indexes.get(id(df))
+        if entry is not None and entry[0]() is df and entry[1] == signature:
+            _indexes.move_to_end(id(df))
+            return entry[2]
+
+    with metrics.timer('row_index_build', rows=len(df)):
+        index = RowIndex(df)
+    with _indexes_lock:
+        _indexes[id(df)] = (weakref.ref(df), signature, index)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def select_relevant_rows(df: pd.DataFrame, question: str, top_k: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Seleção de linhas para o prompt (ver RowIndex.search); None = enviar o DataFrame como antes."""
+    if not RETRIEVAL_ENABLED or df is None or df.empty:
+        return None
+    index = get_row_index(df)
+    with metrics.timer('row_retrieval') as details:
+        result = index.search(question, top_k or RETRIEVAL_TOP_K)
+        details['matched'] = len(result['matched']) if result else 0
+    metrics.increment('retrieval_total', result='focused' if result else 'full')
+    return result
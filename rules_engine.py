@@ -0,0 +1,236 @@
+# rules_engine.py - LançAI: Motor de Regras Contábeis (CFOP, NCM, CST e CNPJ do Emitente)
+
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Optional, List, Tuple
+
+# Valor usado quando nenhuma regra se aplica ao lançamento
+UNMAPPED_ACCOUNT = 'Regra Não Mapeada'
+
+# Chaves aceitas nas regras e as colunas correspondentes no DataFrame de notas
+RULE_KEYS = ('CFOP', 'NCM', 'CST', 'CNPJ_Emitente')
+RULE_KEY_COLUMNS = {
+    'CFOP': 'CFOP_Principal',
+    'NCM': 'NCM_Principal',
+    'CST': 'CST_Principal',
+    'CNPJ_Emitente': 'Emissor_CNPJ',
+}
+# NCM e CNPJ costumam vir formatados ("7208.10.00", "12.345.678/0001-90"): só os dígitos contam
+_DIGITS_ONLY_KEYS = ('NCM', 'CNPJ_Emitente')
+# Intervalos (ex.: "5101-5199") são expandidos em valores exatos; acima disso a regra é recusada
+MAX_RANGE_EXPANSION = 10000
+_RANGE_PATTERN = re.compile(r'^(\d+)\s*-\s*(\d+)$')
+
+
+def _normalize_key_value(key: str, value: Any) -> str:
+    """Padroniza o valor de uma chave (regra ou nota) para comparação."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    text = str(value).strip()
+    if key in _DIGITS_ONLY_KEYS:
+        text = re.sub(r'[^\d*]', '', text)
+    return text
+
+
+def _parse_key_spec(key: str, spec: Any) -> Tuple[str, List[str]]:
+    """
+    Interpreta a especificação de uma chave da regra:
+    vazio ou '*' (qualquer valor), 'prefixo*' (curinga) ou valor exato.
+    Para o CFOP também são aceitos intervalos 'inicio-fim'.
+    Retorna o tipo ('any', 'prefix' ou 'exact') e os valores.
+    """
+    raw = '' if spec is None else str(spec).strip()
+    if key == 'CFOP':
+        range_match = _RANGE_PATTERN.match(raw)
+        if range_match:
+            start, end = range_match.groups()
+            if len(start) != len(end) or int(start) > int(end):
+                raise ValueError(f"Intervalo de CFOP inválido: '{raw}'.")
+            if int(end) - int(start) + 1 > MAX_RANGE_EXPANSION:
+                raise ValueError(f"Intervalo de CFOP muito amplo: '{raw}'. Use um curinga (ex.: '51*').")
+            return 'exact', [str(v).zfill(len(start)) for v in range(int(start), int(end) + 1)]
+
+    value = _normalize_key_value(key, raw)
+    if value in ('', '*'):
+        return 'any', []
+    if value.endswith('*'):
+        prefix = value.rstrip('*')
+        if '*' in prefix:
+            raise ValueError(f"Curinga inválido para {key}: '{raw}'. Use '*' apenas no final.")
+        return 'prefix', [prefix]
+    if '*' in value:
+        raise ValueError(f"Curinga inválido para {key}: '{raw}'. Use '*' apenas no final.")
+    return 'exact', [value]
+
+
+def rules_from_mapping(mapping: Dict[str, Dict[str, str]]) -> List[Dict[str, Any]]:
+    """Converte o dicionário simples CFOP -> {'DEBITO', 'CREDITO'} para o formato de regras."""
+    return [
+        {'CFOP': cfop, 'DEBITO': accounts['DEBITO'], 'CREDITO': accounts['CREDITO']}
+        for cfop, accounts in mapping.items()
+    ]
+
+
+def load_rules_file(path: str) -> List[Dict[str, Any]]:
+    """
+    Carrega as regras de um arquivo CSV ou JSON.
+    Colunas/campos: CFOP, NCM, CST, CNPJ_Emitente, PRIORIDADE, DEBITO, CREDITO
+    (apenas DEBITO e CREDITO são obrigatórios; chaves vazias valem para qualquer valor).
+    """
+    lower_path = path.lower()
+    if lower_path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        records = content.get('regras', []) if isinstance(content, dict) else content
+    elif lower_path.endswith('.csv'):
+        # sep=None deixa o pandas identificar vírgula ou ponto e vírgula
+        df_rules = pd.read_csv(path, sep=None, engine='python', dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        records = df_rules.to_dict('records')
+    else:
+        raise ValueError(f"Formato de arquivo de regras não suportado: '{path}'. Use CSV ou JSON.")
+
+    rules = []
+    for record in records:
+        # Aceita cabeçalhos em qualquer caixa (ex.: 'cfop', 'Debito')
+        normalized = {str(k).strip().upper(): v for k, v in record.items()}
+        rule = {key: normalized.get(key.upper(), '') for key in RULE_KEYS}
+        rule['PRIORIDADE'] = normalized.get('PRIORIDADE', '')
+        rule['DEBITO'] = normalized.get('DEBITO', '')
+        rule['CREDITO'] = normalized.get('CREDITO', '')
+        rules.append(rule)
+    return rules
+
+
+class CompiledRules:
+    """
+    Regras contábeis compiladas em tabelas indexadas por combinação de chaves.
+    Cada grupo reúne as regras que usam as mesmas chaves (e o mesmo tamanho de prefixo),
+    de modo que a aplicação é feita com um merge vetorizado por grupo, sem apply linha a linha.
+
+    Precedência: maior PRIORIDADE, depois a regra mais específica (chaves exatas valem mais
+    que prefixos longos, que valem mais que prefixos curtos) e, por fim, a ordem no arquivo.
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        entries = []
+        for order, rule in enumerate(rules):
+            if not rule.get('DEBITO') or not rule.get('CREDITO'):
+                raise ValueError(f"Regra {order + 1} sem conta de DEBITO ou CREDITO.")
+            priority_raw = str(rule.get('PRIORIDADE', '') or '').strip()
+            priority = int(priority_raw) if priority_raw else 0
+
+            specs = {key: _parse_key_spec(key, rule.get(key)) for key in RULE_KEYS}
+            specificity = sum(
+                1000 if kind == 'exact' else len(values[0]) if kind == 'prefix' else 0
+                for kind, values in specs.values()
+            )
+            # A assinatura define o grupo: (chave, tamanho do prefixo ou -1 para exato)
+            signature = tuple(
+                (key, -1 if kind == 'exact' else len(values[0]))
+                for key, (kind, values) in specs.items() if kind != 'any'
+            )
+            key_values = [values for kind, values in specs.values() if kind != 'any']
+            entries.append((priority, specificity, order, signature, key_values, rule['DEBITO'], rule['CREDITO']))
+
+        # A posição na lista ordenada é o "rank" da regra (menor = maior precedência)
+        entries.sort(key=lambda e: (-e[0], -e[1], e[2]))
+        self.debito = np.array([e[5] for e in entries] + [UNMAPPED_ACCOUNT], dtype=object)
+        self.credito = np.array([e[6] for e in entries] + [UNMAPPED_ACCOUNT], dtype=object)
+        self.size = len(entries)
+
+        groups: Dict[Tuple, List[Tuple]] = {}
+        for rank, (_, _, _, signature, key_values, _, _) in enumerate(entries):
+            rows = groups.setdefault(signature, [])
+            # Intervalos de CFOP geram uma linha por valor exato
+            for combination in _product(key_values):
+                rows.append(tuple(combination) + (rank,))
+
+        # Cada grupo vira um índice hash (Index/MultiIndex) -> rank, consultado com get_indexer
+        self.groups: List[Tuple[Tuple, pd.Index, np.ndarray]] = []
+        for signature, rows in groups.items():
+            columns = [f'{key}_{length}' for key, length in signature] + ['_rank']
+            table = pd.DataFrame(rows, columns=columns)
+            # Para cada combinação de chaves basta a regra de maior precedência
+            table = table.sort_values('_rank')
+            if len(signature) == 0:
+                # Regras genéricas não têm chaves a deduplicar: vale a de menor rank
+                index = pd.Index([])
+            elif len(signature) == 1:
+                table = table.drop_duplicates(subset=columns[:-1], keep='first')
+                index = pd.Index(table[columns[0]])
+            else:
+                table = table.drop_duplicates(subset=columns[:-1], keep='first')
+                index = pd.MultiIndex.from_frame(table[columns[:-1]])
+            self.groups.append((signature, index, table['_rank'].to_numpy()))
+
+    def match(self, df: pd.DataFrame) -> np.ndarray:
+        """Retorna, para cada linha do DataFrame, o rank da regra aplicada (self.size = não mapeada)."""
+        n_rows = len(df)
+        best_rank = np.full(n_rows, self.size, dtype=np.int64)
+        if n_rows == 0 or not self.groups:
+            return best_rank
+
+        # Cada coluna de chave é fatorada: a normalização e as buscas rodam só sobre os
+        # valores distintos (poucos CFOPs/NCMs/CNPJs) e o resultado volta às linhas pelos códigos
+        key_codes, key_uniques = {}, {}
+        for key, column in RULE_KEY_COLUMNS.items():
+            if column in df.columns:
+                codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+                key_codes[key] = codes
+                key_uniques[key] = np.array([_normalize_key_value(key, value) for value in uniques], dtype=object)
+            else:
+                key_codes[key] = np.zeros(n_rows, dtype=np.int64)
+                key_uniques[key] = np.array([''], dtype=object)
+
+        for signature, index, ranks in self.groups:
+            if not signature:
+                # Regra genérica (todas as chaves curinga): vale para qualquer linha
+                np.minimum(best_rank, ranks[0], out=best_rank)
+                continue
+            # Combinações distintas de chaves presentes nas notas (recompactadas a cada chave
+            # para o código combinado não estourar o int64)
+            combined = np.zeros(n_rows, dtype=np.int64)
+            for key, _ in signature:
+                combined = combined * len(key_uniques[key]) + key_codes[key]
+                combined, _ = pd.factorize(combined)
+            n_combos = int(combined.max()) + 1
+            # Uma linha representante por combinação (todas têm os mesmos valores de chave)
+            first_rows = np.zeros(n_combos, dtype=np.int64)
+            first_rows[combined] = np.arange(n_rows)
+            arrays = []
+            for key, length in signature:
+                values = key_uniques[key][key_codes[key][first_rows]]
+                arrays.append(values if length < 0 else np.array([value[:length] for value in values], dtype=object))
+            lookup = pd.Index(arrays[0]) if len(arrays) == 1 else pd.MultiIndex.from_arrays(arrays)
+            positions = index.get_indexer(lookup)[combined]
+            hits = positions >= 0
+            best_rank[hits] = np.minimum(best_rank[hits], ranks[positions[hits]])
+        return best_rank
+
+    def apply(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Retorna as contas de débito e crédito para cada linha do DataFrame."""
+        ranks = self.match(df)
+        return self.debito[ranks], self.credito[ranks]
+
+
+def _product(key_values: List[List[str]]) -> List[List[str]]:
+    """Produto cartesiano dos valores de cada chave (só intervalos geram mais de um valor)."""
+    combinations: List[List[str]] = [[]]
+    for values in key_values:
+        combinations = [combo + [value] for combo in combinations for value in values]
+    return combinations
+
+
+def compile_rules(rules: List[Dict[str, Any]]) -> CompiledRules:
+    """Compila uma lista de regras para aplicação vetorizada."""
+    return CompiledRules(rules)
+
+
+def load_compiled_rules(path: Optional[str], default_mapping: Dict[str, Dict[str, str]]) -> CompiledRules:
+    """Compila as regras do arquivo informado ou, se não houver arquivo, do mapeamento padrão."""
+    if path and os.path.exists(path):
+        return compile_rules(load_rules_file(path))
+    return compile_rules(rules_from_mapping(default_mapping))
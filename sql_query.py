@@ -0,0 +1,228 @@
+# sql_query.py - LançAI: Consultas SQL Locais e Somente Leitura sobre o DataFrame (DuckDB ou SQLite)
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, Any, Tuple
+
+import pandas as pd
+
+from compact_dtypes import expand_lancamentos
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Motor das consultas: 'auto' (DuckDB se instalado), 'duckdb' ou 'sqlite'
+SQL_ENGINE = os.getenv("LANCAI_SQL_ENGINE", "auto")
+# Consultas mais demoradas que isto são interrompidas
+SQL_TIMEOUT_SECONDS = float(os.getenv("LANCAI_SQL_TIMEOUT", "10"))
+# Linhas do resultado devolvidas (e enviadas ao Agente para o resumo)
+SQL_MAX_ROWS = int(os.getenv("LANCAI_SQL_MAX_ROWS", "200"))
+# Linhas de exemplo mostradas ao Agente junto com o esquema
+SQL_SAMPLE_ROWS = 5
+# Nome da tabela (visão do DataFrame) usada nas consultas
+TABLE_NAME = 'dados'
+# Bancos mantidos em memória (um por DataFrame carregado)
+DATABASE_CACHE_SIZE = 4
+# Instruções do SQLite verificadas entre cada checagem do tempo limite
+SQLITE_PROGRESS_STEPS = 10_000
+
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+# Comandos e funções que escrevem, alteram a configuração ou acessam arquivos e rede
+_FORBIDDEN = re.compile(
+    r'\b(insert|update|delete|drop|create|alter|attach|detach|copy|pragma|install|load|export|import|set|reset|'
+    r'call|vacuum|checkpoint|truncate|merge|upsert|begin|commit|rollback|replace\s+into|load_extension|'
+    r'read_\w+|glob|getenv|sniff_csv|parquet_\w+|iceberg_\w+|delta_scan|sqlite_scan|postgres_\w+|mysql_\w+|httpfs)\b',
+    re.IGNORECASE
+)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_COMMENT = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+_SQL_BLOCK = re.compile(r'```(?:sql)?\s*(.*?)```', re.DOTALL | re.IGNORECASE)
+
+
+class SQLQueryError(ValueError):
+    """Consulta recusada (não é um único SELECT de leitura) ou que falhou/expirou na execução."""
+
+
+def sql_engine_name() -> str:
+    """Motor efetivamente usado nas consultas ('duckdb' ou 'sqlite')."""
+    if SQL_ENGINE == 'sqlite' or not DUCKDB_AVAILABLE:
+        if SQL_ENGINE == 'duckdb':
+            logger.warning("LANCAI_SQL_ENGINE=duckdb, mas o pacote duckdb não está instalado; usando SQLite.")
+        return 'sqlite'
+    return 'duckdb'
+
+
+def extract_sql(text: str) -> str:
+    """Consulta contida na resposta do Agente (bloco ```sql``` ou o texto inteiro), sem o ';' final."""
+    match = _SQL_BLOCK.search(text or '')
+    sql = (match.group(1) if match else text or '').strip()
+    return sql.rstrip(';').strip()
+
+
+def validate_sql(sql: str) -> str:
+    """
+    Aceita apenas um único SELECT (ou WITH ... SELECT) sem comandos de escrita, de configuração
+    ou de acesso a arquivos. Textos entre aspas e comentários são ignorados na verificação.
+    Segunda barreira: o banco também é somente leitura (ver _Database).
+    """
+    if not sql:
+        raise SQLQueryError("Nenhuma consulta SQL foi gerada.")
+    code = _COMMENT.sub(' ', _STRING_LITERAL.sub("''", sql))
+    if ';' in code:
+        raise SQLQueryError("Apenas uma consulta por vez é permitida.")
+    if not re.match(r'\s*(select|with)\b', code, re.IGNORECASE):
+        raise SQLQueryError("Apenas consultas de leitura (SELECT) são permitidas.")
+    forbidden = _FORBIDDEN.search(code)
+    if forbidden:
+        raise SQLQueryError(f"A consulta usa um comando não permitido: {forbidden.group(0).upper()}.")
+    return sql
+
+
+def _sql_type(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return 'BOOLEAN'
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(series.dtype):
+        return 'DOUBLE'
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+def _sqlite_authorizer(action: int, *_args) -> int:
+    """Só leitura: SELECT, leitura de colunas e funções (sem escrita, ATTACH ou PRAGMA)."""
+    allowed = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, getattr(sqlite3, 'SQLITE_RECURSIVE', -1)}
+    return sqlite3.SQLITE_OK if action in allowed else sqlite3.SQLITE_DENY
+
+
+class _Database:
+    """
+    Banco em memória com a tabela TABLE_NAME, montado uma vez por DataFrame (valores em reais,
+    como no prompt e na exportação). DuckDB lê o DataFrame direto (sem cópia) e tem o acesso
+    externo desativado; no SQLite os dados são copiados e um autorizador bloqueia tudo que não é leitura.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.engine = sql_engine_name()
+        data = expand_lancamentos(df)
+        # Categorias e strings Arrow viram texto simples (tipos aceitos pelos dois motores)
+        data = data.assign(**{
+            column: data[column].astype(object).where(data[column].notna(), None)
+            for column in data.columns if _sql_type(data[column]) == 'TEXT' and data[column].dtype != object
+        })
+        self.columns = [(str(column), _sql_type(data[column])) for column in data.columns]
+        self.n_rows = len(data)
+        self.sample = data.head(SQL_SAMPLE_ROWS)
+        self._lock = threading.Lock()
+
+        if self.engine == 'duckdb':
+            self._connection = duckdb.connect(':memory:')
+            self._connection.register(TABLE_NAME, data)
+            self._connection.execute("SET enable_external_access = false")
+            self._connection.execute("SET lock_configuration = true")
+        else:
+            self._connection = sqlite3.connect(':memory:', check_same_thread=False)
+            data.to_sql(TABLE_NAME, self._connection, index=False, chunksize=50_000)
+            self._connection.set_authorizer(_sqlite_authorizer)
+
+    def schema_text(self) -> str:
+        """Esquema e linhas de exemplo da tabela (o que o Agente vê no lugar dos dados)."""
+        lines = [f'Tabela "{TABLE_NAME}" ({self.n_rows} linhas). Colunas (nome; tipo):']
+        lines.extend(f'"{name}"; {sql_type}' for name, sql_type in self.columns)
+        lines.append(f"\nPrimeiras {len(self.sample)} linhas (CSV):")
+        lines.append(self.sample.to_csv(index=False).strip())
+        return "\n".join(lines)
+
+    def execute(self, sql: str, max_rows: int, timeout: float) -> Tuple[pd.DataFrame, bool]:
+        """Executa a consulta; retorna até max_rows linhas e se o resultado foi cortado."""
+        with self._lock:
+            if self.engine == 'duckdb':
+                timer = threading.Timer(timeout, self._connection.interrupt)
+                timer.start()
+                try:
+                    cursor = self._connection.execute(sql)
+                    rows = cursor.fetchmany(max_rows + 1)
+                finally:
+                    timer.cancel()
+            else:
+                deadline = time.monotonic() + timeout
+                self._connection.set_progress_handler(lambda: int(time.monotonic() > deadline), SQLITE_PROGRESS_STEPS)
+                try:
+                    cursor = self._connection.execute(sql)
+                    rows = cursor.fetchmany(max_rows + 1)
+                finally:
+                    self._connection.set_progress_handler(None, 0)
+            columns = [description[0] for description in cursor.description or []]
+        return pd.DataFrame(rows[:max_rows], columns=columns), len(rows) > max_rows
+
+
+# Bancos por DataFrame (pelo id, conferindo que o objeto ainda é o mesmo), com limite de entradas
+_databases: 'OrderedDict[int, Tuple[weakref.ref, Tuple[int, Tuple[str, ...]], _Database]]' = OrderedDict()
+_databases_lock = threading.Lock()
+
+
+def get_database(df: pd.DataFrame) -> _Database:
+    """Banco do DataFrame, montado na primeira consulta e reutilizado nas seguintes."""
+    signature = (len(df), tuple(map(str, df.columns)))
+    with _databases_lock:
+        entry = _databases.get(id(df))
+        if entry is not None and entry[0]() is df and entry[1] == signature:
+            _databases.move_to_end(id(df))
+            return entry[2]
+
+    with metrics.timer('sql_database_build', rows=len(df)):
+        database = _Database(df)
+    with _databases_lock:
+        _databases[id(df)] = (weakref.ref(df), signature, database)
+        while len(_databases) > DATABASE_CACHE_SIZE:
+            _databases.popitem(last=False)
+    return database
+
+
+def describe_table(df: pd.DataFrame) -> str:
+    """Esquema e amostra da tabela consultável: tamanho constante, qualquer que seja o número de linhas."""
+    return get_database(df).schema_text()
+
+
+def run_query(df: pd.DataFrame, sql: str, max_rows: int = SQL_MAX_ROWS, timeout: float = SQL_TIMEOUT_SECONDS) -> Dict[str, Any]:
+    """
+    Valida e executa a consulta sobre o DataFrame (tabela TABLE_NAME), somente leitura, com tempo
+    limite e limite de linhas. Retorna a consulta, o resultado (DataFrame), se ele foi cortado,
+    o motor e o tempo gasto. Consultas recusadas, com erro ou expiradas lançam SQLQueryError.
+    """
+    try:
+        sql = validate_sql(sql)
+    except SQLQueryError:
+        metrics.increment('sql_queries_total', result='rejected')
+        raise
+
+    database = get_database(df)
+    started = time.perf_counter()
+    try:
+        with metrics.timer('sql_query', engine=database.engine):
+            result, truncated = database.execute(sql, max_rows, timeout)
+    except Exception as e:
+        seconds = time.perf_counter() - started
+        timed_out = seconds >= timeout or 'interrupt' in str(e).lower()
+        metrics.increment('sql_queries_total', result='timeout' if timed_out else 'error')
+        if timed_out:
+            raise SQLQueryError(f"A consulta foi interrompida após {timeout:.0f} s.") from e
+        raise SQLQueryError(f"Erro ao executar a consulta: {e}") from e
+
+    metrics.increment('sql_queries_total', result='ok')
+    return {
+        'sql': sql, 'result': result, 'truncated': truncated,
+        'engine': database.engine, 'seconds': time.perf_counter() - started,
+    }
@@ -0,0 +1 @@
+# Testes de comportamento do LançAI (executar com: python -m pytest -q)
@@ -0,0 +1,36 @@
+# Dados de exemplo compartilhados pelos testes
+
+import pandas as pd
+import pytest
+
+from rules_engine import UNMAPPED_ACCOUNT
+
+
+def make_lancamentos(n_rows: int = 40) -> pd.DataFrame:
+    """Lançamentos no formato gerado pelos XMLs (valores em reais, antes da compactação)."""
+    emitters = ['Metalúrgica São João', 'Aços Paraná', 'Distribuidora Vale do Aço', 'Indústria Conceição']
+    cfops = ['5102', '1101', '5405', '6102']
+    rows = []
+    for i in range(n_rows):
+        cfop = cfops[i % len(cfops)]
+        rows.append({
+            'NFe_Chave': f"{35240312345678000199550010000000000000 + i:044d}",
+            'Emissor': emitters[i % len(emitters)],
+            'Emissor_CNPJ': f"{12345678000100 + i % len(emitters):014d}",
+            'CFOP_Principal': cfop,
+            'NCM_Principal': '72080000',
+            'CST_Principal': '00',
+            'Valor_Total': round(100.10 + i * 10.01, 2),
+            'Data_Emissao': f"2024-0{1 + i % 3}-15",
+            'XML_Path': f"nota_{i}.xml",
+            'Conta_Debito': UNMAPPED_ACCOUNT if cfop == '6102' else '1.01.01.002 - Clientes',
+            'Conta_Credito': UNMAPPED_ACCOUNT if cfop == '6102' else '3.01.01.001 - Receita de Vendas',
+        })
+    df = pd.DataFrame(rows)
+    df['Valor_Lancamento'] = df['Valor_Total']
+    return df
+
+
+@pytest.fixture
+def lancamentos() -> pd.DataFrame:
+    return make_lancamentos()
@@ -0,0 +1,82 @@
+# Respostas locais (sem LLM): só para perguntas inteiramente entendidas pelas intenções
+
+import pandas as pd
+import pytest
+
+from agent_brain import answer_locally
+from compact_dtypes import compact_lancamentos
+from rules_engine import UNMAPPED_ACCOUNT
+
+KEYS = [f"3524031234567800019955001{n:019d}" for n in range(1, 4)]
+
+
+@pytest.fixture
+def df():
+    lancamentos = pd.DataFrame({
+        'NFe_Chave': KEYS,
+        'Emissor': ['Metalúrgica São João', 'Aços Paraná', 'Metalúrgica São João'],
+        'CFOP_Principal': ['5102', '1101', '6102'],
+        'Valor_Total': [1000.0, 800.0, 350.0],
+        'Valor_Lancamento': [1000.0, 800.0, 350.0],
+        'Data_Emissao': ['2024-01-10', '2024-02-10', '2024-03-10'],
+        'Conta_Debito': ['Clientes', 'Estoque', UNMAPPED_ACCOUNT],
+        'Conta_Credito': ['Receita', 'Fornecedores', UNMAPPED_ACCOUNT],
+    })
+    compact, _ = compact_lancamentos(lancamentos)
+    return compact
+
+
+@pytest.mark.parametrize('question', [
+    "Qual o valor total?",
+    "Valor total geral dos lançamentos",
+    "Qual o valor total de todas as notas carregadas?",
+])
+def test_unqualified_total_is_answered_locally(df, question):
+    assert 'R$ 2.150,00' in answer_locally(df, question)
+
+
+@pytest.mark.parametrize('question', [
+    "Quantas notas?",
+    "Quantos lançamentos existem?",
+    "Qual o número de registros?",
+])
+def test_unqualified_count_is_answered_locally(df, question):
+    assert '**3**' in answer_locally(df, question)
+
+
+@pytest.mark.parametrize('question', [
+    "Qual o valor total de vendas?",
+    "Qual o valor total das notas de janeiro?",
+    "Qual o valor total do ICMS?",
+    "Qual o valor total das notas canceladas?",
+    "Qual o valor total das notas acima de 500 reais?",
+    "Qual o valor total em 2024?",
+    "Quantas notas em março?",
+    "quantas notas acima de 1000 reais?",
+    "Quantas notas abaixo de 1000 reais?",
+    "Quantas notas com valor maior que 500?",
+    "Quantas notas de devolução?",
+    "Top 5 fornecedores de aço",
+])
+def test_qualified_questions_go_to_the_llm(df, question):
+    assert answer_locally(df, question) is None
+
+
+def test_exact_cfop_and_key_filters_are_applied(df):
+    answer = answer_locally(df, "Qual o valor total do CFOP 5.102?")
+    assert 'CFOP 5102' in answer and 'R$ 1.000,00' in answer
+    answer = answer_locally(df, f"Qual o valor total da nota chave {KEYS[1]}?")
+    assert f'chave {KEYS[1]}' in answer and 'R$ 800,00' in answer
+
+
+def test_grouping_and_unmapped_intents(df):
+    assert 'Totais por CFOP' in answer_locally(df, "Valor total por CFOP")
+    assert 'Top 2 por Emissor' in answer_locally(df, "Quais os 2 maiores fornecedores?")
+    assert '6102' in answer_locally(df, "Quais lançamentos estão sem regra?")
+
+
+def test_data_analysis_frame_count_is_gated_too():
+    generic = pd.DataFrame({'Mes': ['janeiro', 'fevereiro', 'março'], 'Produto': ['aço', 'ferro', 'aço'], 'Qtd': [1, 2, 3]})
+    assert '**3**' in answer_locally(generic, "Quantas linhas?")
+    assert answer_locally(generic, "Quantas linhas de aço?") is None
+    assert answer_locally(generic, "Quantas linhas em março?") is None
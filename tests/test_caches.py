@@ -0,0 +1,93 @@
+# Cache de respostas do LLM (LRU, tamanho e TTL) e cache de ingestão (LRU em memória)
+
+import pandas as pd
+
+import llm_cache
+from ingestion_cache import IngestionCache, make_upload_key
+from llm_cache import LLMResponseCache, dataframe_fingerprint, make_cache_key
+
+
+def _cache(tmp_path, **kwargs):
+    options = {'max_entries': 100, 'max_bytes': 10 ** 6, 'ttl_seconds': 3600, 'enabled': True}
+    options.update(kwargs)
+    return LLMResponseCache(path=str(tmp_path / 'llm.sqlite3'), **options)
+
+
+class _Clock:
+    def __init__(self, start=1_000_000.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+
+def test_llm_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_cache.time, 'time', clock.time)
+    cache = _cache(tmp_path, max_entries=2)
+    cache.set('a', 'resposta a')
+    clock.now += 1
+    cache.set('b', 'resposta b')
+    clock.now += 1
+    assert cache.get('a') == 'resposta a'  # 'a' passa a ser a mais recente
+    clock.now += 1
+    cache.set('c', 'resposta c')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'resposta a'
+    assert cache.get('c') == 'resposta c'
+
+
+def test_llm_cache_respects_the_byte_limit(tmp_path):
+    cache = _cache(tmp_path, max_bytes=25)
+    cache.set('a', 'x' * 10)
+    cache.set('b', 'y' * 10)
+    cache.set('c', 'z' * 10)
+    assert cache.stats()['bytes'] <= 25
+    assert cache.get('c') == 'z' * 10
+
+
+def test_llm_cache_expires_entries_after_ttl(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_cache.time, 'time', clock.time)
+    cache = _cache(tmp_path, ttl_seconds=60)
+    cache.set('a', 'resposta')
+    clock.now += 59
+    assert cache.get('a') == 'resposta'
+    clock.now += 2
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_llm_cache_key_ignores_case_spacing_and_final_punctuation():
+    fingerprint = dataframe_fingerprint(pd.DataFrame({'a': [1, 2]}))
+    key = make_cache_key(fingerprint, 'Qual o  TOTAL?', 'modelo', 'v1')
+    assert key == make_cache_key(fingerprint, 'qual o total', 'modelo', 'v1')
+    assert key != make_cache_key(fingerprint, 'qual o total', 'modelo', 'v2')
+    assert key != make_cache_key(dataframe_fingerprint(pd.DataFrame({'a': [1, 3]})), 'qual o total', 'modelo', 'v1')
+
+
+def test_ingestion_cache_lru_and_shallow_copies():
+    cache = IngestionCache(max_entries=2, max_bytes=10 ** 9)
+    frames = {name: pd.DataFrame({'valor': [i]}) for i, name in enumerate('abc')}
+    cache.put('a', 'lancai', frames['a'])
+    cache.put('b', 'lancai', frames['b'])
+    assert cache.get('a') is not None
+    cache.put('c', 'data_analysis', frames['c'])
+    assert cache.get('b') is None
+    mode, df = cache.get('c')
+    assert mode == 'data_analysis'
+    df['nova'] = 1
+    assert 'nova' not in cache.get('c')[1].columns
+
+
+def test_ingestion_cache_byte_limit_and_upload_key():
+    df = pd.DataFrame({'valor': range(1000)})
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    cache = IngestionCache(max_entries=10, max_bytes=size * 2)
+    for key in 'abc':
+        cache.put(key, 'lancai', df)
+    assert cache.stats()['entries'] == 2
+    assert cache.get('a') is None
+    assert make_upload_key(b'x', 'a.zip', 'cfg') != make_upload_key(b'x', 'a.csv', 'cfg')
+    assert make_upload_key(b'x', 'a.zip', 'cfg') != make_upload_key(b'x', 'a.zip', 'outra')
@@ -0,0 +1,37 @@
+# Forma compacta dos lançamentos: centavos inteiros e ida e volta para reais
+
+import numpy as np
+import pandas as pd
+
+from compact_dtypes import CENTS_COLUMN, VALUE_COLUMN, compact_lancamentos, expand_lancamentos, valor_em_reais
+from tests.conftest import make_lancamentos
+
+
+def test_cents_round_trip_is_exact():
+    values = [0.1, 0.2, 0.3, 1234.57, 19.99, 1e9 + 0.01, 0.0, -15.5]
+    df = pd.DataFrame({'Valor_Lancamento': values, 'Valor_Total': values})
+    compact, _ = compact_lancamentos(df)
+    assert compact[CENTS_COLUMN].dtype == np.int64
+    assert compact[CENTS_COLUMN].tolist() == [10, 20, 30, 123457, 1999, 100000000001, 0, -1550]
+    assert valor_em_reais(compact).tolist() == values
+    assert expand_lancamentos(compact)[VALUE_COLUMN].tolist() == values
+    # Somas em centavos não acumulam erro de ponto flutuante
+    assert int(compact[CENTS_COLUMN].sum()) == round(sum(values) * 100)
+
+
+def test_compaction_keeps_every_other_column_and_saves_memory():
+    df = make_lancamentos(2000)
+    compact, report = compact_lancamentos(df)
+    assert set(compact.columns) == (set(df.columns) - {'Valor_Lancamento', 'Valor_Total'}) | {CENTS_COLUMN}
+    assert isinstance(compact['Conta_Debito'].dtype, pd.CategoricalDtype)
+    assert report['bytes_depois'] < report['bytes_antes']
+    expanded = expand_lancamentos(compact)
+    for column in ('NFe_Chave', 'Emissor', 'CFOP_Principal', 'Conta_Debito'):
+        assert expanded[column].astype(str).tolist() == df[column].astype(str).tolist()
+    assert expanded[VALUE_COLUMN].tolist() == df[VALUE_COLUMN].tolist()
+
+
+def test_expanded_frames_are_returned_unchanged():
+    df = make_lancamentos(5)
+    assert expand_lancamentos(df) is df
+    assert valor_em_reais(df).equals(df[VALUE_COLUMN])
@@ -0,0 +1,49 @@
+# Leitura de CSV em passagem única: detecção de encoding e separador
+
+import codecs
+import io
+
+import pytest
+
+from csv_loader import CSV_FALLBACK_ENCODING, detect_delimiter, detect_encoding, read_csv_single_pass, sniff_csv
+
+
+@pytest.mark.parametrize('sep', [';', ',', '\t', '|'])
+def test_detects_the_delimiter(sep):
+    text = "\n".join(sep.join(row) for row in [['Data', 'Histórico', 'Valor'], ['01/03', 'Venda, à vista', '10'], ['02/03', 'Compra', '20']])
+    if sep == ',':
+        text = text.replace('Venda, à vista', '"Venda, à vista"')
+    assert detect_delimiter(text) == sep
+
+
+def test_delimiter_ignores_a_cut_last_line():
+    assert detect_delimiter("a;b;c\n1;2;3\n4;5;6\n7;8") == ';'
+
+
+def test_detects_the_encoding():
+    text = "Histórico;Valor\nAção;1\n"
+    assert detect_encoding(codecs.BOM_UTF8 + text.encode('utf-8')) == 'utf-8-sig'
+    assert detect_encoding(text.encode('utf-8')) == 'utf-8'
+    assert detect_encoding(text.encode('latin-1')) == CSV_FALLBACK_ENCODING
+    # Caractere multibyte cortado no fim da amostra continua sendo UTF-8
+    assert detect_encoding("ação".encode('utf-8')[:-1]) == 'utf-8'
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+def test_reads_latin1_bytes_beyond_the_sample(engine):
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    rows = ["Data;Historico;Valor"] + [f"01/03/2024;Venda {i};{i},50" for i in range(20000)]
+    rows[10000] = "02/03/2024;Conceição;7,25"
+    data = ("\n".join(rows) + "\n").encode('latin-1')
+    source = io.BytesIO(data)
+    assert sniff_csv(source, sample_bytes=1024)['encoding'] == 'utf-8'
+    df = read_csv_single_pass(source, engine=engine, dtype=str)
+    assert len(df) == 20000
+    assert list(df.columns) == ['Data', 'Historico', 'Valor']
+    assert df.loc[9999, 'Historico'] == 'Conceição'
+
+
+def test_explicit_dialect_skips_sniffing():
+    df = read_csv_single_pass(io.BytesIO(b"a|b\n1|2\n"), encoding='utf-8', sep='|', engine='c')
+    assert df.to_dict('records') == [{'a': 1, 'b': 2}]
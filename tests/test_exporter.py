@@ -0,0 +1,26 @@
+# Exportação preparada por versão dos dados, formato e conjunto de colunas
+
+import pandas as pd
+
+from exporter import EXPORT_COLUMNS, prepare_export
+from tests.conftest import make_lancamentos
+
+
+def test_prepared_file_depends_on_the_columns(tmp_path):
+    df = make_lancamentos(10)
+    workspace = str(tmp_path)
+    integration = prepare_export(df, 'csv', workspace, 'v1' * 8, columns=EXPORT_COLUMNS)
+    everything = prepare_export(df, 'csv', workspace, 'v1' * 8, columns=None)
+    assert integration != everything
+    assert list(pd.read_csv(integration, nrows=0).columns) == EXPORT_COLUMNS
+    assert 'Data_Emissao' in pd.read_csv(everything, nrows=0).columns
+    assert prepare_export(df, 'csv', workspace, 'v1' * 8, columns=EXPORT_COLUMNS) == integration
+
+
+def test_new_data_version_removes_previous_exports(tmp_path):
+    df = make_lancamentos(10)
+    workspace = str(tmp_path)
+    old = prepare_export(df, 'csv', workspace, 'a' * 16)
+    new = prepare_export(df, 'csv', workspace, 'b' * 16)
+    assert [str(p) for p in tmp_path.iterdir()] == [new]
+    assert old != new
@@ -0,0 +1,96 @@
+# Base persistente de NF-e: deduplicação por chave e notas já gravadas fora do parsing
+
+import io
+import zipfile
+
+import pytest
+
+import data_handler
+from ledger_store import LedgerStore, nfe_key_from_filename
+from tests.test_xml_parser import NFE_NS
+
+KEYS = [f"3524031234567800019955001{n:019d}" for n in range(1, 4)]
+
+
+def _xml(key, value):
+    return (
+        f'<nfeProc xmlns="{NFE_NS}"><NFe><infNFe Id="NFe{key}">'
+        '<ide><dhEmi>2024-03-05T10:00:00-03:00</dhEmi></ide><emit><CNPJ>12345678000199</CNPJ><xNome>ACME</xNome></emit>'
+        '<det nItem="1"><prod><NCM>72080000</NCM><CFOP>5102</CFOP></prod></det>'
+        f'<total><ICMSTot><vNF>{value:.2f}</vNF></ICMSTot></total></infNFe></NFe></nfeProc>'
+    ).encode('utf-8')
+
+
+def _zip(keys):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for i, key in enumerate(keys):
+            zf.writestr(f"{key}-nfe.xml", _xml(key, 100.0 + i))
+    buffer.seek(0)
+    return zipfile.ZipFile(buffer)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return LedgerStore(path=str(tmp_path / 'notas.sqlite3'), enabled=True)
+
+
+def test_append_keeps_one_row_per_key(ledger):
+    zip_ref = _zip(KEYS[:2])
+    df = data_handler.process_xml_files(zip_ref, zip_ref.namelist(), max_workers=1, ledger=ledger)
+    assert len(df) == 2
+    assert ledger.stats()['notes'] == 2
+    assert ledger.known_keys(KEYS) == set(KEYS[:2])
+    assert ledger.append(ledger.load()) == 0
+
+
+def test_known_notes_skip_parsing(ledger, monkeypatch):
+    first = _zip(KEYS[:2])
+    data_handler.process_xml_files(first, first.namelist(), max_workers=1, ledger=ledger)
+
+    parsed_members = []
+    original = data_handler.parse_xml_members
+
+    def spy(zip_ref, members, **kwargs):
+        parsed_members.extend(members)
+        return original(zip_ref, members, **kwargs)
+
+    monkeypatch.setattr(data_handler, 'parse_xml_members', spy)
+    second = _zip(KEYS)
+    df = data_handler.process_xml_files(second, second.namelist(), max_workers=1, ledger=ledger)
+    assert parsed_members == [f"{KEYS[2]}-nfe.xml"]
+    assert sorted(df['NFe_Chave'].astype(str)) == sorted(KEYS)
+    assert ledger.stats()['notes'] == 3
+
+
+def test_disabled_ledger_parses_everything(tmp_path):
+    ledger = LedgerStore(path=str(tmp_path / 'notas.sqlite3'), enabled=False)
+    zip_ref = _zip(KEYS)
+    df = data_handler.process_xml_files(zip_ref, zip_ref.namelist(), max_workers=1, ledger=ledger)
+    assert len(df) == 3
+    assert ledger.known_keys(KEYS) == set()
+    assert not (tmp_path / 'notas.sqlite3').exists()
+
+
+def test_key_from_filename():
+    assert nfe_key_from_filename(f"pasta/{KEYS[0]}-procNFe.xml") == KEYS[0]
+    assert nfe_key_from_filename("nota_123.xml") is None
+    assert nfe_key_from_filename(f"1{KEYS[0]}.xml") is None
+
+
+@pytest.mark.parametrize('enabled', [True, False])
+def test_repeated_key_in_one_upload_gives_one_row_in_both_modes(tmp_path, enabled):
+    ledger = LedgerStore(path=str(tmp_path / 'notas.sqlite3'), enabled=enabled)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr(f"{KEYS[0]}-nfe.xml", _xml(KEYS[0], 100.0))
+        zf.writestr("copia/nota.xml", _xml(KEYS[0], 100.0))
+        zf.writestr(f"{KEYS[1]}-nfe.xml", _xml(KEYS[1], 200.0))
+    zip_ref = zipfile.ZipFile(buffer)
+    df = data_handler.process_xml_files(zip_ref, zip_ref.namelist(), max_workers=1, ledger=ledger)
+    assert sorted(df['NFe_Chave'].astype(str)) == KEYS[:2]
+    # A auditoria vê a repetição descartada na ingestão
+    duplicates = df.attrs['auditoria']['chaves_duplicadas']
+    assert (duplicates['quantidade'], duplicates['linhas'], duplicates['removidas']) == (1, 2, 1)
+    assert duplicates['itens'][0]['NFe_Chave'] == KEYS[0]
+    assert df.attrs['auditoria']['alertas'] >= 1
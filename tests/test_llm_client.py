@@ -0,0 +1,50 @@
+# Cliente do LLM: vagas de concorrência nas chamadas assíncronas
+
+import asyncio
+
+from llm_client import LocalStubBackend, RateLimitedLLMClient
+
+
+def test_cancelled_ainvoke_gives_back_its_slot():
+    client = RateLimitedLLMClient(LocalStubBackend(), max_concurrency=1, max_retries=0)
+    client._slots.acquire()  # vaga ocupada por uma chamada síncrona
+
+    async def cancel_while_waiting():
+        task = asyncio.create_task(client.ainvoke("pergunta"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        client._slots.release()  # a chamada síncrona termina: a thread da tarefa cancelada obtém a vaga e a devolve
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if client._slots._value == 1:
+                return True
+        client._slots.release()  # sem a devolução, libera a thread para o event loop poder encerrar
+        return False
+
+    assert asyncio.run(cancel_while_waiting())
+
+
+def test_concurrent_ainvoke_calls_share_the_slots():
+    client = RateLimitedLLMClient(LocalStubBackend(), max_concurrency=2, max_retries=0)
+    running, peak = 0, 0
+    original = client.llm.ainvoke
+
+    async def tracked(prompt):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            await asyncio.sleep(0.02)
+            return await original(prompt)
+        finally:
+            running -= 1
+
+    client.llm.ainvoke = tracked
+
+    async def run_all():
+        return await asyncio.gather(*(client.ainvoke(f"pergunta {i}") for i in range(6)))
+
+    assert len(asyncio.run(run_all())) == 6
+    assert peak == 2
+    assert all(client._slots.acquire(blocking=False) for _ in range(2))
@@ -0,0 +1,50 @@
+# Montagem do prompt dentro do orçamento de tokens
+
+import pandas as pd
+
+from compact_dtypes import compact_lancamentos
+from prompt_builder import build_agent_prompt, build_rows_section, estimate_tokens, partition_dataframe
+from tests.conftest import make_lancamentos
+
+SYSTEM = "Você é um assistente contábil."
+
+
+def test_prompt_respects_the_token_budget():
+    df = make_lancamentos(5000)
+    for budget in (1500, 4000, 12000):
+        built = build_agent_prompt(df, "Quais CFOPs não foram mapeados?", SYSTEM, token_budget=budget)
+        assert built['token_usage']['total'] <= budget
+        assert 0 < built['rows_included'] < len(df)
+        assert built['rows_total'] == len(df)
+
+
+def test_statistics_cover_every_row_even_when_rows_are_cut():
+    df = make_lancamentos(5000)
+    built = build_agent_prompt(df, "Total?", SYSTEM, token_budget=3000)
+    assert f"Total de lançamentos: {len(df)}" in built['prompt']
+    assert f"{df['Valor_Lancamento'].sum():.2f}" in built['prompt']
+
+
+def test_compact_frame_is_described_in_reais():
+    df = make_lancamentos(50)
+    compact, _ = compact_lancamentos(df)
+    built = build_agent_prompt(compact, "Total?", SYSTEM, token_budget=12000)
+    assert 'Valor_Centavos' not in built['prompt']
+    assert f"{df['Valor_Lancamento'].sum():.2f}" in built['prompt']
+
+
+def test_rows_section_fits_its_budget():
+    df = make_lancamentos(2000)
+    text, n_rows = build_rows_section(df, 500)
+    assert estimate_tokens(text) <= 500
+    assert 0 < n_rows < len(df)
+    assert build_rows_section(df, 0) == ("", 0)
+
+
+def test_partitions_cover_every_row_once():
+    df = make_lancamentos(103)
+    for partition_by in ('cfop', 'emissor', 'linhas'):
+        parts = partition_dataframe(df, partition_by, chunk_rows=20)
+        assert all(len(part) <= 20 for _, part in parts)
+        combined = pd.concat([part for _, part in parts])
+        assert sorted(combined.index) == list(df.index)
@@ -0,0 +1,40 @@
+# Seleção de linhas relevantes para o prompt (índices exatos e TF-IDF)
+
+import numpy as np
+
+from row_index import RowIndex, tokenize
+from tests.conftest import make_lancamentos
+
+
+def test_tokenize_strips_accents_and_stopwords():
+    assert tokenize("Qual o total da Metalúrgica São João?") == ['total', 'metalurgica', 'joao']
+
+
+def test_access_key_is_an_exact_filter():
+    df = make_lancamentos(40)
+    key = df.loc[7, 'NFe_Chave']
+    spaced = ' '.join(key[i:i + 4] for i in range(0, 44, 4))
+    result = RowIndex(df).search(f"Detalhe a nota {spaced}")
+    assert result['matched'].tolist() == [7]
+    assert result['criteria'] == [f"chave {key}"]
+
+
+def test_cfop_is_an_exact_filter_with_or_without_dot():
+    df = make_lancamentos(40)
+    expected = np.flatnonzero(df['CFOP_Principal'] == '5405').tolist()
+    for question in ("Lançamentos do CFOP 5405", "Lançamentos do CFOP 5.405"):
+        result = RowIndex(df).search(question)
+        assert result['matched'].tolist() == expected
+        assert result['criteria'] == ["CFOP 5405"]
+
+
+def test_text_terms_select_the_named_emitter():
+    df = make_lancamentos(40)
+    result = RowIndex(df).search("notas da Conceição")
+    assert result['matched'].tolist() == np.flatnonzero(df['Emissor'] == 'Indústria Conceição').tolist()
+    assert len(result['top']) <= len(result['matched'])
+
+
+def test_generic_questions_select_nothing():
+    df = make_lancamentos(40)
+    assert RowIndex(df).search("Qual o valor total?") is None
@@ -0,0 +1,81 @@
+# Motor de regras contábeis: precedência, curingas, intervalos e normalização das chaves
+
+import pandas as pd
+import pytest
+
+from rules_engine import UNMAPPED_ACCOUNT, compile_rules
+
+
+def _notes(**columns):
+    return pd.DataFrame(columns)
+
+
+def _rule(debito, **keys):
+    return {'DEBITO': debito, 'CREDITO': f'C-{debito}', **keys}
+
+
+def test_higher_priority_wins_over_specificity():
+    rules = compile_rules([
+        _rule('exata', CFOP='5102', NCM='72080000'),
+        _rule('prioritaria', CFOP='51*', PRIORIDADE='10'),
+    ])
+    debito, _ = rules.apply(_notes(CFOP_Principal=['5102'], NCM_Principal=['72080000']))
+    assert list(debito) == ['prioritaria']
+
+
+def test_more_specific_rule_wins_on_same_priority():
+    rules = compile_rules([
+        _rule('generica'),
+        _rule('prefixo_curto', CFOP='5*'),
+        _rule('prefixo_longo', CFOP='510*'),
+        _rule('exata', CFOP='5102'),
+        _rule('exata_com_ncm', CFOP='5102', NCM='7208*'),
+    ])
+    notes = _notes(CFOP_Principal=['5102', '5101', '5405', '1101', '5102'], NCM_Principal=['72080000', '', '', '', '39269090'])
+    debito, _ = rules.apply(notes)
+    assert list(debito) == ['exata_com_ncm', 'prefixo_longo', 'prefixo_curto', 'generica', 'exata']
+
+
+def test_file_order_breaks_ties():
+    rules = compile_rules([_rule('primeira', CFOP='5102'), _rule('segunda', CFOP='5102')])
+    debito, credito = rules.apply(_notes(CFOP_Principal=['5102']))
+    assert list(debito) == ['primeira']
+    assert list(credito) == ['C-primeira']
+
+
+def test_unmatched_rows_are_unmapped():
+    rules = compile_rules([_rule('venda', CFOP='5102')])
+    debito, credito = rules.apply(_notes(CFOP_Principal=['9999', '5102']))
+    assert list(debito) == [UNMAPPED_ACCOUNT, 'venda']
+    assert list(credito) == [UNMAPPED_ACCOUNT, 'C-venda']
+
+
+def test_cfop_range_and_formatted_keys():
+    rules = compile_rules([
+        _rule('faixa', CFOP='5101-5103'),
+        _rule('fornecedor', CNPJ_Emitente='12.345.678/0001-99', PRIORIDADE='5'),
+        _rule('ncm', NCM='7208.00.00'),
+    ])
+    notes = _notes(
+        CFOP_Principal=['5103', '5104', '1101'],
+        NCM_Principal=['', '72080000', ''],
+        Emissor_CNPJ=['', '', '12345678000199'],
+    )
+    debito, _ = rules.apply(notes)
+    assert list(debito) == ['faixa', 'ncm', 'fornecedor']
+
+
+def test_missing_key_columns_only_match_wildcards():
+    rules = compile_rules([_rule('por_ncm', NCM='7208*'), _rule('qualquer')])
+    debito, _ = rules.apply(_notes(CFOP_Principal=['5102']))
+    assert list(debito) == ['qualquer']
+
+
+@pytest.mark.parametrize('rule', [
+    _rule('x', CFOP='5*02'),
+    _rule('x', CFOP='5199-5101'),
+    {'CFOP': '5102', 'DEBITO': 'sem credito'},
+])
+def test_invalid_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        compile_rules([rule])
@@ -0,0 +1,74 @@
+# Consultas SQL locais: validação, sandbox somente leitura, limites de linhas e de tempo
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import sql_query
+from compact_dtypes import compact_lancamentos
+from sql_query import SQLQueryError, TABLE_NAME, extract_sql, get_database, run_query, validate_sql
+from tests.conftest import make_lancamentos
+
+
+@pytest.fixture
+def df():
+    compact, _ = compact_lancamentos(make_lancamentos(40))
+    return compact
+
+
+@pytest.mark.parametrize('sql', [
+    "DELETE FROM dados",
+    "DROP TABLE dados",
+    "SELECT 1; DROP TABLE dados",
+    "ATTACH DATABASE 'x.db' AS x",
+    "PRAGMA table_info(dados)",
+    "WITH x AS (SELECT 1) INSERT INTO dados SELECT * FROM x",
+    "SELECT * FROM read_csv('/etc/passwd')",
+    "",
+])
+def test_rejects_anything_but_a_single_select(sql):
+    with pytest.raises(SQLQueryError):
+        validate_sql(sql)
+
+
+def test_accepts_forbidden_words_inside_strings_and_comments():
+    sql = "SELECT COUNT(*) FROM dados WHERE Emissor <> 'drop; delete' -- update"
+    assert validate_sql(sql) == sql
+    assert extract_sql("Consulta:\n```sql\nSELECT 1;\n```") == "SELECT 1"
+
+
+def test_query_runs_on_values_in_reais(df):
+    result = run_query(df, f'SELECT CFOP_Principal, SUM(Valor_Lancamento) AS total FROM {TABLE_NAME} GROUP BY 1 ORDER BY 1')
+    expected = make_lancamentos(40).groupby('CFOP_Principal')['Valor_Lancamento'].sum().sort_index()
+    assert list(result['result']['CFOP_Principal']) == list(expected.index)
+    assert result['result']['total'].round(2).tolist() == expected.round(2).tolist()
+    assert not result['truncated']
+
+
+def test_result_is_truncated_at_max_rows(df):
+    result = run_query(df, f'SELECT * FROM {TABLE_NAME}', max_rows=5)
+    assert len(result['result']) == 5
+    assert result['truncated']
+
+
+@pytest.mark.skipif(sql_query.sql_engine_name() != 'sqlite', reason="autorizador específico do SQLite")
+def test_sqlite_authorizer_blocks_writes_that_bypass_validation(df):
+    database = get_database(df)
+    for sql in (f"DELETE FROM {TABLE_NAME}", f"UPDATE {TABLE_NAME} SET Emissor = 'x'", "ATTACH DATABASE ':memory:' AS x", "PRAGMA writable_schema = 1"):
+        with pytest.raises(sqlite3.DatabaseError):
+            database.execute(sql, 10, 5)
+    assert run_query(df, f'SELECT COUNT(*) AS n FROM {TABLE_NAME}')['result']['n'][0] == len(df)
+
+
+def test_long_queries_are_interrupted(df):
+    sql = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT MAX(i) FROM n"
+    with pytest.raises(SQLQueryError, match='interrompida'):
+        run_query(df, sql, timeout=0.2)
+
+
+def test_one_database_per_dataframe(df):
+    assert get_database(df) is get_database(df)
+    other = df.copy()
+    assert get_database(other) is not get_database(df)
+    assert isinstance(get_database(pd.DataFrame({'a': [1]})).schema_text(), str)
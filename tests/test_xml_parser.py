@@ -0,0 +1,74 @@
+# Equivalência do parser rápido de NF-e (parse_nfe_fast) com a implementação de referência
+
+from io import BytesIO
+
+import pytest
+
+from data_handler import parse_nfe_fast, parse_xml_to_dict
+
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+KEY = '35240312345678000199550010000000011000000019'
+
+
+def _det(n_item, cfop='5102', ncm='72080000', icms='<ICMS00><orig>0</orig><CST>00</CST></ICMS00>'):
+    return (
+        f'<det nItem="{n_item}"><prod><cProd>{n_item}</cProd><NCM>{ncm}</NCM><CFOP>{cfop}</CFOP></prod>'
+        f'<imposto><ICMS>{icms}</ICMS><PIS><PISAliq><CST>01</CST></PISAliq></PIS></imposto></det>'
+    )
+
+
+def _nfe(dets, ide='<ide><dhEmi>2024-03-05T10:30:00-03:00</dhEmi></ide>', total='100.50', wrap=True):
+    body = (
+        f'<infNFe Id="NFe{KEY}" versao="4.00">{ide}'
+        '<emit><CNPJ>12345678000199</CNPJ><xNome>Metalúrgica São João &amp; Cia</xNome></emit>'
+        '<dest><CNPJ>11222333000181</CNPJ><xNome>Cliente SA</xNome></dest>'
+        + ''.join(dets) +
+        f'<total><ICMSTot><vProd>{total}</vProd><vNF>{total}</vNF></ICMSTot></total></infNFe>'
+    )
+    xml = f'<NFe xmlns="{NFE_NS}">{body}</NFe>'
+    if wrap:
+        xml = f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="{NFE_NS}" versao="4.00">{xml}</nfeProc>'
+    return xml.encode('utf-8')
+
+
+SIMPLES = '<ICMSSN102><orig>0</orig><CSOSN>102</CSOSN></ICMSSN102>'
+
+FIXTURES = {
+    'um_item': _nfe([_det(1)]),
+    'varios_itens': _nfe([_det(i, cfop=str(5100 + i)) for i in range(1, 4)]),
+    # Mais de um bloco de leitura do parser rápido (64 KB)
+    'quinhentos_itens': _nfe([_det(i, cfop=str(5100 + i % 3)) for i in range(1, 501)]),
+    'simples_nacional': _nfe([_det(i, icms=SIMPLES) for i in range(1, 21)]),
+    # CST só no segundo item: a referência procura o primeiro CST do documento inteiro
+    'cst_no_segundo_item': _nfe([_det(1, icms=SIMPLES), _det(2)]),
+    'primeiro_item_sem_prod': _nfe(['<det nItem="1"><imposto/></det>', _det(2, cfop='6102', ncm='73089010')]),
+    'versao_antiga_dEmi': _nfe([_det(1)], ide='<ide><dEmi>2009-11-30</dEmi></ide>', wrap=False),
+    'sem_itens_e_sem_total': _nfe([], ide='<ide/>', total=''),
+    'vNF_vazio': _nfe([_det(1)], total=''),
+}
+
+
+@pytest.mark.parametrize('name', sorted(FIXTURES))
+def test_fast_parser_matches_reference(name):
+    xml = FIXTURES[name]
+    expected = parse_xml_to_dict(BytesIO(xml), f'{name}.xml')
+    assert expected is not None
+    assert parse_nfe_fast(BytesIO(xml), f'{name}.xml') == expected
+
+
+def test_fast_parser_reads_paths_from_disk(tmp_path):
+    path = tmp_path / 'nota.xml'
+    path.write_bytes(FIXTURES['varios_itens'])
+    assert parse_nfe_fast(str(path)) == parse_xml_to_dict(str(path))
+
+
+@pytest.mark.parametrize('xml', [
+    b'',
+    b'<NFe><infNFe Id="NFe1"></NFe>',
+    FIXTURES['varios_itens'][:-20],
+    f'<NFe xmlns="{NFE_NS}"><outro/></NFe>'.encode(),
+    f'<infNFe xmlns="{NFE_NS}" Id="NFe{KEY}"><det/></infNFe>'.encode(),
+])
+def test_fast_parser_rejects_what_reference_rejects(xml):
+    assert parse_xml_to_dict(BytesIO(xml), 'x.xml') is None
+    assert parse_nfe_fast(BytesIO(xml), 'x.xml') is None
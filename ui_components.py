@@ -0,0 +1,348 @@
+# ui_components.py - LançAI: Componentes de Interface (Prévia Paginada, Contadores, Auditoria Local e Jobs de Ingestão)
+
+import math
+from datetime import datetime
+import streamlit as st
+import pandas as pd
+import numpy as np
+from typing import Dict, Any, List, Tuple
+from llm_cache import dataframe_fingerprint
+from rules_engine import UNMAPPED_ACCOUNT
+from compact_dtypes import CENTS_COLUMN, expand_lancamentos, valor_em_reais
+from metrics import METRICS_ADMIN, metrics
+from audit import MAX_LISTED, build_audit_report
+from agent_brain import format_brl
+
+PAGE_SIZE_OPTIONS = (25, 50, 100, 250)
+# Colunas com filtro por seleção de valores (modo LançAI)
+SELECT_FILTER_COLUMNS = (('CFOP_Principal', 'CFOP'), ('Emissor', 'Emissor'))
+VALUE_COLUMN = 'Valor_Lancamento'
+# Rótulos do estado dos jobs de ingestão em segundo plano
+JOB_STATUS_LABELS = {'queued': "Na fila", 'running': "Processando", 'cancelled': "Cancelado"}
+
+
+def render_ingestion_job(job: Dict[str, Any]) -> bool:
+    """
+    Estado de um job de ingestão (ingestion_jobs.IngestionJob.snapshot()): progresso,
+    tempo decorrido e a última mensagem. Retorna True se o usuário pediu o cancelamento.
+    """
+    done, total, text = job['progress']
+    status = JOB_STATUS_LABELS.get(job['status'], job['status'])
+    if job['cancel_requested']:
+        status = "Cancelando"
+    label = f"{status} '{job['filename']}' ({job['elapsed']:.0f} s)"
+    if total:
+        label += f" - {text}: {done} de {total}"
+    st.progress(done / total if total else 0.0, text=label)
+
+    if job['messages']:
+        st.caption(job['messages'][-1][1])
+    return st.button(
+        "Cancelar processamento", key=f"cancelar_job_{job['id']}", disabled=job['cancel_requested'], type="secondary"
+    )
+
+
+def _has_values(df: pd.DataFrame) -> bool:
+    return VALUE_COLUMN in df.columns or CENTS_COLUMN in df.columns
+
+
+def get_data_version(df: pd.DataFrame) -> str:
+    """Versão dos dados carregados (hash do conteúdo), calculada uma única vez por DataFrame."""
+    cached = st.session_state.get('data_version')
+    if cached is None or cached[0] != id(df):
+        st.session_state['data_version'] = (id(df), dataframe_fingerprint(df))
+    return st.session_state['data_version'][1]
+
+
+def _cached_per_version(name: str, data_version: str, compute):
+    """Guarda na sessão um resultado calculado uma vez por versão dos dados."""
+    cache = st.session_state.setdefault('_ui_cache', {})
+    key = (name, data_version)
+    if key not in cache:
+        # Apenas a versão atual é mantida
+        for stale in [k for k in cache if k[0] == name]:
+            del cache[stale]
+        cache[key] = compute()
+    return cache[key]
+
+
+def compute_summary_counters(df: pd.DataFrame) -> Dict[str, Any]:
+    """Contadores do resumo: linhas, não mapeados e valor total (modo LançAI)."""
+    counters: Dict[str, Any] = {'linhas': len(df)}
+    if 'Conta_Debito' in df.columns:
+        unmapped = (df['Conta_Debito'] == UNMAPPED_ACCOUNT)
+        if 'Conta_Credito' in df.columns:
+            unmapped |= (df['Conta_Credito'] == UNMAPPED_ACCOUNT)
+        counters['nao_mapeados'] = int(unmapped.sum())
+    if _has_values(df):
+        counters['valor_total'] = float(valor_em_reais(df).sum())
+    return counters
+
+
+def get_summary_counters(df: pd.DataFrame) -> Dict[str, Any]:
+    """Contadores do resumo, calculados uma vez por versão dos dados."""
+    return _cached_per_version('counters', get_data_version(df), lambda: compute_summary_counters(df))
+
+
+def _filter_options(df: pd.DataFrame) -> Dict[str, Any]:
+    """Valores disponíveis para os filtros (calculados uma vez por versão dos dados)."""
+    options: Dict[str, Any] = {}
+    for column, _ in SELECT_FILTER_COLUMNS:
+        if column in df.columns:
+            options[column] = sorted(df[column].dropna().astype(str).unique().tolist())
+    if _has_values(df) and not df.empty:
+        values = valor_em_reais(df)
+        options['valor'] = (float(values.min()), float(values.max()))
+    return options
+
+
+def filter_dataframe(df: pd.DataFrame, filters: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Aplica os filtros e a ordenação no servidor (máscaras vetorizadas).
+    filters: CFOP_Principal/Emissor (listas), conta (texto), valor (mín., máx.),
+    nao_mapeados (bool), ordenar_por (coluna) e crescente (bool).
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column, _ in SELECT_FILTER_COLUMNS:
+        selected = filters.get(column)
+        if selected and column in df.columns:
+            mask &= df[column].astype(str).isin(selected).to_numpy()
+    account = (filters.get('conta') or '').strip()
+    if account:
+        account_mask = np.zeros(len(df), dtype=bool)
+        for column in ('Conta_Debito', 'Conta_Credito'):
+            if column in df.columns:
+                account_mask |= df[column].astype(str).str.contains(account, case=False, regex=False).to_numpy()
+        mask &= account_mask
+    value_range = filters.get('valor')
+    if value_range and _has_values(df):
+        values = valor_em_reais(df).to_numpy()
+        mask &= (values >= value_range[0]) & (values <= value_range[1])
+    if filters.get('nao_mapeados') and 'Conta_Debito' in df.columns:
+        unmapped = df['Conta_Debito'] == UNMAPPED_ACCOUNT
+        if 'Conta_Credito' in df.columns:
+            unmapped |= df['Conta_Credito'] == UNMAPPED_ACCOUNT
+        mask &= unmapped.to_numpy()
+
+    result = df if mask.all() else df[mask]
+    sort_column = filters.get('ordenar_por')
+    if sort_column and sort_column in result.columns:
+        result = result.sort_values(sort_column, ascending=filters.get('crescente', True), kind='stable')
+    return result
+
+
+def _freeze(filters: Dict[str, Any]) -> Tuple:
+    return tuple(sorted((k, tuple(v) if isinstance(v, (list, tuple)) else v) for k, v in filters.items()))
+
+
+def render_paginated_grid(df: pd.DataFrame, key: str, lancamentos_filters: bool = False) -> None:
+    """
+    Prévia paginada: apenas a página atual é enviada ao navegador. Filtros e ordenação
+    rodam no servidor; o resultado filtrado fica em cache até os filtros ou os dados mudarem.
+    """
+    data_version = get_data_version(df)
+    filters: Dict[str, Any] = {}
+
+    with st.container():
+        if lancamentos_filters:
+            options = _cached_per_version(f'{key}_options', data_version, lambda: _filter_options(df))
+            col_a, col_b, col_c = st.columns(3)
+            for (column, label), col in zip(SELECT_FILTER_COLUMNS, (col_a, col_b)):
+                if column in options:
+                    filters[column] = col.multiselect(label, options[column], key=f'{key}_{column}')
+            filters['conta'] = col_c.text_input("Conta (débito ou crédito) contém", key=f'{key}_conta')
+            col_d, col_e = st.columns([3, 1])
+            if 'valor' in options and options['valor'][0] < options['valor'][1]:
+                low, high = options['valor']
+                selected_range = col_d.slider(
+                    "Faixa de valor (R$)", min_value=math.floor(low), max_value=math.ceil(high),
+                    value=(math.floor(low), math.ceil(high)), key=f'{key}_valor'
+                )
+                if selected_range != (math.floor(low), math.ceil(high)):
+                    filters['valor'] = selected_range
+            filters['nao_mapeados'] = col_e.checkbox("Só não mapeados", key=f'{key}_nao_mapeados')
+
+        col_sort, col_order, col_size = st.columns([2, 1, 1])
+        filters['ordenar_por'] = col_sort.selectbox(
+            "Ordenar por", options=[None] + list(df.columns),
+            format_func=lambda c: "(ordem original)" if c is None else c, key=f'{key}_ordenar'
+        )
+        filters['crescente'] = col_order.radio("Ordem", ["Crescente", "Decrescente"], key=f'{key}_ordem', horizontal=True) == "Crescente"
+        page_size = col_size.selectbox("Linhas por página", PAGE_SIZE_OPTIONS, key=f'{key}_page_size')
+
+    # Resultado filtrado reaproveitado enquanto dados e filtros não mudarem (ex.: troca de página)
+    filter_key = (data_version, _freeze(filters))
+    cached = st.session_state.get(f'{key}_filtered')
+    if cached is None or cached[0] != filter_key:
+        cached = (filter_key, filter_dataframe(df, filters))
+        st.session_state[f'{key}_filtered'] = cached
+    filtered = cached[1]
+
+    total_pages = max(1, math.ceil(len(filtered) / page_size))
+    page = st.number_input(f"Página (de {total_pages})", min_value=1, max_value=total_pages, value=1, step=1, key=f'{key}_page')
+    page = min(int(page), total_pages)
+    start = (page - 1) * page_size
+    # Só a página exibida volta a ter os valores em reais
+    st.dataframe(expand_lancamentos(filtered.iloc[start:start + page_size]), use_container_width=True)
+
+    shown_end = min(start + page_size, len(filtered))
+    caption = f"Linhas {start + 1 if len(filtered) else 0}–{shown_end} de {len(filtered)}"
+    if len(filtered) != len(df):
+        caption += f" (filtradas de {len(df)})"
+    st.caption(caption)
+
+
+def get_audit_report(df: pd.DataFrame) -> Dict[str, Any]:
+    """Auditoria local: a calculada na ingestão (df.attrs) ou, na falta dela, uma vez por versão dos dados."""
+    report = df.attrs.get('auditoria')
+    if report is not None:
+        return report
+    return _cached_per_version('audit', get_data_version(df), lambda: build_audit_report(df))
+
+
+def _audit_table(items: List[Dict[str, Any]]) -> None:
+    df_items = pd.DataFrame(items)
+    for column in ('Valor', 'Mediana do Grupo'):
+        if column in df_items.columns:
+            df_items[column] = df_items[column].map(format_brl)
+    st.dataframe(df_items, use_container_width=True, hide_index=True)
+
+
+def render_audit_report(report: Dict[str, Any]) -> None:
+    """
+    Auditoria local (audit.build_audit_report): indicadores no topo e, recolhidos, os detalhes
+    de cada verificação. Exibida na hora, antes (e independentemente) da análise do LLM.
+    """
+    summary = report['resumo']
+    unmapped = report['nao_mapeados']
+    duplicates = report['chaves_duplicadas']
+    invalid = report['valores_invalidos']
+    outliers = report['outliers']
+
+    columns = st.columns(6)
+    columns[0].metric("Lançamentos", f"{summary['lancamentos']:,}".replace(',', '.'), help=f"{summary['notas']} notas de {summary['emitentes']} emitentes")
+    columns[1].metric("Valor Total", format_brl(summary['valor_total']))
+    columns[2].metric("Não Mapeados", unmapped['quantidade'], help=f"Valor: {format_brl(unmapped['valor'])}")
+    duplicates_help = f"{duplicates['linhas']} lançamentos com chave repetida"
+    if duplicates.get('removidas'):
+        duplicates_help += f"; {duplicates['removidas']} repetição(ões) descartada(s) na ingestão"
+    columns[3].metric("Chaves Repetidas", duplicates['quantidade'], help=duplicates_help)
+    columns[4].metric("Valores Zerados/Negativos", invalid['quantidade'])
+    columns[5].metric("Valores Atípicos", outliers['quantidade'], help="Desvio da mediana do CFOP ou do emitente, medido em MADs")
+    if summary['periodo']:
+        st.caption(f"Período das notas: {summary['periodo'][0]} a {summary['periodo'][1]}.")
+
+    if report['alertas'] == 0:
+        st.success("✅ Nenhuma pendência encontrada: todos os CFOPs têm regra, sem chaves repetidas, valores inválidos ou atípicos.")
+
+    if unmapped['quantidade']:
+        with st.expander(f"⚠️ CFOPs sem regra contábil ({unmapped['quantidade']} lançamentos)"):
+            _audit_table(unmapped['por_cfop'])
+            if unmapped['chaves']:
+                st.caption(f"Chaves de acesso afetadas (até {MAX_LISTED}):")
+                st.code('\n'.join(unmapped['chaves']), language=None)
+    sections = (
+        (duplicates, f"⚠️ Chaves de acesso repetidas ({duplicates['quantidade']})"),
+        (invalid, f"⚠️ Valores zerados ou negativos ({invalid['quantidade']})"),
+        (outliers, f"⚠️ Valores atípicos por CFOP/emitente ({outliers['quantidade']})"),
+    )
+    for section, title in sections:
+        if section['quantidade']:
+            with st.expander(title):
+                _audit_table(section['itens'])
+                if section['quantidade'] > len(section['itens']):
+                    st.caption(f"Exibindo {len(section['itens'])} de {section['quantidade']}.")
+
+    with st.expander("📊 Totais por Conta"):
+        col_debit, col_credit = st.columns(2)
+        with col_debit:
+            st.markdown("**Débito**")
+            _audit_table(report['totais_por_conta']['debito'])
+        with col_credit:
+            st.markdown("**Crédito**")
+            _audit_table(report['totais_por_conta']['credito'])
+
+
+# Consultas de cache exibidas no painel de diagnóstico: (rótulo da métrica, título)
+DIAGNOSTIC_CACHES = (('llm_response', 'Cache de respostas do LLM'), ('ingestion', 'Cache de uploads'))
+DIAGNOSTIC_RECENT_EVENTS = 20
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    return ', '.join(f"{name}={value}" for name, value in labels.items())
+
+
+def render_diagnostics_panel() -> None:
+    """
+    Painel de diagnóstico (recolhido): tempo por etapa do pipeline, acertos de cache,
+    tokens do LLM, contadores e os eventos mais recentes, com exportação em JSON lines
+    e no formato de texto do Prometheus (geradas só no clique do download).
+    """
+    with st.expander("🩺 Diagnóstico de Desempenho"):
+        if not metrics.enabled:
+            st.caption("Coleta de métricas desativada (LANCAI_METRICS=0).")
+            return
+        st.caption(
+            f"Métricas do processo (todas as sessões) desde {datetime.fromtimestamp(metrics.started_at):%d/%m/%Y %H:%M:%S}. "
+            "Etapas internas (ex.: parse_xml_members) também estão contidas no tempo da etapa que as chama (process_xml_files)."
+        )
+
+        stages = metrics.stage_table()
+        if stages:
+            df_stages = pd.DataFrame(stages).sort_values('Total (s)', ascending=False)
+            st.dataframe(df_stages, use_container_width=True, hide_index=True)
+        else:
+            st.caption("Nenhuma etapa medida ainda.")
+
+        columns = st.columns(len(DIAGNOSTIC_CACHES) + 1)
+        for (cache, title), col in zip(DIAGNOSTIC_CACHES, columns):
+            hits = metrics.counter_value('cache_requests_total', cache=cache, result='hit')
+            total = hits + metrics.counter_value('cache_requests_total', cache=cache, result='miss')
+            col.metric(title, f"{hits / total:.0%}" if total else "—", help=f"{int(hits)} acertos em {int(total)} consultas")
+        prompt_tokens = metrics.counter_value('llm_tokens_total', kind='prompt')
+        response_tokens = metrics.counter_value('llm_tokens_total', kind='response')
+        columns[-1].metric(
+            "Tokens do LLM (prompt / resposta)", f"{prompt_tokens:,.0f} / {response_tokens:,.0f}",
+            help="Informados pelo modelo quando disponíveis; caso contrário, estimados pelo tamanho do texto."
+        )
+
+        snapshot = metrics.snapshot()
+        if snapshot['counters']:
+            st.markdown("**Contadores**")
+            st.dataframe(
+                pd.DataFrame([
+                    {'Métrica': counter['name'], 'Rótulos': _format_labels(counter['labels']), 'Valor': counter['value']}
+                    for counter in snapshot['counters']
+                ]),
+                use_container_width=True, hide_index=True
+            )
+        events = metrics.recent_events(DIAGNOSTIC_RECENT_EVENTS)
+        if events:
+            st.markdown(f"**Últimas {len(events)} etapas**")
+            base_fields = ('ts', 'stage', 'seconds', 'status')
+            df_events = pd.DataFrame([
+                {
+                    'Horário': datetime.fromtimestamp(event['ts']).strftime('%H:%M:%S.%f')[:-3],
+                    'Etapa': event['stage'],
+                    'Duração (ms)': round(1000 * event['seconds'], 1),
+                    'Status': event['status'],
+                    'Detalhes': _format_labels({k: v for k, v in event.items() if k not in base_fields}),
+                }
+                for event in reversed(events)
+            ])
+            st.dataframe(df_events, use_container_width=True, hide_index=True)
+
+        # As exportações só são montadas no clique do download, não a cada rerun da página
+        col_jsonl, col_prom, col_reset = st.columns(3)
+        col_jsonl.download_button(
+            "Exportar métricas (JSON lines)", data=metrics.to_json_lines,
+            file_name="lancai_metricas.jsonl", mime="application/x-ndjson"
+        )
+        col_prom.download_button(
+            "Exportar métricas (Prometheus)", data=metrics.to_prometheus,
+            file_name="lancai_metricas.prom", mime="text/plain"
+        )
+        # Zerar afeta todas as sessões do processo: fica restrito a LANCAI_METRICS_ADMIN=1
+        if METRICS_ADMIN and col_reset.button("Zerar métricas (todas as sessões)"):
+            metrics.reset()
+            st.rerun()